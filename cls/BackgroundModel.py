@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import logging
+from collections import deque
+import cv2
+import numpy as np
+
+class BackgroundModel():
+    """ Base class of the background model for motion detection.
+    <apply> takes prepared (grayscale, blurred) image and returns (background image, difference image),
+    or None if there is not enough frames yet. Difference image is thresholded by motion detector.
+    Models with <is_batch> set only provide background image by <update>, so difference can be calculated
+    for many cameras at once (see MotionBatch)
+    """
+    is_batch = True
+
+    def __init__(self, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:BackgroundModel")
+        # mask of motion detection areas (set by motion detector), changes outside of it are ignored
+        self.mask = None
+
+    def apply(self, img_new):
+        img_bg = self.update(img_new)
+        if img_bg is None or img_bg is NotImplemented:
+            return None
+        return img_bg, cv2.absdiff(img_bg, img_new)
+
+    def update(self, img_new):
+        """ Abstract method, must be implementet inside derived classes (or derived class sets is_batch = False and implements <apply>)
+        Add image into the model. Returns background image to compare it with, or None if there is not enough frames yet
+        """
+        return NotImplemented
+
+    def on_motion(self):
+        """ Called when motion is detected on the latest applied image """
+        pass
+
+class FrameListBackground(BackgroundModel):
+    """ Background is the list of the last <frame_count> frames. New frame is compared with the oldest one,
+    and frames with motion are not kept in the list (if they differ from the last static frame more than <static_threshold>)
+    """
+    def __init__(self, frame_count, static_threshold, save_debug=None, logger_name='None'):
+        BackgroundModel.__init__(self, logger_name)
+        self.frames = deque(maxlen=max(frame_count, 2))
+        self.static_threshold = static_threshold
+        self.save_debug = save_debug
+        self.last_background = None
+
+    def update(self, img_new):
+        self.frames.append(img_new)
+        if len(self.frames) < 2:
+            return None
+        return self.frames[0]
+
+    def on_motion(self):
+        """ Check if the latest frame is static (compared with the last static frame), otherwise remove it from background """
+        if self.last_background is None and len(self.frames) >= 2:
+            self.last_background = self.frames[-2]
+        if not self.last_background is None:
+            img_delta = cv2.absdiff(self.last_background, self.frames[-1])
+            if not self.mask is None:
+                img_delta = cv2.bitwise_and(img_delta, self.mask)
+            _, dev_delta = cv2.meanStdDev(img_delta)
+            discard_background = dev_delta.max() > self.static_threshold
+            if not self.save_debug is None:
+                img_blank = np.zeros(img_delta.shape, np.uint8)
+                img_blank = cv2.putText(img_blank, f'IS BG: { not discard_background}', (10,10), cv2.FONT_HERSHEY_SIMPLEX,.3,(255, 0, 0) )
+                self.save_debug(self.frames[-1], self.last_background, img_delta, img_blank)
+            if discard_background:
+                self.frames.pop()
+        if len(self.frames) > 0:
+            self.last_background = self.frames[-1]
+
+class RunningAverageBackground(BackgroundModel):
+    """ Background is exponential running average of frames (cv2.accumulateWeighted) with <learning_rate>,
+    so slow lighting changes are absorbed into background
+    """
+    def __init__(self, learning_rate=0.05, logger_name='None'):
+        BackgroundModel.__init__(self, logger_name)
+        self.learning_rate = learning_rate
+        self.average = None
+
+    def update(self, img_new):
+        if self.average is None:
+            self.average = img_new.astype(np.float32)
+            return None
+        img_bg = cv2.convertScaleAbs(self.average)
+        cv2.accumulateWeighted(img_new, self.average, self.learning_rate)
+        return img_bg
+
+class SubtractorBackground(BackgroundModel):
+    """ OpenCV background subtractor (MOG2 or KNN). Difference image is the foreground mask (0 or 255 for each pixel).
+    <threshold> is the threshold of the subtractor itself (if None, then OpenCV default is used):
+        'mog2' - varThreshold: squared Mahalanobis distance of the pixel to the background model (default 16)
+        'knn'  - dist2Threshold: squared distance of the pixel value to the background samples (default 400)
+    """
+    is_batch = False
+
+    def __init__(self, method='mog2', history=100, threshold=None, learning_rate=-1, logger_name='None'):
+        BackgroundModel.__init__(self, logger_name)
+        self.learning_rate = learning_rate
+        if method == 'knn':
+            self.subtractor = cv2.createBackgroundSubtractorKNN(history=history, dist2Threshold=400 if threshold is None else threshold, detectShadows=False)
+        else:
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=16 if threshold is None else threshold, detectShadows=False)
+        self.cnt_frames = 0
+
+    def apply(self, img_new):
+        img_mask = self.subtractor.apply(img_new, learningRate=self.learning_rate)
+        self.cnt_frames += 1
+        if self.cnt_frames < 2:
+            return None
+        img_bg = self.subtractor.getBackgroundImage()
+        if img_bg is None:
+            img_bg = np.zeros(img_new.shape, np.uint8)
+        return img_bg, img_mask
+
+def create_background_model(cnfg, save_debug=None, logger_name='None'):
+    """ Create background model selected by <background_model> in <motion_detector> config group """
+    method = cnfg.motion_background_model
+    if method == 'average':
+        return RunningAverageBackground(cnfg.motion_background_learning_rate, logger_name=logger_name)
+    if method in ('mog2', 'knn'):
+        return SubtractorBackground(method, history=cnfg.motion_background_history, threshold=cnfg.motion_background_subtractor_threshold, logger_name=logger_name)
+    if method != 'frames':
+        logging.getLogger(f"{logger_name}:BackgroundModel").error(f"Unknown background model '{method}', using 'frames'")
+    return FrameListBackground(cnfg.motion_detector_bg_frame_count, cnfg.detect_by_diff_threshold, save_debug=save_debug, logger_name=logger_name)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os, logging
+import json
+import time
+from threading import Lock
+import concurrent.futures
+
+from cls.misc import get_stream_info, ping_ip
+
+class CameraProbe():
+    """ Probe service for camera streams: ping and ffprobe are run with timeouts in the pool of threads,
+    so all cameras are probed concurrently.
+    Stream info (frame shape and codec) is cached on disk, keyed by stream_url, so restarts of the daemon and recorders
+    do not wait for ffprobe. Cached info is returned immediately and revalidated in background
+    (at startup, and when it is older than <revalidate_interval> seconds)
+    """
+    def __init__(self, cnfg, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:CameraProbe")
+        self.cache_filename = cnfg.camera_probe_cache_filename
+        self.ping_timeout = cnfg.camera_probe_ping_timeout
+        self.timeout = cnfg.camera_probe_timeout
+        self.revalidate_interval = cnfg.camera_probe_revalidate_interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=cnfg.camera_probe_workers, thread_name_prefix='CameraProbe')
+        self._lock = Lock()
+        self._pending = {} # probes in progress: {stream_url: Future}
+        self.cache = read_cache(self.cache_filename)
+
+    def ping(self, ip):
+        return ping_ip(ip, self.ping_timeout)
+
+    def get_cached(self, stream_url):
+        with self._lock:
+            return self.cache.get(stream_url)
+
+    def probe(self, stream_url):
+        """ Start probing of the stream in background (if it is not started yet). Returns Future with stream info """
+        with self._lock:
+            future = self._pending.get(stream_url)
+            if future is None:
+                future = self._executor.submit(self._probe, stream_url)
+                self._pending[stream_url] = future
+            return future
+
+    def probe_all(self, stream_urls):
+        """ Probe (or revalidate cached info of) all streams concurrently """
+        return [self.probe(stream_url) for stream_url in stream_urls]
+
+    def _probe(self, stream_url):
+        try:
+            info = get_stream_info(stream_url, timeout=self.timeout)
+        except:
+            self.logger.exception(f"Can't probe stream: {stream_url}")
+            info = None
+        with self._lock:
+            self._pending.pop(stream_url, None)
+            if info is None:
+                return None
+            cached = self.cache.get(stream_url)
+            info['time'] = time.time()
+            self.cache[stream_url] = info
+            if cached is None or any(cached.get(key) != info[key] for key in ('height', 'width', 'channels', 'codec')):
+                self.logger.debug(f"Stream info is changed: {stream_url} {info}")
+            self._save()
+        return info
+
+    def _save(self):
+        """ Write cache file atomically (it is read by recorder processes) """
+        try:
+            os.makedirs(os.path.dirname(self.cache_filename) or '.', exist_ok=True)
+            filename_tmp = f'{self.cache_filename}.tmp'
+            with open(filename_tmp, 'w') as f:
+                json.dump(self.cache, f, indent=1)
+            os.replace(filename_tmp, self.cache_filename)
+        except OSError:
+            self.logger.exception(f"Can't save camera probe cache: {self.cache_filename}")
+
+    def get_stream_info(self, stream_url, refresh=False):
+        """ Returns stream info: cached (revalidated in background if it is outdated), or probed right now.
+        If <refresh> is set, then stream is probed again (i.e. recorder can't start with cached frame shape)
+        """
+        info = None if refresh else self.get_cached(stream_url)
+        if info is None:
+            try:
+                return self.probe(stream_url).result(timeout=self.timeout + 5)
+            except concurrent.futures.TimeoutError:
+                return None
+        if time.time() - info.get('time', 0) > self.revalidate_interval:
+            self.probe(stream_url)
+        return info
+
+    def stop(self):
+        self._executor.shutdown(wait=False)
+
+def read_cache(filename):
+    """ Returns cached stream info of all streams: {stream_url: dict(height, width, channels, codec, time)} """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def read_cached_stream_info(filename, stream_url):
+    """ Cached stream info (used by recorder, when frame shape is not provided) """
+    return read_cache(filename).get(stream_url)
@@ -0,0 +1,661 @@
+#!/usr/bin/env python
+
+import os, logging
+import numpy as np
+import cv2
+from subprocess import Popen, PIPE, TimeoutExpired
+from datetime import datetime
+from time import time
+import signal
+import shlex
+import hashlib
+import math
+import re
+import csv
+from threading import Thread, Event, Lock
+
+from cls.misc import get_frame_shape
+from cls.CameraProbe import read_cached_stream_info
+from cls.StorageManager import StorageManager
+from cls.StorageUsage import StorageUsage
+from cls.RAM_Storage import RAM_Storage
+from cls.FrameBuffer import FrameBuffer
+from cls.FramePool import FramePool, read_frame
+from cls.PipelineStage import PipelineStage
+from cls.PacketBuffer import PacketBuffer
+from cls.VideoIndex import VideoIndex
+
+class CameraRecorder():
+    """ Recorder of one camera: connects to video source stream, continuously takes snapshots and records into video file.
+    It is run by sxvrs_recorder.py (separate process for each camera) or by sxvrs_engine.py (several cameras in one process).
+    In <snapshot_mode> no video recording is done, only snapshots are taken.
+    Recording can be started and stopped at runtime by control commands, without reconnecting to the source stream.
+    Commands are received and events (video file, snapshot, stats) are sent thru the <channel> (see ControlChannel)
+    """
+    def __init__(self, cnfg_daemon, name, frame_shape=None, snapshot_mode=False, channel=None, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:{name}")
+        self.name = name
+        self.channel = channel
+        self.cnfg_daemon = cnfg_daemon
+        self.snapshot_mode = snapshot_mode
+        if name in cnfg_daemon.recorders:
+            self.cnfg = cnfg = cnfg_daemon.recorders[name]
+        else:
+            msg = f"Recorder '{name}' not found in config"
+            self.logger.error(msg)
+            raise ValueError(msg)
+        self.frame_shape = frame_shape
+        # In segmenting mode, video files are rotated on {record_time} boundaries without gaps
+        self.is_segments = cnfg.record_segments and not snapshot_mode
+        # In event recording mode, source stream is buffered in RAM and written into the file only on events from the watcher
+        self.is_event_mode = cnfg.is_record_event
+        # In stream copy mode, video file is written by the reader process itself, so recording can't be started at runtime
+        self.is_copy_mode = cnfg.is_record_stream_copy and not self.is_event_mode
+        # In encoding mode, video writer is attached to the reader when recording is started, and video files are rotated
+        # every {record_time} seconds, so the recorder process is never restarted
+        self.is_encode_mode = not self.is_copy_mode and not self.is_event_mode
+        # events to control recorder
+        self._stop_event = Event()
+        self._watcher_started_event = Event()
+        self._event_triggered_event = Event()
+        self._record_started_event = Event()
+        if cnfg.is_motion_detection:
+            self._watcher_started_event.set()
+        if not snapshot_mode:
+            self._record_started_event.set()
+        self.ffmpeg_read = None
+        self.ffmpeg_write = None # encoder process (attached only while recording)
+        self.ffmpeg_write_lock = Lock()
+        self.ffmpeg_write_finishing = [] # encoder processes of previous segments, which are finalizing their files
+        self._finishing_lock = Lock()
+        self.video_index = None # index file of the current video file
+        self.frames_written = 0 # count of frames written into the current video file (by encoder)
+        self.filename_video = None
+        self.segment_end_time = 0
+        self.event_writer = None
+        self.event_start_time = 0
+        self.event_end_time = 0
+        self.snap = 0
+        # size of frame files in RAM folder, which are not processed by the watcher yet (frame file is renamed on each stage)
+        self.ram_usage = StorageUsage(extensions=('.rec', '.wch', '.obj.wait', '.obj.start', '.obj.none', '.obj.found', '.obj.dropped'))
+        # frames are passed to the watcher not often than every <sampling_interval> seconds (it is adjusted by the watcher)
+        self.sampling_interval = 1 / cnfg.analysis_fps
+        self.sampled_time = 0
+        self.frame_hash_old = ''
+        self.compare_frame_width = None
+        self.compare_frame_height = None
+        self.cnt_reader_dropped = 0
+        self.frame_cnt = 0
+        self.pipeline_stages = []
+
+    def command(self, msg):
+        """ Handle control command from the daemon (see ControlChannel) """
+        cmd = msg.get('cmd')
+        if cmd == 'watch':
+            if msg.get('state'):
+                self._watcher_started_event.set()
+            else:
+                self._watcher_started_event.clear()
+        elif cmd == 'event':
+            self._event_triggered_event.set()
+        elif cmd == 'record':
+            if not msg.get('state'):
+                self._record_started_event.clear()
+                self.detach_video_writer()
+            elif self.is_copy_mode:
+                self.logger.warning("Video writer can't be attached at runtime in stream copy mode")
+            else:
+                self._record_started_event.set()
+        elif cmd == 'sampling':
+            self.sampling_interval = float(msg['interval'])
+            self.logger.debug(f"Analysis sampling interval: {self.sampling_interval} sec")
+        else:
+            self.logger.warning(f"Unknown command: {msg}")
+
+    def send_event(self, event, **fields):
+        """ Notify the daemon about recorder event """
+        if not self.channel is None:
+            self.channel.send_event(event, **fields)
+
+    def stop(self):
+        """ Stop recording gracefully (after the current frame is read) """
+        self._stop_event.set()
+
+    def kill(self):
+        """ Stop the reader process, if the source stream does not return frames """
+        self._stop_event.set()
+        if not self.ffmpeg_read is None and self.ffmpeg_read.poll() is None:
+            self.ffmpeg_read.kill()
+
+    def is_stopped(self):
+        return self._stop_event.is_set()
+
+    def get_cmd_ffmpeg_write(self, filename_video):
+        if self.scale != 1:
+            return self.cnfg.cmd_ffmpeg_write(filename=filename_video, height=self.new_height, width=self.new_width, pix_fmt=self.pix_fmt)
+        else:
+            return self.cnfg.cmd_ffmpeg_write(filename=filename_video, height=self.frame_height, width=self.frame_width, pix_fmt=self.pix_fmt)
+
+    def start_ffmpeg_write(self, cmd_ffmpeg_write):
+        self.logger.debug(f"Execute process to write frames:\n  {cmd_ffmpeg_write}")
+        return Popen(shlex.split(cmd_ffmpeg_write), stderr=None, stdout=None, stdin = PIPE, bufsize=self.frame_size*self.cnfg.ffmpeg_buffer_frames)
+
+    def close_video_index(self):
+        # reference is taken once, as index can be closed or replaced from the other thread (event clips, segments)
+        video_index, self.video_index = self.video_index, None
+        if not video_index is None:
+            video_index.close()
+
+    def start_next_segment(self, filename, start_time=None):
+        """ Announce new video file (segmenting mode) and cleanup storage in background """
+        self.filename_video = filename
+        self.frames_written = 0
+        if self.cnfg.is_video_index:
+            # index file is created before announcing the video file, so the watcher can append to it
+            video_index_old = self.video_index
+            self.video_index = VideoIndex(f'{filename}.idx', start_time=start_time or time(), logger_name=self.logger.name)
+            if not video_index_old is None:
+                video_index_old.close()
+        self.logger.info(f'Start record filename: <{self.filename_video}>')
+        self.send_event('segment_opened', filename=self.filename_video, time=start_time or time())
+        Thread(target=self.storage.cleanup).start()
+
+    def attach_video_writer(self):
+        """ Start encoder process for the new video file (recording is started) """
+        if self.is_segments:
+            self.segment_end_time = (math.floor(time() / self.cnfg.record_time) + 1) * self.cnfg.record_time
+        else:
+            self.segment_end_time = time() + self.cnfg.record_time
+        filename = self.cnfg.filename_video()
+        self.storage.force_create_file_path(filename)
+        self.ffmpeg_write = self.start_ffmpeg_write(self.get_cmd_ffmpeg_write(filename))
+        self.start_next_segment(filename)
+
+    def detach_video_writer(self):
+        """ Stop recording without stopping the reader.
+        Encoder finalizes its file on the end of input, event clip is finished on the next keyframe
+        """
+        self.event_end_time = 0
+        with self.ffmpeg_write_lock:
+            if self.ffmpeg_write is None:
+                return
+            self.logger.info(f'Finish record filename: <{self.filename_video}>')
+            self.send_event('segment_closed', filename=self.filename_video, frames=self.frames_written)
+            self.ffmpeg_write.stdin.close()
+            self.add_finishing_writer(self.ffmpeg_write)
+            self.ffmpeg_write = None
+            self.close_video_index()
+
+    def rotate_video_file(self):
+        """ Switch encoder to the new video file (every {record_time} seconds).
+        New encoder process is started, and the old one finalizes its file on the end of input
+        """
+        filename = self.cnfg.filename_video(datetime=datetime.fromtimestamp(self.segment_end_time))
+        self.storage.force_create_file_path(filename)
+        ffmpeg_write_old = self.ffmpeg_write
+        self.send_event('segment_closed', filename=self.filename_video, frames=self.frames_written)
+        self.ffmpeg_write = self.start_ffmpeg_write(self.get_cmd_ffmpeg_write(filename))
+        self.segment_end_time += self.cnfg.record_time
+        self.start_next_segment(filename)
+        ffmpeg_write_old.stdin.close()
+        self.add_finishing_writer(ffmpeg_write_old)
+
+    def add_finishing_writer(self, proc):
+        """ Keep encoder process, which is finalizing its file (input is closed), and reap already finished ones """
+        with self._finishing_lock:
+            self.ffmpeg_write_finishing = [p for p in self.ffmpeg_write_finishing if p.poll() is None]
+            self.ffmpeg_write_finishing.append(proc)
+
+    def run_segment_list_loop(self):
+        """ Announce files of ffmpeg segment muxer: the first one when it is created,
+        and the next one when the previous is finished (read from the list of finished segments, CSV: filename,start,end)
+        """
+        filename = self.find_segment_file(self.segments_start_time, timeout=self.cnfg_daemon.camera_probe_timeout)
+        if not filename is None:
+            self.start_next_segment(filename)
+        with os.fdopen(self.segment_list_fd_read, 'r') as segment_list:
+            for row in csv.reader(segment_list):
+                if len(row) == 0:
+                    continue
+                self.logger.debug(f'Segment finished: {row}')
+                # list has only base name of the file, it is in the folder of the announced file
+                filename = os.path.join(os.path.dirname(self.filename_video), os.path.basename(row[0]))
+                if filename != self.filename_video and not self.filename_video is None:
+                    self.logger.warning(f'Finished segment <{filename}> is not the announced one <{self.filename_video}>')
+                self.send_event('segment_closed', filename=filename)
+                self.create_segment_folders()
+                filename = self.find_segment_file(time() - 2, exclude=filename)
+                if not filename is None:
+                    self.start_next_segment(filename)
+
+    def create_segment_folders(self):
+        """ ffmpeg does not create folders for segment files, so folders of the current and the next segment are created in advance """
+        for timestamp in (time(), time() + self.cnfg.record_time):
+            self.storage.force_create_file_path(self.cnfg.filename_video(datetime=datetime.fromtimestamp(timestamp)))
+
+    def find_segment_file(self, time_from, timeout=5, exclude=None):
+        """ Name of the segment file opened by ffmpeg after <time_from> (ffmpeg names it by the clock with precision of one second).
+        Waits up to <timeout> seconds for the file, otherwise returns the name for <time_from> (or None if recorder is stopped)
+        """
+        time_from = math.floor(time_from)
+        deadline = time() + timeout
+        while True:
+            # the newest file first
+            for timestamp in range(math.ceil(time()) + 1, time_from - 1, -1):
+                filename = datetime.fromtimestamp(timestamp).strftime(self.filename_segments)
+                if filename != exclude and os.path.isfile(filename):
+                    return filename
+            if self._stop_event.wait(0.2):
+                return None # the last segment is finished
+            if time() >= deadline:
+                break
+        filename = datetime.fromtimestamp(time_from).strftime(self.filename_segments)
+        self.logger.warning(f'Segment file is not found, assuming <{filename}>')
+        return filename
+
+    def start_event_clip(self, timestamp):
+        """ Start new video file for event recording """
+        filename = self.cnfg.filename_video(datetime=datetime.fromtimestamp(timestamp))
+        self.storage.force_create_file_path(filename)
+        cmd_ffmpeg_event_write = self.cnfg.cmd_ffmpeg_event_write(filename=filename)
+        self.logger.debug(f"Execute process to write event:\n  {cmd_ffmpeg_event_write}")
+        self.event_writer = Popen(shlex.split(cmd_ffmpeg_event_write), stderr=None, stdout=None, stdin=PIPE)
+        self.event_start_time = time()
+        self.start_next_segment(filename, start_time=timestamp)
+
+    def stop_event_clip(self):
+        """ Finish video file for event recording (ffmpeg finalizes the file on the end of input) """
+        self.logger.info(f'Finish event recording: <{self.filename_video}> ({time() - self.event_start_time:.1f} sec)')
+        self.send_event('segment_closed', filename=self.filename_video)
+        self.event_writer.stdin.close()
+        self.add_finishing_writer(self.event_writer)
+        self.event_writer = None
+        self.close_video_index()
+
+    def run_packet_loop(self):
+        """ Keep source stream packets in RAM buffer. On event write buffered packets into the file,
+        and continue writing until {post_record_time} after the last event
+        """
+        cnfg = self.cnfg
+        packet_buffer = PacketBuffer(cnfg.event_pre_record_time, logger_name=self.logger.name)
+        with os.fdopen(self.packets_fd_read, 'rb', buffering=0) as packets_pipe:
+            while True:
+                data = packets_pipe.read(188*512)
+                if not data:
+                    break
+                now = time()
+                is_event = self._event_triggered_event.is_set()
+                if is_event:
+                    self._event_triggered_event.clear()
+                # events are ignored while recording is stopped
+                if is_event and self._record_started_event.is_set():
+                    self.event_end_time = max(self.event_end_time, now + cnfg.event_post_record_time)
+                    if self.event_writer is None:
+                        self.start_event_clip(packet_buffer.start_time() or now)
+                        self.event_writer.stdin.write(packet_buffer.get_data())
+                for is_keyframe, chunk in packet_buffer.append(data, now):
+                    # files are finished and started on keyframes, so they can be decoded from the beginning
+                    if is_keyframe and not self.event_writer is None and (now >= self.event_end_time or now - self.event_start_time >= cnfg.record_time):
+                        self.stop_event_clip()
+                    if is_keyframe and self.event_writer is None and now < self.event_end_time:
+                        self.start_event_clip(now)
+                    if not self.event_writer is None:
+                        self.event_writer.stdin.write(chunk)
+        if not self.event_writer is None:
+            self.stop_event_clip()
+
+    def save_frame_for_watcher(self, frame_np, frame_num, convert=None):
+        """ Pass frame to the watcher thru RAM folder (or shared memory ring buffer), checking for free RAM and duplicated frames.
+        <convert> is color conversion needed to get BGR frame (None if frame is already in BGR)
+        """
+        cnfg = self.cnfg
+        # analysis rate is controlled by the watcher (sampling interval), this is only the last line of defence
+        tmp_size = self.ram_usage.get_size()
+        if tmp_size > cnfg.throttling_max_mem_size:
+            self.logger.error(f"Can't save frame to temporary RAM folder. There are too many files for recorder: {cnfg.name}.\n Size occupied: {tmp_size}\n Max size: {cnfg.throttling_max_mem_size}")
+        else:
+            # Need to compare hash of the frame to detect duplicated frames
+            # but first, make frame significantly smaller (like simple motion detection)
+            height, width, channels = frame_np.shape
+            if width <= cnfg.frame_comparing_width:
+                frame_compare = frame_np
+            else:
+                if self.compare_frame_width is None:
+                    compare_scale = cnfg.frame_comparing_width / width
+                    self.compare_frame_width = math.floor(width * compare_scale)
+                    self.compare_frame_height = math.floor(height * compare_scale)
+                frame_compare = cv2.resize(frame_np, (self.compare_frame_width, self.compare_frame_height))
+            frame_hash = hashlib.sha1(frame_compare).hexdigest()
+            if frame_hash != self.frame_hash_old:
+                self.frame_hash_old = frame_hash
+                if not self.frame_buffer is None:
+                    # put frame into shared memory ring buffer (color conversion is done directly into the slot)
+                    self.frame_buffer.write(frame_np, frame_num, convert=convert)
+                else:
+                    temp_frame_file = cnfg.filename_temp(temp_storage_path=self.ram_storage.storage_path, frame_num=frame_num)
+                    # save frame into RAM snapshot file
+                    if not convert is None:
+                        frame_np = cv2.cvtColor(frame_np, convert)
+                    cv2.imwrite(f'{temp_frame_file}.bmp', frame_np)
+                    os.rename(f'{temp_frame_file}.bmp', f'{temp_frame_file}.rec')
+                    self.ram_usage.add(temp_frame_file, frame_np.nbytes)
+                self.snap += 1
+
+    def is_sampled(self, frame_time):
+        """ Returns True if the frame must be passed to the watcher (frames are sampled every {sampling_interval} seconds) """
+        if frame_time - self.sampled_time < self.sampling_interval:
+            return False
+        # keep the rate without drift, but do not try to catch up after a pause
+        self.sampled_time = max(self.sampled_time + self.sampling_interval, frame_time - self.sampling_interval)
+        return True
+
+    def run_analysis_loop(self):
+        """ Read low resolution frames from the additional ffmpeg output (they are already scaled and fps limited) and pass them to the watcher"""
+        j = 0
+        frame_np = np.empty(self.analysis_shape, np.uint8)
+        with os.fdopen(self.analysis_fd_read, 'rb', buffering=self.analysis_frame_size*self.cnfg.ffmpeg_buffer_frames) as analysis_pipe:
+            while not self._stop_event.is_set():
+                if not read_frame(analysis_pipe, frame_np):
+                    self.logger.debug("Analysis stream is closed")
+                    break
+                if self._watcher_started_event.is_set() and self.is_sampled(time()):
+                    self.save_frame_for_watcher(frame_np, j, convert=None)
+                j += 1
+
+    def process_snapshot(self, frame_np):
+        """ Snapshot stage: encode snapshot into JPEG file in background """
+        if self.snapshot_scale < 1:
+            frame_np = cv2.resize(frame_np, self.snapshot_size, interpolation=cv2.INTER_AREA)
+        if not self.convert_to_bgr is None:
+            frame_np = cv2.cvtColor(frame_np, self.convert_to_bgr)
+        filename_snapshot = self.cnfg.filename_snapshot()
+        cv2.imwrite(filename_snapshot, frame_np)
+        self.logger.info(f'Snapshot filename: <{filename_snapshot}>')
+        self.send_event('snapshot', filename=filename_snapshot)
+
+    def process_analysis(self, frame_np, frame_num):
+        """ Analysis stage: pass frame to the watcher """
+        self.save_frame_for_watcher(frame_np, frame_num, convert=self.convert_to_bgr)
+
+    def process_encoder(self, frame_np, frame_num, timestamp):
+        """ Encoder stage: write frame into video file """
+        with self.ffmpeg_write_lock:
+            if not self._record_started_event.is_set():
+                return # frame was queued before recording is stopped
+            if self.ffmpeg_write is None:
+                self.attach_video_writer()
+            elif time() >= self.segment_end_time:
+                self.rotate_video_file()
+            self.ffmpeg_write.stdin.write(frame_np.data)
+            video_index = self.video_index
+            if not video_index is None:
+                video_index.add_frame(frame_num, timestamp, pts=None if self.write_fps is None else self.frames_written / self.write_fps)
+            self.frames_written += 1
+
+    def log_pipeline_stats(self, level=logging.DEBUG):
+        self.logger.log(level, f"Pipeline stats: reader: read={self.frame_cnt} dropped={self.cnt_reader_dropped} | " +
+                          " | ".join(str(stage.stats()) for stage in self.pipeline_stages))
+
+    def send_stats(self, fps=None):
+        """ Send counters of the reader and pipeline stages to the daemon """
+        self.send_event('stats', fps=fps, read=self.frame_cnt, dropped=self.cnt_reader_dropped, snap=self.snap,
+                        sampling_interval=self.sampling_interval, stages=[stage.stats() for stage in self.pipeline_stages])
+
+    def init_frame_shape(self):
+        """ Calculate frame sizes (frame shape is detected by ffprobe, if it is not provided).
+        Returns False if frame shape can not be detected
+        """
+        cnfg = self.cnfg
+        frame_shape = self.frame_shape
+        # calculate frame_size
+        if frame_shape is None or None in frame_shape:
+            # frame shape is probed by the daemon and cached on disk, so ffprobe is run only if cache is empty
+            info = read_cached_stream_info(self.cnfg_daemon.camera_probe_cache_filename, cnfg.stream_url())
+            if info is None:
+                frame_shape = get_frame_shape(cnfg.stream_url(), timeout=self.cnfg_daemon.camera_probe_timeout)
+            else:
+                frame_shape = (info['height'], info['width'], info['channels'])
+            if frame_shape is None:
+                self.logger.error(f"Can't detect frame shape of the stream (ffprobe is failed or not finished in {self.cnfg_daemon.camera_probe_timeout} sec): {cnfg.stream_url()}")
+                return False
+        self.frame_height, self.frame_width, self.frame_ch = frame_shape
+        self.frame_size = self.frame_height * self.frame_width * self.frame_ch
+        self.logger.debug(f"frame_shape = ({self.frame_height}, {self.frame_width}, {self.frame_ch})    frame_size = {self.frame_size}")
+        # calculate resized values (if it is needed to resize)
+        if cnfg.resize_frame:
+            if self.frame_height > cnfg.resize_frame_height:
+                scale_height = cnfg.resize_frame_height / self.frame_height
+            else:
+                scale_height = 1
+            if self.frame_width > cnfg.resize_frame_width:
+                scale_width = cnfg.resize_frame_width / self.frame_width
+            else:
+                scale_width = 1
+            self.scale = min(scale_height, scale_width)
+            self.new_height = round(self.frame_height * self.scale)
+            self.new_width = round(self.frame_width * self.scale)
+        else:
+            self.scale = 1
+        # Low resolution and low fps frames for the watcher can be produced by ffmpeg itself, as additional output
+        self.is_analysis_stream = cnfg.is_analysis_stream
+        if self.is_analysis_stream:
+            analysis_scale = min(cnfg.analysis_stream_width / self.frame_width, cnfg.analysis_stream_height / self.frame_height, 1)
+            self.analysis_shape = (round(self.frame_height * analysis_scale), round(self.frame_width * analysis_scale), self.frame_ch)
+            self.analysis_frame_size = self.analysis_shape[0] * self.analysis_shape[1] * self.analysis_shape[2]
+            self.logger.debug(f"analysis_shape = {self.analysis_shape}    analysis_frame_size = {self.analysis_frame_size}    fps = {cnfg.analysis_stream_fps}")
+        return True
+
+    def run(self):
+        """ Connect to the source stream and process frames until recorder is stopped or the stream is finished.
+        Returns exit code (not 0 if recorder can not be started)
+        """
+        cnfg = self.cnfg
+        dt_start = datetime.now()
+        if not self.init_frame_shape():
+            return 1
+        # Mount RAM storage disk
+        self.ram_storage = RAM_Storage(self.cnfg_daemon, logger_name = self.logger.name)
+        # Shared memory ring buffer to pass frames to the watcher (instead of image files in RAM folder)
+        if cnfg.frame_buffer_slots > 0:
+            if self.is_analysis_stream:
+                frame_buffer_shape = self.analysis_shape
+            elif self.scale != 1:
+                frame_buffer_shape = (self.new_height, self.new_width, self.frame_ch)
+            else:
+                frame_buffer_shape = (self.frame_height, self.frame_width, self.frame_ch)
+            self.frame_buffer = FrameBuffer(cnfg.filename_frame_buffer(temp_storage_path=self.ram_storage.storage_path), name=cnfg.name,
+                                shape=frame_buffer_shape, slots=cnfg.frame_buffer_slots, create=True, logger_name=self.logger.name)
+        else:
+            self.frame_buffer = None
+        # Maintain Storage for the recorded files:
+        self.storage = StorageManager(cnfg.storage_path(), cnfg.storage_max_size, logger_name = self.logger.name)
+        self.storage.cleanup()
+        # Force create path for snapshot
+        self.storage.force_create_file_path(cnfg.filename_snapshot())
+        pass_fds = ()
+        if self.is_event_mode:
+            self.logger.debug("Event recording mode detected: video file is recorded only on events from the watcher")
+            self.packets_fd_read, packets_fd_write = os.pipe()
+            pass_fds += (packets_fd_write,)
+            cmd_ffmpeg_read = cnfg.cmd_ffmpeg_read() + ' ' + cnfg.cmd_ffmpeg_packets(fd=packets_fd_write)
+        elif self.is_copy_mode and not self.snapshot_mode:
+            # single ffmpeg process copies source stream into the video file (without re-encoding) and decodes frames for snapshots and watcher
+            self.logger.debug("Stream copy mode detected: source stream is written into video file as is")
+            if self.is_segments:
+                # ffmpeg segment muxer rotates files and names them by the clock (-strftime 1), list of finished segments is written into separate pipe.
+                # Files are announced by segment list thread, as names are known only when ffmpeg creates them
+                self.filename_segments = cnfg.filename_video_strftime()
+                self.segments_start_time = time()
+                self.create_segment_folders()
+                self.segment_list_fd_read, segment_list_fd_write = os.pipe()
+                pass_fds += (segment_list_fd_write,)
+                cmd_ffmpeg_read = cnfg.cmd_ffmpeg_copy_segments(filename=self.filename_segments, fd=segment_list_fd_write)
+            else:
+                # Force create path for video file
+                self.filename_video = cnfg.filename_video()
+                self.storage.force_create_file_path(self.filename_video)
+                cmd_ffmpeg_read = cnfg.cmd_ffmpeg_copy(filename=self.filename_video)
+                self.logger.info(f'Start record filename: <{self.filename_video}>')
+                self.send_event('segment_opened', filename=self.filename_video, time=time())
+        else:
+            if self.snapshot_mode:
+                self.logger.debug("Snapshot mode detected: continuously take snapshots from source stream, until recording is started")
+            cmd_ffmpeg_read = cnfg.cmd_ffmpeg_read()
+        # OpenCV works with BGR frames, so if ffmpeg is not asked for bgr24, then frames must be converted
+        pix_fmt = re.search(r'-pix_fmt\s+(\w+)', cmd_ffmpeg_read)
+        self.pix_fmt = 'rgb24' if pix_fmt is None else pix_fmt.group(1)
+        self.convert_to_bgr = None if self.pix_fmt == 'bgr24' else cv2.COLOR_RGB2BGR
+        # frame rate of the encoded video, to calculate pts of the frames in the video index
+        self.write_fps = None
+        if self.is_encode_mode:
+            write_fps = re.search(r'-r\s+([\d.]+)', self.get_cmd_ffmpeg_write('') or '')
+            self.write_fps = None if write_fps is None else float(write_fps.group(1))
+        if self.is_analysis_stream:
+            # additional ffmpeg output is written into separate pipe, which is inherited by ffmpeg process
+            self.analysis_fd_read, analysis_fd_write = os.pipe()
+            cmd_ffmpeg_read += ' ' + cnfg.cmd_ffmpeg_analysis(fd=analysis_fd_write, width=self.analysis_shape[1], height=self.analysis_shape[0], fps=cnfg.analysis_stream_fps)
+            pass_fds += (analysis_fd_write,)
+        self.logger.debug(f"Execute process to read frames:\n   {cmd_ffmpeg_read}")
+        self.ffmpeg_read = Popen(shlex.split(cmd_ffmpeg_read), stdout = PIPE, bufsize=self.frame_size*cnfg.ffmpeg_buffer_frames, pass_fds=pass_fds)
+        for fd in pass_fds:
+            os.close(fd)
+
+        thread_packets = None
+        thread_analysis = None
+        i = 0
+        # cleanup (stop stages and threads, signal ffmpeg) is done on any error, otherwise recorder process is not finished
+        try:
+            if self.is_segments and cnfg.is_record_stream_copy and not self.is_event_mode:
+                thread_segment_list = Thread(target=self.run_segment_list_loop)
+                thread_segment_list.daemon = True
+                thread_segment_list.start()
+            if self.is_event_mode:
+                thread_packets = Thread(target=self.run_packet_loop)
+                thread_packets.start()
+            if self.is_analysis_stream:
+                thread_analysis = Thread(target=self.run_analysis_loop)
+                thread_analysis.start()
+
+            # Pipeline: reader (main loop) -> analysis stage (watcher), snapshot stage (JPEG files) and encoder stage (video file)
+            # frames are read into preallocated buffers (no memory allocation per frame) and shared between stages
+            if self.scale != 1:
+                frame_pool_shape = (self.new_height, self.new_width, self.frame_ch)
+            else:
+                frame_pool_shape = (self.frame_height, self.frame_width, self.frame_ch)
+            # optional downscale of snapshots (never upscale)
+            if cnfg.snapshot_resize:
+                self.snapshot_scale = min([1] + [size / frame_size for size, frame_size in 
+                            ((cnfg.snapshot_width, frame_pool_shape[1]), (cnfg.snapshot_height, frame_pool_shape[0])) if not size is None])
+                self.snapshot_size = (round(frame_pool_shape[1] * self.snapshot_scale), round(frame_pool_shape[0] * self.snapshot_scale))
+            else:
+                self.snapshot_scale = 1
+            frame_pool_size = cnfg.frame_pool_size
+            if frame_pool_size is None:
+                # +1 for snapshot stage
+                frame_pool_size = cnfg.encoder_queue_size + cnfg.analysis_queue_size + 3
+            frame_pool = FramePool(frame_pool_shape, size=frame_pool_size, logger_name=self.logger.name)
+            frame_raw = np.empty((self.frame_height, self.frame_width, self.frame_ch), np.uint8)
+            release_frame = lambda item: frame_pool.release(item[0])
+            stage_analysis = PipelineStage('analysis', self.process_analysis, queue_size=cnfg.analysis_queue_size,
+                                drop_policy='oldest', release=release_frame, logger_name=self.logger.name)
+            stage_analysis.start()
+            # snapshot encoding never blocks other stages, and the latest frame always wins
+            stage_snapshot = PipelineStage('snapshot', self.process_snapshot, queue_size=1,
+                                drop_policy='oldest', release=release_frame, logger_name=self.logger.name)
+            stage_snapshot.start()
+            self.pipeline_stages = [stage_analysis, stage_snapshot]
+            if self.is_encode_mode:
+                stage_encoder = PipelineStage('encoder', self.process_encoder, queue_size=cnfg.encoder_queue_size,
+                                drop_policy='newest', release=release_frame, logger_name=self.logger.name)
+                stage_encoder.start()
+                self.pipeline_stages.append(stage_encoder)
+            else:
+                stage_encoder = None
+            snapshot_taken_time = 0
+            stats_time = time()
+            stats_frame_cnt = 0
+            while not self._stop_event.is_set():
+                # reader never waits for other stages: if there is no free frame in the pool, then frame is dropped
+                frame_np = frame_pool.acquire(timeout=0)
+                if self.scale == 1 and not frame_np is None:
+                    frame_read = frame_np
+                else:
+                    frame_read = frame_raw
+                if not read_frame(self.ffmpeg_read.stdout, frame_read):
+                    if not frame_np is None:
+                        frame_pool.release(frame_np)
+                    self.logger.error("Received zero length frame. exiting recording loop..")
+                    break
+                frame_time = time()
+                # index can be closed or replaced by the other thread (writing to the closed index is ignored)
+                video_index = self.video_index
+                if not self.is_encode_mode and not video_index is None:
+                    # frame is written into video file by ffmpeg itself, so pts is estimated by wallclock
+                    video_index.add_frame(i, frame_time)
+                if frame_np is None:
+                    self.cnt_reader_dropped += 1
+                    if self.cnt_reader_dropped % 100 == 1:
+                        self.logger.warning(f"No free frames in the pool, frame is dropped ({self.cnt_reader_dropped})")
+                else:
+                    # resize frame if needed
+                    if self.scale != 1:
+                        cv2.resize(frame_raw, (self.new_width, self.new_height), dst=frame_np)
+                    # take snapshot and process frame in RAM folder (if there is no separate analysis stream)
+                    is_snapshot = time() - snapshot_taken_time > cnfg.snapshot_time
+                    is_watch = not self.is_analysis_stream and self._watcher_started_event.is_set() and self.is_sampled(frame_time)
+                    if is_snapshot:
+                        snapshot_taken_time = time()
+                        frame_pool.retain(frame_np)
+                        stage_snapshot.put((frame_np,))
+                    if is_watch:
+                        frame_pool.retain(frame_np)
+                        stage_analysis.put((frame_np, i))
+                    # save frame to video file
+                    if not stage_encoder is None and self._record_started_event.is_set():
+                        frame_pool.retain(frame_np)
+                        if not stage_encoder.put((frame_np, i, frame_time)) and stage_encoder.cnt_dropped % 100 == 1:
+                            self.logger.warning(f"Encoder is too slow, frame is dropped ({stage_encoder.cnt_dropped})")
+                    frame_pool.release(frame_np)
+                if frame_time - stats_time >= cnfg.send_status_interval:
+                    self.send_stats(fps=round((i - stats_frame_cnt) / (frame_time - stats_time), 2))
+                    stats_time = frame_time
+                    stats_frame_cnt = i
+                dt_end = datetime.now()
+                # only in stream copy mode, recorder process is restarted to start the next video file
+                if self.is_copy_mode and not (self.is_segments or self.snapshot_mode) and (dt_end - dt_start).total_seconds() >= cnfg.record_time:
+                    break
+                i += 1
+                self.frame_cnt = i
+            if not self.filename_video is None:
+                self.logger.debug(f"Finish recording to {self.filename_video} wrote {i}/{self.snap} frames")
+        except (KeyboardInterrupt, SystemExit):
+            self.logger.info("[CTRL+C detected] MainLoop")
+        finally:
+            self._stop_event.set()
+            # finish processing of queued frames
+            for stage in self.pipeline_stages:
+                stage.stop(timeout=5)
+            self.log_pipeline_stats(logging.INFO)
+            self.send_stats()
+            self.detach_video_writer()
+            if not self.ffmpeg_read is None and self.ffmpeg_read.poll() is None:
+                self.ffmpeg_read.send_signal(signal.SIGINT)
+            if not thread_analysis is None:
+                thread_analysis.join(timeout=5)
+            if not thread_packets is None:
+                thread_packets.join(timeout=5)
+            for proc in self.ffmpeg_write_finishing:
+                try:
+                    proc.wait(timeout=30)
+                except TimeoutExpired:
+                    self.logger.warning(f'Video writer is not finished in time, killing it (pid={proc.pid})')
+                    proc.kill()
+            self.close_video_index()
+            if not self.frame_buffer is None:
+                self.frame_buffer.close()
+            if not self.ffmpeg_read is None:
+                try:
+                    self.ffmpeg_read.wait(timeout=30)
+                except TimeoutExpired:
+                    self.ffmpeg_read.kill()
+        return 0
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 """ Camera Instance
-It runs separate thread for recording in a loop and run additional separate thread for watcher loop
+Recorder process and watcher of all cameras are supervised by single asyncio event loop (RecorderSupervisor)
 """
 import os
 import sys
@@ -9,32 +9,39 @@ import logging
 import json
 from datetime import datetime
 import time
-from threading import Thread, Event
-from queue import Queue, Empty
-import subprocess
+from threading import Event, Lock
 from operator import itemgetter
 import math
 import signal
-import shlex
-import re
 import glob
+import concurrent.futures
+import cv2
 
-from cls.misc import get_frame_shape, ping_ip, AnyChangeEvent
 from cls.config_reader import config_reader
 from cls.StorageManager import StorageManager
 from cls.RAM_Storage import RAM_Storage
 from cls.MotionDetector import MotionDetector
+from cls.MotionBatch import get_motion_batch
+from cls.MotionPool import RemoteMotionDetector
 from cls.ActionManager import ActionManager
 from cls.WatcherMemory import WatcherMemory
+from cls.FrameBuffer import FrameBuffer
+from cls.VideoIndex import VideoIndex
+from cls.FileWatcher import get_file_watcher
+from cls.PipelineStage import PipelineStage, get_stage_executor
+from cls.SamplingController import SamplingController
+from cls.RecorderSupervisor import get_recorder_supervisor
+from cls.CameraProbe import CameraProbe
+from cls.ControlChannel import encode_message, decode_message
 
-class CameraThread(Thread):
+class CameraThread():
     """
-    Camera Instance - It runs separate thread for recording in a loop and run additional separate thread for watcher loop
+    Camera Instance - recorder process and watcher are run by supervisor (one asyncio event loop for all cameras),
+    motion and object detection are run by the bounded pipeline stages
     """  
 
-    def __init__(self, name, cnfg_daemon, cnfg_recorder, mqtt_client):
+    def __init__(self, name, cnfg_daemon, cnfg_recorder, mqtt_client, object_detector=None, supervisor=None, probe=None, motion_pool=None):
         """Init and assigning params before run"""
-        Thread.__init__(self)
         self.logger = logging.getLogger(f"{name}:CameraThread")
         self.state_msg = 'stopped'
         self._stop_event = Event()
@@ -44,6 +51,8 @@ class CameraThread(Thread):
         self.cnfg_daemon = cnfg_daemon
         self.cnfg = cnfg_recorder
         self.mqtt_client = mqtt_client
+        self.object_detector = object_detector # object detector running in the same process (for direct transport)
+        self.motion_pool = motion_pool # pool of motion detection processes (if <motion_pool> is enabled)
         self.latest_recorded_filename = '' # in this variable I will keep the latest recorded filename 
         self.latest_snapshot = ''
         self.err_cnt = 0
@@ -51,14 +60,25 @@ class CameraThread(Thread):
         self.frame_width = None
         self.frame_height = None
         self.frame_channels = None
-        self.watcher_thread = None
+        self.supervisor = supervisor # RecorderSupervisor, which runs recorder process and watcher
+        self.on_change = None # callback to wake up supervisor, when state is changed
+        self.probe = probe # CameraProbe shared by all cameras (ping + cached ffprobe)
         self.proc_recorder = None
-        self.motion_throttling = ''
+        self.recorder_stats = None # the latest counters of the recorder (fps, read and dropped frames)
+        self.sampling = None # SamplingController of the analysis rate (created with the watcher)
+        self.motion_batch = None # motion detection engine shared by all cameras (if <motion_batch> is enabled)
+        self._sampling_sent = None # (recorder process, interval) last sent to the recorder
         self.cnt_motion_frame = 0
         self.cnt_obj_frame = 0
         self.cnt_in_memory = 0
         self.cnt_no_object = 0
         self.cnt_frame_analyzed = 0
+        self.cnt_watcher_frame = 0
+        self.video_index = None
+        self._video_index_lock = Lock()
+        self.stage_motion = None
+        self.stage_object = None
+        self.file_watcher = None
         if self.cnfg.is_motion_detection:
             self._watcher_started_event.set()
         if self.cnfg.record_autostart:
@@ -68,7 +88,10 @@ class CameraThread(Thread):
         """ Start recording, if it is not started yet """
         self.logger.debug(f'receve "record_start" event')
         self._recorder_started_event.set()
+        if self.is_recorder_persistent() and self.recorder_send_record_state(True):
+            self.set_recorder_state('started')
         self.mqtt_status()
+        self.state_changed()
 
     def record_stop(self):
         """ Stop recording gracefully"""
@@ -76,9 +99,21 @@ class CameraThread(Thread):
         if self._recorder_started_event.is_set():
             self._recorder_started_event.clear()            
             if not self.proc_recorder is None:
-                self.proc_recorder.send_signal(signal.SIGINT)
-                #self.proc_recorder.kill()
+                if self.is_recorder_persistent() and self._watcher_started_event.is_set():
+                    # keep connection to the source stream for the watcher, only video writer is detached
+                    self.recorder_send_record_state(False)
+                    self.set_recorder_state('stopped')
+                else:
+                    self.proc_recorder.send_signal(signal.SIGINT)
+                    #self.proc_recorder.kill()
         self.mqtt_status()
+        self.state_changed()
+
+    def is_recorder_persistent(self):
+        """ Recorder process can start and stop recording at runtime (without reconnecting to the source stream).
+        Only in stream copy mode video file is written by ffmpeg reader, so recorder process must be restarted
+        """
+        return self.cnfg.is_record_event or not self.cnfg.is_record_stream_copy
         
 
     def watcher_start(self):
@@ -87,6 +122,7 @@ class CameraThread(Thread):
         self._watcher_started_event.set()
         self.mqtt_status()
         self.recorder_send_watch_state(self._watcher_started_event.is_set())
+        self.state_changed()
 
     def watcher_stop(self):
         """ Stop watching"""
@@ -98,17 +134,26 @@ class CameraThread(Thread):
                 self.proc_recorder.send_signal(signal.SIGINT)
                 #self.proc_recorder.kill()
         self.mqtt_status()
+        self.state_changed()
+
+    def start(self):
+        """ Register camera in the supervisor """
+        if self.supervisor is None:
+            self.supervisor = get_recorder_supervisor(logger_name=self.name)
+        self.supervisor.add(self)
 
     def stop(self, timeout=None):
-        """ Stop the thread. """      
+        """ Stop recorder and watcher, wait until they are finished """      
         try:  
             self._stop_event.set()
             if not self.proc_recorder is None and self.proc_recorder.returncode is None:
                 self.proc_recorder.send_signal(signal.SIGINT)
             self.logger.debug(f'receve "stop" event')
-            Thread.join(self, timeout)
+            self.state_changed()
+            if not self.supervisor is None:
+                self.supervisor.wait(self, timeout)
         except:
-            self.logger.exception(f"Can't stop thread: {self.name} ")
+            self.logger.exception(f"Can't stop camera: {self.name} ")
     
     def set_recorder_state(self, state):
         if self.state_msg != state:
@@ -125,119 +170,91 @@ class CameraThread(Thread):
                 'snapshot': self.latest_snapshot,
                 'record': self._recorder_started_event.is_set(),
                 'watcher': self._watcher_started_event.is_set(),
-                'motion throttling': self.motion_throttling,
+                'analysis_fps': None if self.sampling is None else round(self.sampling.fps, 2),
+                'recorder': self.recorder_stats,
                 'cnt_frame_analyzed': self.cnt_frame_analyzed,
                 'cnt_motion_frame': self.cnt_motion_frame,
                 'object throttling': math.ceil(self.cnt_no_object / self.cnfg.object_throttling),
                 'cnt_obj_frame': self.cnt_obj_frame,
                 'cnt_in_memory': self.cnt_in_memory,
+                'watcher_queue': self.watcher_queue_stats(),
+                'object_detector': None if self.object_detector is None else self.object_detector.scheduler_stats(self.name),
+                'motion_batch': None if self.motion_batch is None else self.motion_batch.stats(),
                 })
         self.logger.debug(f'mqtt send "status" [{payload}]')
         self.mqtt_client.publish(self.cnfg.mqtt_topic_recorder_publish.format(source_name=self.name),payload)
 
-    def get_camera_info(self):
-        """ Check if camera is available and calculate frame_shape"""
-        if ping_ip(self.cnfg.ip):
-            frame_shape = get_frame_shape(self.cnfg.stream_url())
-            if not frame_shape is None:
-                self.frame_width = frame_shape[1]
-                self.frame_height = frame_shape[0]
-                self.frame_channels = frame_shape[2]
+    def watcher_queue_stats(self):
+        """ Queue depth and average wait time (seconds) of the watcher stages """
+        result = {}
+        for stage in (self.stage_motion, self.stage_object):
+            if not stage is None:
+                stats = stage.stats()
+                result[stage.name] = {
+                    'queue': stats['queue'],
+                    'max_queue': stats['max_queue'],
+                    'dropped': stats['dropped'],
+                    'avg_wait': round(stats['avg_wait'], 3),
+                }
+        return result
+
+    def get_camera_info(self, refresh=False):
+        """ Check if camera is available and get frame_shape (from the probe cache, unless <refresh> is set)"""
+        if self.probe is None:
+            self.probe = CameraProbe(self.cnfg_daemon, logger_name = self.name)
+        if self.probe.ping(self.cnfg.ip):
+            info = self.probe.get_stream_info(self.cnfg.stream_url(), refresh=refresh)
+            if not info is None:
+                self.frame_width = info['width']
+                self.frame_height = info['height']
+                self.frame_channels = info['channels']
         else:
             self.set_recorder_state('inactive')
             self._recorder_started_event.clear()
             self._watcher_started_event.clear()
 
-    def run(self):
-        """Main thread"""        
-        self.get_camera_info()        
-        self.notify_status_thread = Thread(target=self.run_notify_status_loop, args=())
-        self.notify_status_thread.start()
-        while not self._stop_event.is_set(): 
-            if self.state_msg in ('inactive'):
-                if AnyChangeEvent(
-                            self._recorder_started_event, 
-                            self._watcher_started_event, 
-                            self._stop_event
-                        ).wait(self.cnfg.recorder_ping_interval):
-                    self.mqtt_status()
-                self.get_camera_info()
-            elif not (self._recorder_started_event.is_set() or self._watcher_started_event.is_set()):
-                if AnyChangeEvent(
-                            self._recorder_started_event, 
-                            self._watcher_started_event, 
-                            self._stop_event
-                        ).wait(self.cnfg.recorder_ping_interval):
-                    self.mqtt_status()
-            else:
-                # watcher running in separate thread (start only once)
-                if self.watcher_thread is None:
-                    self.watcher_thread = Thread(target=self.run_watcher_thread, args=()) 
-                    self.watcher_thread.start()
-                # recorder loop running in main thread
-                self.run_recorder_loop()
-
-    def run_recorder_loop(self):
-        """ Function to run in a loop:
-        - execute {cmd_recorder_start} for start recording into file and take snapshots
-        - parse execution output to get required variable values
-        """
-        i = 0 
-        while not self._stop_event.is_set() and (self._recorder_started_event.is_set() or self._watcher_started_event.is_set()): 
-            if self.state_msg in ('inactive'): # camera is not alive, then just exit from recording loop and wait in upper loop
-                break               
-            elif self._recorder_started_event.is_set(): # start recording                               
-                # run cmd_recorder_start
-                cmd_recorder_start = self.cnfg.cmd_recorder_start(
-                    frame_height = self.frame_height,
-                    frame_width = self.frame_width,
-                    frame_channels = self.frame_channels
-                )
-                if cmd_recorder_start == '':
-                    raise ValueError(f"Config value: 'cmd_recorder_start' is not defined")                    
-                if (not self._stop_event.is_set()):
-                    self.logger.debug(f'record process run:> {cmd_recorder_start}')
-                    #self.proc_recorder = subprocess.Popen(cmd_recorder_start, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE, universal_newlines=True)
-                    self.proc_recorder = subprocess.Popen(shlex.split(cmd_recorder_start), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
-                    self.set_recorder_state('started')
-                    # need to parse sxvrs_recorder execution output, to catch required variables 
-                    duration = self.parse_subprocess_output()                                        
-                    # detect if process run too fast (unsuccessful start)
-                    if duration<self.cnfg.start_error_threshold:
-                        self.err_cnt += 1
-                        self.logger.debug(f"Probably can't start recording. Finished in {duration:.2f} sec (attempt {self.err_cnt})")
-                        if (self.err_cnt % self.cnfg.start_error_atempt_cnt)==0:
-                            self.logger.debug(f'Too many attempts to start with no success ({self.err_cnt}). Going to sleep for {self.cnfg.start_error_sleep} sec')
-                            self.get_camera_info() # check if camera is available
-                            self.set_recorder_state('error')
-                            AnyChangeEvent(
-                                self._recorder_started_event, 
-                                self._watcher_started_event, 
-                                self._stop_event
-                            ).wait(self.cnfg.start_error_sleep)
-                    else:
-                        self.err_cnt = 0
-                        self.logger.debug(f'process execution finished in {duration:.2f} sec')
-                    if self._recorder_started_event.is_set():
-                        self.set_recorder_state('restarting')
-                    else:
-                        self.set_recorder_state('stopped')
-                i += 1
-                self.logger.debug(f'Running thread, iteration #{i}')
-            elif self._watcher_started_event.is_set(): # take snapshots only (no recording)
-                if self.proc_recorder is None or not self.proc_recorder.returncode is None:
-                    cmd_take_snapshot = self.cnfg.cmd_take_snapshot(
-                        frame_height = self.frame_height,
-                        frame_width = self.frame_width,
-                        frame_channels = self.frame_channels
-                    )
-                    self.logger.debug(f'snapshot process run:> {cmd_take_snapshot}')
-                    self.proc_recorder = subprocess.Popen(shlex.split(cmd_take_snapshot), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.PIPE)
-                    self.parse_subprocess_output(from_recorder=False)
-                self.logger.debug(f'Recording is not started. Sleeping..')
-
-    def run_watcher_thread(self):
-        """
+    def is_stopped(self):
+        return self._stop_event.is_set()
+
+    def is_record_started(self):
+        return self._recorder_started_event.is_set()
+
+    def is_watcher_started(self):
+        return self._watcher_started_event.is_set()
+
+    def state_changed(self):
+        """ Wake up supervisor, so it reacts on changed state immediately """
+        if not self.on_change is None:
+            self.on_change()
+
+    def notify_status(self):
+        """ Periodic mqtt status with given <send_status_interval> (counters are reset after each message) """
+        self.mqtt_status()
+        self.cnt_obj_frame = 0
+        self.cnt_in_memory = 0
+        self.cnt_motion_frame = 0
+        self.cnt_frame_analyzed = 0
+
+    def handle_recorder_message(self, line):
+        """ Handle event message of the recorder process (see ControlChannel) """
+        msg = decode_message(line)
+        if msg is None:
+            self.logger.debug(f"recorder output: {line.decode('utf-8', errors='replace').strip()}")
+            return
+        event = msg.get('event')
+        if event == 'segment_opened':
+            self.latest_recorded_filename = msg.get('filename', '')
+            self.mqtt_status()
+        elif event == 'segment_closed':
+            self.logger.debug(f"Video file is finished: {msg.get('filename')}")
+        elif event == 'snapshot':
+            self.latest_snapshot = msg.get('filename', '')
+        elif event == 'stats':
+            self.recorder_stats = {key: msg.get(key) for key in ('fps', 'read', 'dropped', 'sampling_interval')}
+            self.logger.debug(f'Recorder stats: {msg}')
+
+    def watcher_init(self):
+        """ Prepare watcher (called once, before watcher is started):
         1) Monitor provided RAM folder for newly taken frames
         2) Detect Motion between taken frames
         3) Run object detection if motion detected
@@ -245,205 +262,327 @@ class CameraThread(Thread):
         5) Take an action on frame where object was detected (email, copy, etc..)
         """
         # Mount RAM storage disk
-        ram_storage = RAM_Storage(self.cnfg_daemon, logger_name = self.name)
+        self.ram_storage = RAM_Storage(self.cnfg_daemon, logger_name = self.name)
 
         # Create storage manager
-        storage = StorageManager(self.cnfg.storage_path(), self.cnfg.storage_max_size, logger_name = self.name)
+        self.storage = StorageManager(self.cnfg.storage_path(), self.cnfg.storage_max_size, logger_name = self.name)
 
-        # Create MotionDetector
-        motion_detector = MotionDetector(self.cnfg, logger_name = self.name)
+        # Create MotionDetector (if <motion_pool> is enabled, then it runs inside the worker process,
+        # if <motion_batch> is enabled, then frames of all cameras are compared together)
+        if not self.motion_pool is None:
+            self.motion_detector = RemoteMotionDetector(self.motion_pool, self.name, frame_shape=(self.frame_height, self.frame_width))
+        else:
+            if self.cnfg_daemon.is_motion_batch:
+                self.motion_batch = get_motion_batch(self.cnfg_daemon.motion_batch_max_batch, self.cnfg_daemon.motion_batch_max_wait, logger_name=self.name)
+            # motion detection areas are defined in pixels of the camera stream (frame shape is known from the camera probe)
+            self.motion_detector = MotionDetector(self.cnfg, batch=self.motion_batch, frame_shape=(self.frame_height, self.frame_width), logger_name = self.name)
 
         # Create ActionManager to run actions on files with detected objects
-        action_manager = ActionManager(self.cnfg, name = self.name)
+        self.action_manager = ActionManager(self.cnfg, name = self.name)
 
         # Remember detected objects, to avvoid triggering duplicate acctions
-        watcher_memory = WatcherMemory(self.cnfg, name = self.name)
+        self.watcher_memory = WatcherMemory(self.cnfg, name = self.name)
+
+        # Shared memory ring buffer with frames (if it is enabled, then it is used instead of *.rec files)
+        self.frame_buffer = None
 
         self.cnt_no_object = 0 # count motion frames without objects for throttling
-        def thread_process(filename): 
-            """ Processing of each snapshot file must be done in separate thread
-            """
+        # analysis rate of the recorder is adjusted by the latency of the watcher and depth of its queues
+        self.sampling = SamplingController(self.cnfg.analysis_fps, target_latency=self.cnfg.analysis_max_latency, 
+                    target_queue=self.cnfg.watcher_queue_size // 2, min_fps=self.cnfg.analysis_min_fps)
+        # bounded queues: if watcher is too slow, then the oldest frames are dropped
+        # stages of all cameras run on shared thread pools (motion detection of the camera is one item at a time, so frames are compared in order)
+        self.stage_motion = PipelineStage('motion', self.process_motion, queue_size=self.cnfg.watcher_queue_size, drop_policy='oldest', 
+                    release=lambda item: self.remove_leftover(item[0] if item[1] is None else None), 
+                    executor=get_stage_executor('motion', self.cnfg_daemon.watcher_pool_motion_workers, logger_name=self.name), logger_name=self.name)
+        self.stage_object = PipelineStage('object', self.process_object, queue_size=self.cnfg.watcher_queue_size, drop_policy='oldest', 
+                    release=lambda item: self.remove_leftover(item[1]), workers=self.cnfg.watcher_workers, 
+                    executor=get_stage_executor('object', self.cnfg_daemon.watcher_pool_object_workers, logger_name=self.name), logger_name=self.name)
+        self.stage_motion.start()
+        self.stage_object.start()
+        # new frame files from the recorder are dispatched by file watcher (one for all cameras), instead of scanning the folder
+        self.file_watcher = get_file_watcher(self.ram_storage.storage_path, poll_interval=self.cnfg.motion_detection_sleep_time, logger_name=self.name)
+        self.file_subscription = self.file_watcher.subscribe(f'{self.name}_*.rec', self.on_watcher_file)
+
+    def watcher_close(self):
+        if not self.file_watcher is None:
+            self.file_watcher.unsubscribe(self.file_subscription)
+        if not self.stage_motion is None:
+            self.stage_motion.stop(timeout=5)
+        if not self.stage_object is None:
+            self.stage_object.stop(timeout=self.cnfg_daemon.object_detector_timeout)
+
+    def is_watcher_throttled(self):
+        """ Skip some frames, if object detector does not find anything on frames with motion """
+        self.cnt_watcher_frame += 1
+        throttling = round(self.cnt_no_object / self.cnfg.object_throttling)
+        if throttling>0 and self.cnt_watcher_frame % throttling != 0:
+            self.logger.debug(f'ObjectDetector throttling')
+            return True
+        return False
+
+    def on_watcher_file(self, filename):
+        """ New frame file is written by recorder (called by file watcher) """
+        if os.path.isfile(filename):
+            if self.is_watcher_throttled():
+                self.remove_leftover(filename) # some times thread is not fast enoght to rename file first
+            else:
+                self.stage_motion.put((filename, None, None))
+
+    def watcher_poll(self):
+        """ Pass new frames from shared memory ring buffer to motion detection (called every {motion_detection_sleep_time}) """
+        self.update_sampling()
+        if self.cnfg.frame_buffer_slots > 0:
+            self.frame_buffer = self.attach_frame_buffer(self.frame_buffer, self.ram_storage)
+            if not self.frame_buffer is None:
+                for slot, frame_num, timestamp in self.frame_buffer.get_new_frames():
+                    if not self.is_watcher_throttled():
+                        filename = self.cnfg.filename_temp(temp_storage_path=self.ram_storage.storage_path, frame_num=frame_num, datetime=datetime.fromtimestamp(timestamp))
+                        self.stage_motion.put((filename, (self.frame_buffer, slot, frame_num), timestamp))
+
+    def process_motion(self, filename, frame_ref=None, timestamp=None): 
+        """ Motion detection of each snapshot file (single worker, so frames are compared in order)
+        If <frame_ref> is set, then frame is taken from shared memory ring buffer: (frame_buffer, slot, frame_num)
+        """
+        time_start = time.time()
+        self.cnt_frame_analyzed += 1
+        if frame_ref is None:
+            filename_wch = f"{filename[:-4]}.wch"
             try:
-                self.cnt_frame_analyzed += 1
-                filename_wch = f"{filename[:-4]}.wch"
-                try:
-                    os.rename(filename, filename_wch)
-                except FileNotFoundError:
+                os.rename(filename, filename_wch)
+                timestamp = os.stat(filename_wch).st_mtime
+            except FileNotFoundError:
+                return
+            filename = filename[:-4]
+            frame_num = -1
+            is_motion = self.motion_detector.detect(filename_wch)
+        else:
+            filename_wch = None
+            _frame_buffer, slot, frame_num = frame_ref
+            if self.motion_pool is None:
+                frame = _frame_buffer.get_frame(slot, frame_num)
+                if frame is None:
                     return
-                filename = filename[:-4]
-                label = filename[filename.rindex('_')+1:]
-                is_motion = motion_detector.detect(filename_wch)
-                if self.cnfg_daemon.is_object_detection:
-                    if not is_motion:
-                        os.remove(filename_wch)
-                    else:
-                        self.cnt_motion_frame += 1
-                        if self.latest_recorded_filename != '' and self._recorder_started_event.is_set():
-                            self.log_to_file(self.latest_recorded_filename+".motion.log", '', label)                        
-                        filename_obj_wait = f"{filename}.obj.wait"
-                        filename_obj_none = f"{filename}.obj.none"
-                        filename_obj_found = f"{filename}.obj.found"
-                        os.rename(filename_wch, filename_obj_wait)
-                        # wait for file where object detection is complete
-                        time_start = time.time()
-                        while time.time()-time_start < self.cnfg_daemon.object_detector_timeout:                                     
-                            if os.path.isfile(filename_obj_none):
-                                self.cnt_no_object += 1
-                                os.remove(filename_obj_none)
-                                break
-                            if os.path.isfile(filename_obj_found):
-                                self.logger.debug(f'Detection finished: {filename_obj_found}')                                            
-                                try: # Read info file
-                                    with open(filename_obj_found+'.info') as f:
-                                        info = json.loads(f.read())
-                                        info['filename'] = filename_obj_found
-                                except:
-                                    self.logger.exception(f"Can't load info file: {filename_obj_found}.info")
-                                    info = {"result": "can't load info file"}
-                                    continue
-                                if self.latest_recorded_filename != '' and self._recorder_started_event.is_set():
-                                    self.log_to_file(self.latest_recorded_filename+".object.log", info, label)
-                                self.cnt_obj_frame += 1
-                                if watcher_memory.add(info):
-                                    self.cnt_no_object = 0 # dissable object detection throttling
-                                    # Take actions if required objects was found
-                                    action_manager.run(filename_obj_found, info) 
-                                else:
-                                    self.cnt_in_memory += 1
-                                # Remove all temporary files
-                                for file in glob.glob(filename_obj_found[:-10] + "*"):
-                                    try:
-                                        os.remove(file)
-                                    except:
-                                        self.logger.exception(f'Can''t delete temporary file: {file}')
-                                break
-                            time.sleep(self.cnfg.object_watch_delay)                 
-                        if time.time()-time_start >= self.cnfg_daemon.object_detector_timeout:
-                            self.logger.warning(f'Timeout: {filename} {time.time()-time_start:.2f} >= {self.cnfg_daemon.object_detector_timeout} sec')
-                            # increase object throttling
-                            self.cnt_no_object += 1
-                            # remove temporary file on timeout
-                            for ext in ['.wch','.obj.wait','.obj.none','.obj.found','.obj.found.info']:
-                                if os.path.isfile(filename+ext):
-                                    self.logger.warning(f"remove unprocessed file '{filename+ext}'' due timeout ({self.cnt_no_object})")
-                                    os.remove(filename+ext)
-                else: # in case if object detection is dissabled
-                    # TODO: notify recorder that object detected
-                    os.remove(filename_wch)
-                #self.mqtt_status()
-            except:
-                self.logger.exception(f'Watch: {filename} failed')
-        sleep_time = self.cnfg.motion_detection_sleep_time
-        i = 0
-        while not self._stop_event.is_set():
-            if not self._watcher_started_event.is_set():
-                self.logger.debug(f'Watcher {self.name}: wait for start {self.event_timeout} sec')
-                if AnyChangeEvent(
-                            self._recorder_started_event, 
-                            self._watcher_started_event, 
-                            self._stop_event
-                        ).wait(self.event_timeout):
-                    self.mqtt_status()
+                is_motion = self.motion_detector.detect_frame(frame, timestamp)
             else:
-                try:
-                    i += 1
-                    for filename in storage.get_file_list(f"{ram_storage.storage_path}/{self.name}_*.rec"):
-                        if filename is None:                        
-                            #self.logger.debug(f'Wait for "{self.name}_*.rec" file. Sleep {sleep_time} sec')
-                            time.sleep(sleep_time)
-                            continue
-                        if os.path.isfile(filename):
-                            throttling = round(self.cnt_no_object / self.cnfg.object_throttling)
-                            if throttling>0 and i % throttling != 0:
-                                self.logger.debug(f'ObjectDetector throttling')
-                                try:
-                                    os.remove(filename)
-                                except FileNotFoundError:
-                                    pass # some times thread is not fast enoght to rename file first                                
-                            else:
-                                thread = Thread(target=thread_process, args=(filename,))
-                                thread.start()
-                    AnyChangeEvent(
-                            self._recorder_started_event, 
-                            self._watcher_started_event, 
-                            self._stop_event
-                        ).wait(1)
+                # worker process reads the frame from shared memory itself
+                is_motion = self.motion_detector.detect_ref(_frame_buffer, slot, frame_num, timestamp)
+            if not _frame_buffer.is_valid(slot, frame_num):
+                self.logger.debug(f'Frame {frame_num} was overwritten during motion detection')
+                return
+        self.sampling.frame_processed(time.time() - timestamp, time.time() - time_start)
+        label = filename[filename.rindex('_')+1:]
+        if is_motion and self.cnfg.event_trigger == 'motion':
+            self.recorder_send_event()
+        if is_motion:
+            video_index = self.get_video_index()
+            if not video_index is None:
+                video_index.add_motion(frame_num, timestamp, self.motion_detector.score)
+        if self.cnfg_daemon.is_object_detection and is_motion:
+            self.cnt_motion_frame += 1
+            if self.latest_recorded_filename != '' and self._recorder_started_event.is_set():
+                self.log_to_file(self.latest_recorded_filename+".motion.log", '', label)                        
+            # waiting for object detection is done by the pool of workers
+            self.stage_object.put((filename, filename_wch, frame_ref, frame_num, timestamp, label))
+        elif not filename_wch is None:
+            os.remove(filename_wch)
+
+    def wait_object_file(self, filename, filename_wch, frame_ref):
+        """ Pass frame to object detector thru RAM folder (file transport) and wait for the result.
+        Returns (filename_obj_found, info) if objects are detected, otherwise None
+        """
+        filename_obj_wait = f"{filename}.obj.wait"
+        filename_obj_none = f"{filename}.obj.none"
+        filename_obj_found = f"{filename}.obj.found"
+        filename_obj_dropped = f"{filename}.obj.dropped"
+        if frame_ref is None:
+            os.rename(filename_wch, filename_obj_wait)
+        else:
+            # object detector will read the frame directly from shared memory
+            _frame_buffer, slot, frame_num = frame_ref
+            _frame_buffer.write_reference(filename_obj_wait, slot, frame_num)
+        # wait for file where object detection is complete
+        time_start = time.time()
+        while time.time()-time_start < self.cnfg_daemon.object_detector_timeout:                                     
+            if os.path.isfile(filename_obj_none):
+                self.cnt_no_object += 1
+                os.remove(filename_obj_none)
+                return None
+            if os.path.isfile(filename_obj_dropped):
+                # object detector is busy with other frames, it is not a reason for throttling
+                os.remove(filename_obj_dropped)
+                return None
+            if os.path.isfile(filename_obj_found):
+                self.logger.debug(f'Detection finished: {filename_obj_found}')                                            
+                try: # Read info file
+                    with open(filename_obj_found+'.info') as f:
+                        info = json.loads(f.read())
+                        info['filename'] = filename_obj_found
                 except:
-                    self.logger.exception(f"watcher failed '{self.name}'")
+                    self.logger.exception(f"Can't load info file: {filename_obj_found}.info")
+                    info = {"result": "can't load info file"}
+                    continue
+                return filename_obj_found, info
+            time.sleep(self.cnfg.object_watch_delay)                 
+        self.logger.warning(f'Timeout: {filename} {time.time()-time_start:.2f} >= {self.cnfg_daemon.object_detector_timeout} sec')
+        # increase object throttling
+        self.cnt_no_object += 1
+        # remove temporary file on timeout
+        for ext in ['.wch','.obj.wait','.obj.none','.obj.dropped','.obj.found','.obj.found.info']:
+            if os.path.isfile(filename+ext):
+                self.logger.warning(f"remove unprocessed file '{filename+ext}'' due timeout ({self.cnt_no_object})")
+                os.remove(filename+ext)
+        return None
 
-    def run_notify_status_loop(self):
-        """ Send mqtt notify messages with given <send_status_interval> from separate thread
+    def wait_object_direct(self, filename, filename_wch, frame_ref):
+        """ Submit frame to object detector inside the same process and wait for the result.
+        Returns (filename_obj_found, info) if objects are detected, otherwise None
         """
-        while not self._stop_event.is_set():            
-            if not self._stop_event.wait(self.cnfg.send_status_interval):
-                self.mqtt_status()
-                self.cnt_obj_frame = 0
-                self.cnt_in_memory = 0
-                self.cnt_motion_frame = 0
-                self.cnt_frame_analyzed = 0            
+        if frame_ref is None:
+            image = cv2.imread(filename_wch)
+        else:
+            _frame_buffer, slot, frame_num = frame_ref
+            image = _frame_buffer.get_frame(slot, frame_num)
+            if image is None:
+                return None
+            # copy frame, as it can be overwritten by recorder during detection
+            image = image.copy()
+            if not _frame_buffer.is_valid(slot, frame_num):
+                self.logger.debug(f'Frame {frame_num} was overwritten before object detection')
+                return None
+        future = self.object_detector.submit(image=image, camera=self.name)
+        try:
+            info = future.result(timeout=self.cnfg_daemon.object_detector_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.logger.warning(f'Timeout: {filename} >= {self.cnfg_daemon.object_detector_timeout} sec')
+            info = None
+        if info is None or len(info.get('objects', [])) == 0:
+            if info is None or info.get('result') != 'dropped':
+                self.cnt_no_object += 1
+            self.remove_leftover(filename_wch)
+            return None
+        # actions need an image file
+        filename_obj_found = f"{filename}.obj.found"
+        if frame_ref is None:
+            os.rename(filename_wch, filename_obj_found)
+        else:
+            cv2.imencode('.bmp', image)[1].tofile(filename_obj_found)
+        info['filename'] = filename_obj_found
+        return filename_obj_found, info
 
-    def recorder_send_watch_state(self, state):
-        """ interact with child process to set watcher state by keypress event
-        w - to start watching
-        e - to stop watching
+    def process_object(self, filename, filename_wch, frame_ref, frame_num, timestamp, label):
+        """ Pass frame with motion to object detector, wait for the result and take actions """
+        time_start = time.time()
+        if not self.object_detector is None and self.object_detector.is_direct:
+            found = self.wait_object_direct(filename, filename_wch, frame_ref)
+        else:
+            found = self.wait_object_file(filename, filename_wch, frame_ref)
+        # waiting is shared by the pool of workers
+        self.sampling.add_latency(time.time() - timestamp, (time.time() - time_start) / self.cnfg.watcher_workers)
+        if found is None:
+            return
+        filename_obj_found, info = found
+        if self.latest_recorded_filename != '' and self._recorder_started_event.is_set():
+            self.log_to_file(self.latest_recorded_filename+".object.log", info, label)
+        video_index = self.get_video_index()
+        if not video_index is None:
+            for obj in info.get('objects', []):
+                video_index.add_object(frame_num, timestamp, obj.get('class'), obj.get('score', 0))
+        self.cnt_obj_frame += 1
+        if self.cnfg.event_trigger == 'object':
+            self.recorder_send_event()
+        if self.watcher_memory.add(info):
+            self.cnt_no_object = 0 # dissable object detection throttling
+            # Take actions if required objects was found
+            self.action_manager.run(filename_obj_found, info) 
+        else:
+            self.cnt_in_memory += 1
+        # Remove all temporary files
+        for file in glob.glob(filename_obj_found[:-10] + "*"):
+            try:
+                os.remove(file)
+            except:
+                self.logger.exception(f'Can''t delete temporary file: {file}')
+
+    def remove_leftover(self, filename):
+        """ Remove file of the frame, if it is left after processing or dropped from the queue (watcher is too slow) """
+        if not filename is None:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    def get_video_index(self):
+        """ Index file of the current recording, where watcher adds detected motion and objects.
+        Returns None if recording is not started, or index file is not created by recorder yet
         """
-        if not self.proc_recorder is None:
-            if state:
-                self.proc_recorder.stdin.write(b'w') #_watcher_started_event.set()
-            else:
-                self.proc_recorder.stdin.write(b'e') #_watcher_started_event.clear()
+        if not self.cnfg.is_video_index or self.latest_recorded_filename == '' or not self._recorder_started_event.is_set():
+            return None
+        filename = f'{self.latest_recorded_filename}.idx'
+        with self._video_index_lock:
+            if self.video_index is None or self.video_index.filename != filename:
+                if not self.video_index is None:
+                    self.video_index.close()
+                    self.video_index = None
+                if not os.path.isfile(filename):
+                    return None
+                try:
+                    self.video_index = VideoIndex(filename, logger_name=self.name)
+                except:
+                    self.logger.exception(f"Can't open video index: {filename}")
+                    return None
+            return self.video_index
+
+    def attach_frame_buffer(self, frame_buffer, ram_storage):
+        """ Attach to shared memory ring buffer created by recorder process. 
+        Reattach if recorder has replaced it (i.e. frame shape is changed)
+        """
+        if not frame_buffer is None and frame_buffer.is_current():
+            return frame_buffer
+        filename = self.cnfg.filename_frame_buffer(temp_storage_path=ram_storage.storage_path)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            frame_buffer = FrameBuffer(filename, logger_name=self.name)
+            self.logger.debug(f'Attached to frame buffer: {filename} shape={frame_buffer.shape}')
+            return frame_buffer
+        except:
+            self.logger.exception(f"Can't attach to frame buffer: {filename}")
+            return None
+
+    def recorder_send_command(self, cmd, **fields):
+        """ Send control command to the recorder process (see ControlChannel). Returns False if recorder process is not running """
+        if self.proc_recorder is None:
+            return False
+        try:
+            self.proc_recorder.stdin.write(encode_message({'cmd': cmd, **fields}))
             self.proc_recorder.stdin.flush()
+        except (AttributeError, OSError):
+            return False # recorder is restarting
+        return True
 
-    def parse_subprocess_output(self, from_recorder = True):
-        self.mqtt_status()
-        start_time = time.time()
-        self.cnt_obj_frame = 0
-        self.cnt_motion_frame = 0
-        # interact with child process to set watcher state
-        self.recorder_send_watch_state(self._watcher_started_event.is_set())
-        # regex paterns to catch output
-        pattern_videofile = re.compile(r".*Start record filename: \<(.*)\>.*")
-        pattern_snapshotfile = re.compile(r".*Snapshot filename: \<(.*)\>.*")
-        pattern_motion_throttling = re.compile(r".* frame throttling \((.*)\) for recorder.*")
-        def parse_output(output, pattern, var):
-            found = re.search(pattern, output)
-            if not found is None:
-                var = found.groups()[0]
-            return var
-        # non-blocking way to read from stdout of subprocess
-        def enqueue_output(out, queue):
-            for line in iter(out.readline, b''):
-                queue.put(line)
-            out.close()      
-        q = Queue()
-        t = Thread(target=enqueue_output, args=(self.proc_recorder.stdout, q))
-        t.daemon = True # thread dies with the program
-        t.start()                  
-        duration = 0
-        while ((not self._stop_event.is_set()) and ((from_recorder and self._recorder_started_event.is_set()) or (not from_recorder and self._watcher_started_event.is_set() and not self._recorder_started_event.is_set()) )) and duration < self.cnfg.record_time+5:
-            #output = self.proc_recorder.stdout.readline()
-            # read line without blocking
-            try:  output = q.get_nowait() # or q.get(timeout=.1)
-            except Empty:
-                #print('no output yet')
-                time.sleep(1)
-                pass
-            else: # got line
-                # ... do something with line
-                if output == b'' and self.proc_recorder.poll() is not None:
-                    break
-                if output:
-                    output = output.decode("utf-8") 
-                    self.logger.debug(output.strip()) # log output. maybe need to dissable this
-                    self.latest_recorded_filename = parse_output(output, pattern_videofile, self.latest_recorded_filename)
-                    self.latest_snapshot = parse_output(output, pattern_snapshotfile, self.latest_snapshot)
-                    self.motion_throttling = parse_output(output, pattern_motion_throttling, self.motion_throttling)                
-            duration = time.time() - start_time 
-        # if process still running, then send stop signal
-        if self.proc_recorder.returncode is None: 
-            self.proc_recorder.send_signal(signal.SIGINT)
-        self.proc_recorder = None  
-        return duration     
+    def recorder_send_event(self):
+        """ notify recorder about detected event (used in event recording mode) """
+        if self.cnfg.is_record_event and self._recorder_started_event.is_set():
+            self.recorder_send_command('event')
+
+    def recorder_send_record_state(self, state):
+        """ start/stop recording (attach/detach video writer) without restarting of the recorder process
+        Returns False if recorder process is not running
+        """
+        return self.recorder_send_command('record', state=state)
+
+    def update_sampling(self):
+        """ Recalculate analysis sampling interval by the load of the watcher, and pass it to the recorder """
+        queue_depth = sum(stage.queue.qsize() for stage in (self.stage_motion, self.stage_object) if not stage is None)
+        interval = self.sampling.update(queue_depth)
+        if self._sampling_sent != (self.proc_recorder, interval) and self.recorder_send_command('sampling', interval=round(interval, 3)):
+            self._sampling_sent = (self.proc_recorder, interval)
+
+    def recorder_send_watch_state(self, state):
+        """ start/stop passing frames to the watcher """
+        self.recorder_send_command('watch', state=state)
 
     def log_to_file(self, filename, data, label=''):
         """ Function to write data into file """
@@ -453,7 +592,7 @@ class CameraThread(Thread):
             f.write(f'{label}\t{data}\n')
 
 
-def camera_create(name, cnfg_daemon, cnfg_recorder, mqtt_client):
-    camera = CameraThread(name, cnfg_daemon, cnfg_recorder, mqtt_client)
+def camera_create(name, cnfg_daemon, cnfg_recorder, mqtt_client, object_detector=None, supervisor=None, probe=None, motion_pool=None):
+    camera = CameraThread(name, cnfg_daemon, cnfg_recorder, mqtt_client, object_detector, supervisor, probe, motion_pool)
     camera.start()
     return camera
\ No newline at end of file
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import json
+from threading import Lock
+
+def encode_message(msg):
+    """ Message is a dict, encoded as one line of JSON """
+    return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+def decode_message(line):
+    """ Returns message dict, or None if the line is not a message (i.e. stray output of the process) """
+    try:
+        msg = json.loads(line)
+    except ValueError:
+        return None
+    return msg if isinstance(msg, dict) else None
+
+class ControlChannel():
+    """ Control channel between daemon and recorder: one JSON message per line (recorder stdin/stdout, log output goes to stderr).
+    Commands (daemon -> recorder):
+        {"cmd": "watch", "state": true|false}   - start/stop passing frames to the watcher
+        {"cmd": "record", "state": true|false}  - start/stop recording (attach/detach video writer)
+        {"cmd": "event"}                        - event is detected (event recording mode)
+        {"cmd": "sampling", "interval": 0.5}    - interval between frames passed to the watcher (seconds)
+    Events (recorder -> daemon):
+        {"event": "segment_opened", "filename": ..., "time": ...}   - recording into the new video file is started
+        {"event": "segment_closed", "filename": ..., "frames": ...}  - video file is finished
+        {"event": "snapshot", "filename": ...}                      - snapshot is written
+        {"event": "stats", "fps": ..., "read": ..., "dropped": ..., "stages": [...]}  - reader and pipeline stages counters
+    <fields> are added to each sent message (i.e. recorder name inside the engine), <lock> can be shared by channels of one stream
+    """
+    def __init__(self, stream, lock=None, **fields):
+        self.stream = stream
+        self.fields = fields
+        self._lock = Lock() if lock is None else lock
+
+    def send(self, msg):
+        data = encode_message({**msg, **self.fields})
+        with self._lock:
+            try:
+                self.stream.write(data)
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass # daemon is finished
+
+    def send_event(self, event, **fields):
+        self.send({'event': event, **fields})
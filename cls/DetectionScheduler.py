@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from collections import deque
+from threading import Thread, Condition
+
+class _CameraQueue():
+    """ Frames of one camera waiting for object detection, with counters """
+    def __init__(self, weight):
+        self.weight = weight
+        self.items = deque() # [(deadline, item)], the newest is at the right
+        self.deficit = 0
+        self.cnt_admitted = 0
+        self.cnt_dropped = 0
+        self.cnt_expired = 0
+        self.cnt_processed = 0
+
+class DetectionScheduler(Thread):
+    """ Global scheduler of frames waiting for object detection from all cameras.
+    Each camera has its own bounded queue, and queues are served by deficit round-robin according to camera <weight>,
+    so one noisy camera (i.e. trees in wind) can not starve the rest.
+    Inside camera queue the newest frame is served first. Frames which are not processed before their deadline
+    (<timeout> seconds after submit) are dropped, as well as the oldest frames if camera queue is full.
+    <release> callback is called for each item after it is processed or dropped
+    """
+    def __init__(self, process, release=None, queue_size=8, timeout=30, get_weight=None, logger_name='None'):
+        Thread.__init__(self, name='DetectionScheduler')
+        self.daemon = True
+        self.logger = logging.getLogger(f"{logger_name}:DetectionScheduler")
+        self.process = process
+        self.release = release
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.get_weight = get_weight
+        self._cond = Condition()
+        self._queues = {} # {camera: _CameraQueue}
+        self._active = deque() # cameras having frames in their queues, in round-robin order
+        self._stopped = False
+
+    def _get_queue(self, camera):
+        queue = self._queues.get(camera)
+        if queue is None:
+            weight = 1 if self.get_weight is None else self.get_weight(camera)
+            queue = _CameraQueue(max(weight, 0.01))
+            self._queues[camera] = queue
+        return queue
+
+    def put(self, camera, item, deadline=None):
+        """ Put frame of the camera into its queue without blocking. Returns False if some item was dropped """
+        dropped = []
+        with self._cond:
+            if self._stopped:
+                dropped.append(item)
+            else:
+                queue = self._get_queue(camera)
+                queue.cnt_admitted += 1
+                if deadline is None:
+                    deadline = time.time() + self.timeout
+                if len(queue.items) == 0:
+                    self._active.append(camera)
+                queue.items.append((deadline, item))
+                while len(queue.items) > self.queue_size:
+                    dropped.append(queue.items.popleft()[1])
+                    queue.cnt_dropped += 1
+                self._cond.notify()
+        for item in dropped:
+            self._release(item)
+        return len(dropped) == 0
+
+    def _next(self, dropped):
+        """ Returns (camera, item) to be processed next, or None if all queues are empty. Expired items are moved into <dropped> """
+        now = time.time()
+        while len(self._active) > 0:
+            camera = self._active[0]
+            queue = self._queues[camera]
+            while len(queue.items) > 0 and queue.items[0][0] < now:
+                dropped.append(queue.items.popleft()[1])
+                queue.cnt_expired += 1
+            if len(queue.items) == 0:
+                self._active.popleft()
+                queue.deficit = 0
+                continue
+            if queue.deficit < 1:
+                # new round for this camera
+                queue.deficit += queue.weight
+                if queue.deficit < 1:
+                    self._active.rotate(-1)
+                    continue
+            queue.deficit -= 1
+            item = queue.items.pop()[1]
+            queue.cnt_processed += 1
+            if len(queue.items) == 0:
+                self._active.popleft()
+                queue.deficit = 0
+            elif queue.deficit < 1:
+                self._active.rotate(-1)
+            return camera, item
+        return None
+
+    def _release(self, item):
+        if not self.release is None:
+            try:
+                self.release(item)
+            except:
+                self.logger.exception('Release of detection item failed')
+
+    def run(self):
+        while True:
+            dropped = []
+            with self._cond:
+                selected = self._next(dropped)
+                while selected is None and len(dropped) == 0 and not self._stopped:
+                    self._cond.wait()
+                    selected = self._next(dropped)
+            for item in dropped:
+                self._release(item)
+            if selected is None:
+                if self._stopped and len(dropped) == 0:
+                    break
+                continue
+            camera, item = selected
+            try:
+                self.process(*item)
+            except:
+                self.logger.exception(f'Object detection failed: {camera}')
+            finally:
+                self._release(item)
+
+    def stop(self, timeout=None):
+        """ Drop all queued items and stop the thread """
+        dropped = []
+        with self._cond:
+            self._stopped = True
+            for queue in self._queues.values():
+                dropped.extend(item for _deadline, item in queue.items)
+                queue.cnt_dropped += len(queue.items)
+                queue.items.clear()
+            self._active.clear()
+            self._cond.notify_all()
+        for item in dropped:
+            self._release(item)
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self, camera=None):
+        """ Returns counters of the camera queue (or of all cameras: {camera: counters}) """
+        with self._cond:
+            if camera is None:
+                return {name: self._queue_stats(queue) for name, queue in self._queues.items()}
+            queue = self._queues.get(camera)
+            return None if queue is None else self._queue_stats(queue)
+
+    def _queue_stats(self, queue):
+        return {
+            'weight': queue.weight,
+            'queue': len(queue.items),
+            'admitted': queue.cnt_admitted,
+            'processed': queue.cnt_processed,
+            'dropped': queue.cnt_dropped,
+            'expired': queue.cnt_expired,
+        }
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+import os, logging
+import struct
+import select
+import fnmatch
+import ctypes, ctypes.util
+from threading import Thread, Event, Lock
+
+# inotify constants (see: man inotify)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_inotify_event = struct.Struct('iIII')
+
+def _load_inotify():
+    """ Returns libc with inotify functions, or None if inotify is not available (i.e. not Linux) """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+class FileWatcher(Thread):
+    """ Dispatcher of file events inside one folder (i.e. RAM storage).
+    Subscribers register fnmatch pattern and callback, which is called with full filename
+    when matching file is created in the folder (written and closed, or renamed into the folder).
+    Linux inotify is used, so new files are dispatched immediately. If inotify is not available,
+    then folder is scanned every <poll_interval> seconds (once for all subscribers).
+    Callbacks are called from the dispatcher thread, so they must be fast (i.e. put filename into the queue)
+    """
+    def __init__(self, path, poll_interval=1, use_inotify=True, logger_name='None'):
+        Thread.__init__(self, name=f'FileWatcher:{path}')
+        self.daemon = True
+        self.logger = logging.getLogger(f"{logger_name}:FileWatcher")
+        self.path = path
+        self.poll_interval = poll_interval
+        self._stop_event = Event()
+        self._lock = Lock()
+        self._subscriptions = []
+        self._seen = set()
+        self.inotify_fd = None
+        libc = _load_inotify() if use_inotify else None
+        if not libc is None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_Q_OVERFLOW) >= 0:
+                self.inotify_fd = fd
+            else:
+                self.logger.warning(f"Can't start inotify for '{path}' (errno={ctypes.get_errno()}). Polling is used instead")
+                if fd >= 0:
+                    os.close(fd)
+        if self.inotify_fd is None:
+            self._seen = set(self._list_files())
+        self.logger.debug(f"File watcher started for '{path}' using {'inotify' if self.is_inotify else 'polling'}")
+
+    @property
+    def is_inotify(self):
+        return not self.inotify_fd is None
+
+    def _list_files(self):
+        try:
+            return [entry.name for entry in os.scandir(self.path) if entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def subscribe(self, pattern, callback, existing=True):
+        """ Call <callback>(filename) for every new file matching <pattern>.
+        If <existing> is True, then callback is called for already existing files too (the oldest first)
+        Returns subscription, which can be passed to <unsubscribe>
+        """
+        subscription = (pattern, callback)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if existing:
+                filenames = [os.path.join(self.path, name) for name in fnmatch.filter(self._list_files(), pattern)]
+                for filename in sorted(filenames, key=_get_mtime):
+                    callback(filename)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def dispatch(self, name):
+        """ Pass new file to all matching subscribers """
+        with self._lock:
+            for pattern, callback in self._subscriptions:
+                if fnmatch.fnmatchcase(name, pattern):
+                    try:
+                        callback(os.path.join(self.path, name))
+                    except:
+                        self.logger.exception(f"File watcher callback failed: {name}")
+
+    def rescan(self):
+        """ Dispatch files, which appeared since the previous scan """
+        names = self._list_files()
+        new_names = [name for name in names if not name in self._seen]
+        self._seen = set(names)
+        for name in sorted(new_names, key=lambda name: _get_mtime(os.path.join(self.path, name))):
+            self.dispatch(name)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self.is_inotify:
+                    self._read_inotify_events()
+                else:
+                    self._stop_event.wait(self.poll_interval)
+                    self.rescan()
+            except:
+                self.logger.exception(f"File watcher failed: '{self.path}'")
+                self._stop_event.wait(self.poll_interval)
+        if self.is_inotify:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def _read_inotify_events(self):
+        rfds, _, _ = select.select([self.inotify_fd], [], [], self.poll_interval)
+        if not rfds:
+            return
+        try:
+            data = os.read(self.inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos + _inotify_event.size <= len(data):
+            wd, mask, cookie, length = _inotify_event.unpack_from(data, pos)
+            pos += _inotify_event.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                # some events are lost: dispatch all existing files, subscribers must ignore missing or processed files
+                self.logger.warning(f"File watcher queue overflow: '{self.path}'")
+                self._seen = set()
+                self.rescan()
+            elif len(name) > 0:
+                self.dispatch(os.fsdecode(name))
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
+
+def _get_mtime(filename):
+    try:
+        return os.path.getmtime(filename)
+    except FileNotFoundError:
+        return 0
+
+# File watchers shared by all subscribers in the process (one for each folder)
+_watchers = {}
+_watchers_lock = Lock()
+
+def get_file_watcher(path, poll_interval=1, logger_name='None'):
+    """ Returns started file watcher for the <path> (it is created only once per process) """
+    path = os.path.abspath(path)
+    with _watchers_lock:
+        watcher = _watchers.get(path)
+        if watcher is None or not watcher.is_alive():
+            watcher = FileWatcher(path, poll_interval=poll_interval, logger_name=logger_name)
+            watcher.start()
+            _watchers[path] = watcher
+        return watcher
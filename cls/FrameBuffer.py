@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import os, logging
+import mmap
+import struct
+import json
+import time
+import numpy as np
+import cv2
+
+class FrameBuffer():
+    """ Ring buffer of raw frames in shared memory (memory mapped file inside RAM storage folder).
+    Recorder writes frames into it, watcher and object detector read them as numpy views,
+    so there is no need to encode/decode image files for every analysed frame.
+    File layout:
+        header: magic, camera name, frame shape (height, width, channels), number of slots, count of written frames
+        slot:   sequence (odd while frame is being written), frame_num, timestamp + raw frame data
+    """
+    MAGIC = b'SXVRSFB1'
+    _header = struct.Struct('<8s32s4Iq')
+    _slot_header = struct.Struct('<Qqd')
+    HEADER_SIZE = 64
+    SLOT_HEADER_SIZE = 64
+
+    def __init__(self, filename, name='', shape=None, slots=16, create=False, logger_name='None'):
+        """ Attach to existing buffer file, or create new one (only recorder must create it)
+        """
+        self.logger = logging.getLogger(f"{logger_name}:FrameBuffer")
+        self.filename = filename
+        self.name = name
+        if create:
+            self.create(shape, slots)
+        self.file = open(filename, 'r+b' if create else 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+        magic, name, height, width, channels, self.slots, write_count = self._header.unpack_from(self.mm, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"Wrong frame buffer file: {filename}")
+        self.name = name.rstrip(b'\0').decode('utf-8')
+        self.shape = (height, width, channels)
+        self.frame_size = height * width * channels
+        self.slot_size = self.SLOT_HEADER_SIZE + (self.frame_size + 63) // 64 * 64
+        # reader starts from the latest written frame
+        self.write_count = write_count
+        self.read_count = write_count
+        self.cnt_lost = 0
+
+    def create(self, shape, slots):
+        """ Create buffer file. If file already exists with the same shape, then continue to use it,
+        so watchers attached to it will not notice recorder restart
+        """
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename, 'rb') as f:
+                    magic, _, height, width, channels, _slots, _ = self._header.unpack(f.read(self._header.size))
+                if magic == self.MAGIC and (height, width, channels) == tuple(shape) and _slots == slots:
+                    return
+            except (OSError, struct.error):
+                pass
+        height, width, channels = shape
+        slot_size = self.SLOT_HEADER_SIZE + (height * width * channels + 63) // 64 * 64
+        # create new file and rename it, so readers can detect that buffer was replaced (by inode change)
+        filename_tmp = f'{self.filename}.tmp'
+        with open(filename_tmp, 'wb') as f:
+            f.truncate(self.HEADER_SIZE + slots * slot_size)
+            f.write(self._header.pack(self.MAGIC, self.name.encode('utf-8')[:32], height, width, channels, slots, 0))
+        os.rename(filename_tmp, self.filename)
+        self.logger.debug(f"Created frame buffer: {self.filename} shape={shape} slots={slots}")
+
+    def close(self):
+        try:
+            self.mm.close()
+        except (AttributeError, BufferError):
+            pass
+        self.file.close()
+
+    def is_current(self):
+        """ Returns False if buffer file was removed or replaced by recorder (i.e. frame shape is changed)"""
+        try:
+            return os.stat(self.filename).st_ino == self.inode
+        except FileNotFoundError:
+            return False
+
+    def _slot_offset(self, slot):
+        return self.HEADER_SIZE + slot * self.slot_size
+
+    def _view(self, slot):
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.mm, offset=self._slot_offset(slot) + self.SLOT_HEADER_SIZE)
+
+    def write(self, frame, frame_num, timestamp=None, convert=None):
+        """ Write frame into the next slot (only for recorder).
+        If <convert> is set, then frame is converted by cv2.cvtColor directly into the slot
+        Returns: slot number
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        slot = self.write_count % self.slots
+        offset = self._slot_offset(slot)
+        seq = self._slot_header.unpack_from(self.mm, offset)[0]
+        # odd sequence marks that slot is being written
+        self._slot_header.pack_into(self.mm, offset, seq | 1, -1, 0)
+        view = self._view(slot)
+        if convert is None:
+            np.copyto(view, frame)
+        else:
+            cv2.cvtColor(frame, convert, dst=view)
+        self._slot_header.pack_into(self.mm, offset, (seq | 1) + 1, frame_num, timestamp)
+        self.write_count += 1
+        struct.pack_into('<q', self.mm, self._header.size - 8, self.write_count)
+        return slot
+
+    def get_new_frames(self):
+        """ Returns list of (slot, frame_num, timestamp) written since the last call (only for readers).
+        If reader is too slow, then oldest frames are skipped
+        """
+        self.write_count = struct.unpack_from('<q', self.mm, self._header.size - 8)[0]
+        if self.write_count < self.read_count:
+            # buffer was recreated
+            self.read_count = self.write_count
+        # keep one slot gap, as it can be overwritten right now
+        if self.write_count - self.read_count > self.slots - 1:
+            self.cnt_lost += self.write_count - self.read_count - (self.slots - 1)
+            self.read_count = self.write_count - (self.slots - 1)
+        frames = []
+        while self.read_count < self.write_count:
+            slot = self.read_count % self.slots
+            seq, frame_num, timestamp = self._slot_header.unpack_from(self.mm, self._slot_offset(slot))
+            if seq % 2 == 0 and frame_num >= 0:
+                frames.append((slot, frame_num, timestamp))
+            self.read_count += 1
+        return frames
+
+    def is_valid(self, slot, frame_num):
+        """ Check that slot still contains required frame (i.e. it is not overwritten by recorder)"""
+        seq, _frame_num, _ = self._slot_header.unpack_from(self.mm, self._slot_offset(slot))
+        return seq % 2 == 0 and _frame_num == frame_num
+
+    def get_frame(self, slot, frame_num):
+        """ Returns numpy view of the frame inside shared memory (no copy is made), or None if frame is already overwritten.
+        Caller must check <is_valid> after processing, as view can be overwritten at any time
+        """
+        if not self.is_valid(slot, frame_num):
+            return None
+        return self._view(slot)
+
+    def write_reference(self, filename, slot, frame_num):
+        """ Write small file with reference to the frame, which can be passed instead of image file (i.e. for object detection)"""
+        with open(f'{filename}.tmp', 'w') as f:
+            f.write(json.dumps({'frame_buffer': self.filename, 'slot': slot, 'frame_num': frame_num}))
+        os.rename(f'{filename}.tmp', filename)
+
+# Frame buffers attached by readers of the reference files
+_attached = {}
+
+def read_reference(filename, logger_name='None'):
+    """ If <filename> is a frame reference file, then returns tuple (frame_buffer, slot, frame_num)
+    otherwise returns None (i.e. it is a regular image file)
+    """
+    with open(filename, 'rb') as f:
+        if f.read(1) != b'{':
+            return None
+        ref = json.loads(b'{' + f.read())
+    frame_buffer = _attached.get(ref['frame_buffer'])
+    if frame_buffer is None or not frame_buffer.is_current():
+        if not frame_buffer is None:
+            frame_buffer.close()
+        frame_buffer = FrameBuffer(ref['frame_buffer'], logger_name=logger_name)
+        _attached[ref['frame_buffer']] = frame_buffer
+    return frame_buffer, ref['slot'], ref['frame_num']
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import logging
+from threading import Lock
+from queue import Queue, Empty
+import numpy as np
+
+class FramePool():
+    """ Pool of preallocated frames. Frames are read from ffmpeg directly into them,
+    so there is no memory allocation for each frame.
+    Frame can be shared between several consumers (pipeline stages): each of them must call <retain> before
+    and <release> after usage. Frame returns into the pool when it is released by all consumers
+    """
+    def __init__(self, shape, size=4, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:FramePool")
+        self.shape = tuple(shape)
+        self.size = size
+        self._free = Queue()
+        self._refs = {}
+        self._lock = Lock()
+        for _ in range(size):
+            self._free.put(np.empty(self.shape, np.uint8))
+
+    def acquire(self, timeout=None):
+        """ Take free frame from the pool. Returns None if there is no free frame during <timeout> """
+        try:
+            frame = self._free.get(timeout=timeout)
+        except Empty:
+            return None
+        with self._lock:
+            self._refs[id(frame)] = 1
+        return frame
+
+    def retain(self, frame):
+        """ Register one more consumer of the frame """
+        with self._lock:
+            self._refs[id(frame)] += 1
+
+    def release(self, frame):
+        """ Return frame back into the pool (when it is released by all consumers) """
+        with self._lock:
+            self._refs[id(frame)] -= 1
+            if self._refs[id(frame)] > 0:
+                return
+            del self._refs[id(frame)]
+        self._free.put(frame)
+
+def read_frame(pipe, frame):
+    """ Read exactly one frame from the <pipe> into preallocated numpy <frame>.
+    Returns False if pipe is closed before the whole frame is received
+    """
+    buffer = memoryview(frame).cast('B')
+    pos = 0
+    while pos < len(buffer):
+        cnt = pipe.readinto(buffer[pos:])
+        if not cnt:
+            return False
+        pos += cnt
+    return True
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, Condition, Lock
+import cv2
+import numpy as np
+
+class MotionBatch(Thread):
+    """ Batch engine of motion detection for all cameras of the process.
+    Camera watchers prepare their frames (resize, grayscale, blur) and submit them to the engine.
+    Frames of the same size are stacked into one numpy array together with their backgrounds, and difference,
+    threshold and bounding box of changed pixels are calculated in one vectorized pass.
+    Contour analysis runs only for frames, where changed pixels can form a contour of the minimal area
+    (deviation of the difference is calculated by OpenCV on the view of the stacked array, it is faster than numpy reduction).
+    Batch is made of frames which came while the previous batch was processed (not more than <max_batch> frames),
+    and if <max_wait> is set, then engine waits up to <max_wait> seconds for more frames
+    """
+    def __init__(self, max_batch=64, max_wait=0, logger_name='None'):
+        Thread.__init__(self, name='MotionBatch')
+        self.daemon = True
+        self.logger = logging.getLogger(f"{logger_name}:MotionBatch")
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait
+        self._cond = Condition()
+        self._items = deque() # [(future, detector, img_new, frame_orig, timestamp, filename)]
+        self._stopped = False
+        self.cnt_batches = 0
+        self.cnt_frames = 0
+        self.cnt_contours = 0 # frames passed prefilter to contour analysis
+
+    def submit(self, detector, img_new, frame_orig, timestamp=None, filename=None):
+        """ Submit prepared image <img_new> of the motion <detector> (its background model must support <update>, see BackgroundModel.is_batch)
+        Returns concurrent.futures.Future with the result of detection
+        """
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                future.set_exception(RuntimeError('Motion batch engine is stopped'))
+            else:
+                self._items.append((future, detector, img_new, frame_orig, timestamp, filename))
+                self._cond.notify()
+        return future
+
+    def detect(self, detector, img_new, frame_orig, timestamp=None, filename=None):
+        """ Submit image and wait for the result (returns the same as MotionDetector.detect_frame) """
+        return self.submit(detector, img_new, frame_orig, timestamp, filename).result()
+
+    def _get_batch(self):
+        with self._cond:
+            while len(self._items) == 0 and not self._stopped:
+                self._cond.wait()
+            deadline = time.time() + self.max_wait
+            while len(self._items) < self.max_batch and not self._stopped:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+            return [self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))]
+
+    def run(self):
+        while True:
+            batch = self._get_batch()
+            if len(batch) == 0:
+                break
+            try:
+                self.process_batch(batch)
+            except Exception as ex:
+                self.logger.exception('Motion detection batch failed')
+                for item in batch:
+                    if not item[0].done():
+                        item[0].set_exception(ex)
+
+    def process_batch(self, batch):
+        """ Update background models and group frames by size and threshold, then compare each group in one pass """
+        self.cnt_batches += 1
+        self.cnt_frames += len(batch)
+        groups = {} # {(shape, threshold): [(item, img_bg)]}
+        for item in batch:
+            future, detector, img_new, frame_orig, timestamp, filename = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            img_bg = detector.background.update(img_new)
+            if img_bg is None or img_bg is NotImplemented:
+                future.set_result(None) # there is not enough frames for the background
+                continue
+            groups.setdefault((img_new.shape, detector.cnfg.motion_detector_threshold), []).append((item, img_bg))
+        for (_shape, threshold), group in groups.items():
+            self.process_group(group, threshold)
+
+    def process_group(self, group, threshold):
+        """ Difference, threshold and changed pixels statistics of the frames of the same size in one pass """
+        cnt, (height, width) = len(group), group[0][1].shape
+        # all frames are processed as one tall image (operations are elementwise)
+        img_new = np.stack([item[2] for item, _img_bg in group])
+        img_bg = np.stack([img_bg for _item, img_bg in group])
+        img_delta = cv2.absdiff(img_new.reshape(cnt * height, width), img_bg.reshape(cnt * height, width))
+        # changes outside of the motion detection areas are ignored
+        masks = [item[1].mask for item, _img_bg in group]
+        if any(not mask is None for mask in masks):
+            mask = np.stack([np.full((height, width), 255, np.uint8) if mask is None else mask for mask in masks])
+            img_delta = cv2.bitwise_and(img_delta, mask.reshape(cnt * height, width))
+        img_thresh = cv2.threshold(img_delta, threshold, 255, cv2.THRESH_BINARY)[1]
+        img_delta = img_delta.reshape(cnt, height, width)
+        img_thresh = img_thresh.reshape(cnt, height, width)
+        # contour can not be bigger than the bounding box of changed pixels (+1 pixel on each side after dilation)
+        rows = cv2.reduce(img_thresh.reshape(cnt * height, width), 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).reshape(cnt, height) > 0
+        area_bound = np.zeros(cnt, np.int64)
+        changed = np.flatnonzero(rows.any(axis=1))
+        if len(changed) > 0:
+            rows = rows[changed]
+            cols = img_thresh[changed].max(axis=1) > 0
+            box_height = height - rows[:, ::-1].argmax(axis=1) - rows.argmax(axis=1) + 2
+            box_width = width - cols[:, ::-1].argmax(axis=1) - cols.argmax(axis=1) + 2
+            area_bound[changed] = box_height * box_width
+        for k, (item, _img_bg) in enumerate(group):
+            future, detector, _img_new, frame_orig, timestamp, filename = item
+            self._set_result(future, detector.check_motion, img_new[k], img_bg[k], img_delta[k], img_thresh[k], frame_orig, timestamp, filename,
+                        area_bound=int(area_bound[k]))
+            if detector.cnfg.is_motion_contour_detection and area_bound[k] >= detector.contour_min_area:
+                self.cnt_contours += 1
+
+    def _set_result(self, future, func, *args, **kwargs):
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as ex:
+            future.set_exception(ex)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            items = list(self._items)
+            self._items.clear()
+            self._cond.notify_all()
+        for item in items:
+            item[0].cancel()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self):
+        return {
+            'batches': self.cnt_batches,
+            'frames': self.cnt_frames,
+            'avg_batch': round(self.cnt_frames / self.cnt_batches, 2) if self.cnt_batches > 0 else 0,
+            'contours': self.cnt_contours,
+        }
+
+# Batch engine shared by all cameras in the process
+_batch = None
+_batch_lock = Lock()
+
+def get_motion_batch(max_batch=64, max_wait=0, logger_name='None'):
+    """ Returns started motion batch engine (it is created only once per process) """
+    global _batch
+    with _batch_lock:
+        if _batch is None or not _batch.is_alive():
+            _batch = MotionBatch(max_batch=max_batch, max_wait=max_wait, logger_name=logger_name)
+            _batch.start()
+        return _batch
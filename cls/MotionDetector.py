@@ -5,145 +5,223 @@ import cv2
 import matplotlib.path as mplPath
 import numpy as np
 import math
-from random import randrange
 import imutils
 
+from cls.BackgroundModel import create_background_model
+
 class MotionDetector():
     """ Loads frames and compares them for motion detection
+    If <batch> engine is set, then prepared frames are compared together with frames of other cameras
+    <frame_shape> is (height, width) of the camera stream, pixel coordinates of motion detection areas are given in it
+    (received frames can be smaller, i.e. analysis stream). If it is not known, then the size of the first frame is used
     """
-    def __init__(self, cnfg, logger_name='None'):
+    def __init__(self, cnfg, batch=None, frame_shape=None, logger_name='None'):
         self.logger = logging.getLogger(f"{logger_name}:MotionDetector")
         self.cnfg = cnfg
+        self.batch = batch
+        self.frame_shape = None if frame_shape is None or None in frame_shape[:2] else tuple(frame_shape[:2])
         self.scale = None
+        self.size = None # (width, height) of compared images
+        # mask of the areas where motion is detected (at the size of compared images), None if areas are not defined
+        self.mask = None
         self.contour_min_area = None
         self.contour_max_area = None
-        self.images_bg = []
-        self.last_background = None
+        # background model is selected by {background_model} config
+        self.background = create_background_model(cnfg, save_debug=self.save_debug_bg_img, logger_name=logger_name)
         self.cnt_frames_changed = 0     
         self.cnt_frames_static = 0
+        # score of the latest detected motion (max contour area, or deviation of the difference)
+        self.score = 0
+        # time of the latest compared frame and of the latest detected motion
+        self.timestamp = None
+        self.motion_timestamp = None
 
     
     def detect(self, filename):
         """ Loads image from filename and compare with a previous
+        Instead of filename it is possible to pass the frame itself (numpy array in BGR format)
+        """
+        if isinstance(filename, np.ndarray):
+            return self.detect_frame(filename)
+        frame = self.load_frame(filename)
+        if frame is None:
+            self.logger.warning(f"Can't read image file: {filename}")
+            return None
+        return self.detect_frame(frame, filename=filename)
+
+    def load_frame(self, filename):
+        """ Decode image file for motion detection. When the scale is known (after the first file), 
+        image is decoded in grayscale at reduced resolution, which is still not smaller than required for comparing
         """
-        #self.logger.debug(f'motion detection start: {filename}')
-        is_motion_detected = False
-        frame_orig = cv2.imread(filename)
-        height, width, channels = frame_orig.shape
-        # Calculate scale coefitient only once, in case it is not defined yet
         if self.scale is None:
-            if height > self.cnfg.motion_detector_max_image_height:
-                scale_height = self.cnfg.motion_detector_max_image_height / height
-            else:
-                scale_height = 1
-            if width > self.cnfg.motion_detector_max_image_width:
-                scale_width = self.cnfg.motion_detector_max_image_width / width
-            else:
-                scale_width = 1
-            self.scale = min(scale_height, scale_width)
+            return cv2.imread(filename)
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+            if self.scale * factor <= 1:
+                return cv2.imread(filename, flag)
+        return cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+
+    def init_size(self, height, width):
+        """ Calculate scale coefitient and size of compared images (only once, for the first frame) """
+        if height > self.cnfg.motion_detector_max_image_height:
+            scale_height = self.cnfg.motion_detector_max_image_height / height
+        else:
+            scale_height = 1
+        if width > self.cnfg.motion_detector_max_image_width:
+            scale_width = self.cnfg.motion_detector_max_image_width / width
+        else:
+            scale_width = 1
+        self.scale = min(scale_height, scale_width)
+        self.size = (math.floor(width*self.scale), math.floor(height*self.scale))
+        self.mask = self.create_mask(*(self.frame_shape or (height, width)))
+        # background model checks changes of its frames inside the same areas
+        self.background.mask = self.mask
+
+    def create_mask(self, height, width):
+        """ Rasterize {include_areas} and {exclude_areas} polygons at the size of compared images (camera stream is <height> x <width>) """
+        if len(self.cnfg.motion_include_areas) == 0 and len(self.cnfg.motion_exclude_areas) == 0:
+            return None
+        size_width, size_height = self.size
+        if len(self.cnfg.motion_include_areas) > 0:
+            mask = np.zeros((size_height, size_width), np.uint8)
+            cv2.fillPoly(mask, self.get_polygons(self.cnfg.motion_include_areas, height, width), 255)
+        else:
+            mask = np.full((size_height, size_width), 255, np.uint8)
+        if len(self.cnfg.motion_exclude_areas) > 0:
+            cv2.fillPoly(mask, self.get_polygons(self.cnfg.motion_exclude_areas, height, width), 0)
+        self.logger.debug(f"Motion detection mask: {cv2.countNonZero(mask)} of {size_width*size_height} pixels")
+        return mask
+
+    def get_polygons(self, areas, height, width):
+        """ Convert area polygons into points of compared images. Point is [x, y] in pixels of the camera stream (<height> x <width>)
+        or in percents of the frame size
+        """
+        scale_x, scale_y = self.size[0] / width, self.size[1] / height
+        polygons = []
+        for area in areas:
+            if len(area) < 3:
+                self.logger.warning(f"Motion detection area must have at least 3 points: {area}")
+                continue
+            points = [(self.define_point(x, width) * scale_x, self.define_point(y, height) * scale_y) for x, y in area]
+            polygons.append(np.round(np.array(points)).astype(np.int32))
+        return polygons
+
+    def define_point(self, value, size):
+        """ if coordinate is in percentage, then need to calculate actual value """
+        if str(value).endswith('%'):
+            return float(value.strip(' %'))*size/100
+        return float(value)
+
+    def detect_frame(self, frame_orig, timestamp=None, filename=None):
+        """ Compare frame with a previous (numpy array in BGR format or grayscale, of any resolution: it is resized if needed)
+        <timestamp> is the time when frame is taken, <filename> is used to save the last motion frame in full resolution
+        """
+        img_new = self.prepare_frame(frame_orig, timestamp)
+        # frames of many cameras are compared together by batch engine
+        if not self.batch is None and self.background.is_batch:
+            return self.batch.detect(self, img_new, frame_orig, timestamp, filename)
+        # compare new image with background model (and update the model)
+        background = self.background.apply(img_new)
+        # if there is not enough frames for the background, then just store it
+        if background is None:
+            return None
+        img_prev, img_delta = background
+        # changes outside of the motion detection areas are ignored
+        if not self.mask is None:
+            img_delta = cv2.bitwise_and(img_delta, self.mask)
+        # find difference
+        try:
+            img_thresh = cv2.threshold(img_delta, self.cnfg.motion_detector_threshold, 255, cv2.THRESH_BINARY)[1]
+        except cv2.error:
+            self.logger.exception(f'img_prev:{img_prev.shape}  | img_new: {img_new.shape} | frame_orig: {frame_orig.shape} | scale={self.scale}')
+            return None
+        return self.check_motion(img_new, img_prev, img_delta, img_thresh, frame_orig, timestamp, filename)
+
+    def prepare_frame(self, frame_orig, timestamp=None):
+        """ Resize frame to the size of compared images, convert to grayscale and blur it """
+        self.timestamp = timestamp
+        if self.scale is None:
+            self.init_size(*frame_orig.shape[:2])
+        width, height = self.size
         # If it is required, then resize/scale the image
-        if self.scale < 1:
-            height = math.floor(height*self.scale)
-            width = math.floor(width*self.scale)
-            frame = cv2.resize(frame_orig, (width, height))
+        if frame_orig.shape[1] != width or frame_orig.shape[0] != height:
+            frame = cv2.resize(frame_orig, self.size)
         else:
             frame = frame_orig
-        # Prepare image for comparing
-        img_new = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        img_new = cv2.GaussianBlur(img_new, (self.cnfg.motion_blur_size, self.cnfg.motion_blur_size), 0)
-        # remember new image for background, and delete oldest background image
-        self.images_bg.append(img_new)
-        while len(self.images_bg) > self.cnfg.motion_detector_bg_frame_count:
-            self.images_bg.remove(self.images_bg[0])
-        # if this is a first frame, then just store it
-        if len(self.images_bg) < 2:
-            return None
-        else:            
-            i = 0 if len(self.images_bg) <= 2 else randrange(len(self.images_bg)-2)
-            img_prev = self.images_bg[i]
-            # find difference
-            try:
-                img_delta = cv2.absdiff(img_prev, img_new)
-                img_thresh = cv2.threshold(img_delta, self.cnfg.motion_detector_threshold, 255, cv2.THRESH_BINARY)[1]
-            except cv2.error:
-                self.logger.exception(f'img_prev:{img_prev.shape}  | img_new: {img_new.shape} | frame_orig: {frame_orig.shape} | scale={self.scale}')
-            # if detect by countour area
-            if self.cnfg.is_motion_contour_detection:
-                # Calculate min/max area only for the first frame
-                if self.contour_min_area is None or self.contour_max_area is None:
-                    self.contour_min_area = self.define_minmax_area(self.cnfg.motion_contour_min_area, height, width)
-                    self.contour_max_area = self.define_minmax_area(self.cnfg.motion_contour_max_area, height, width)
+        img_new = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(img_new, (self.cnfg.motion_blur_size, self.cnfg.motion_blur_size), 0)
+
+    def check_motion(self, img_new, img_prev, img_delta, img_thresh, frame_orig, timestamp=None, filename=None, area_bound=None):
+        """ Decide if there is a motion by the difference with background, and count changed/static frames.
+        <area_bound> (upper bound of the contour area) can be precalculated by batch engine:
+        if contours can not be big enough, then contour analysis is skipped
+        """
+        is_motion_detected = False
+        width, height = self.size
+        # if detect by countour area
+        if self.cnfg.is_motion_contour_detection:
+            # Calculate min/max area only for the first frame
+            if self.contour_min_area is None or self.contour_max_area is None:
+                self.contour_min_area = self.define_minmax_area(self.cnfg.motion_contour_min_area, height, width)
+                self.contour_max_area = self.define_minmax_area(self.cnfg.motion_contour_max_area, height, width)
+            if not area_bound is None and area_bound < self.contour_min_area:
+                contours = []
+            else:
                 # dilate the thresholded image to fill in holes, then find contours
                 # on thresholded image
                 img_thresh = cv2.dilate(img_thresh, None, iterations=1)
                 contours = cv2.findContours(img_thresh.copy(), cv2.RETR_EXTERNAL,
                     cv2.CHAIN_APPROX_SIMPLE)
                 contours = imutils.grab_contours(contours)            
-                if len(contours)>self.cnfg.motion_contour_max_count:                    
-                    self.logger.warning(f"Too many counturs found: '{len(contours)} > {self.cnfg.motion_contour_max_count}'. Skipping..")
-                    return None
-                else:
-                    self.logger.debug(f"Counturs found: '{len(contours)}'")
-                # loop over all contours                            
-                max_area = 0
-                for contour in contours:
-                    area = cv2.contourArea(contour)
-                    max_area = max(max_area, area)
-                is_motion_detected = max_area >= self.contour_min_area and max_area <= self.contour_max_area
-            else:
-                _, dev_delta = cv2.meanStdDev(img_delta)
-                #is_motion_detected = dev_delta > self.cnfg.detect_by_diff_threshold
-                is_motion_detected = any(i >= self.cnfg.detect_by_diff_threshold for i in dev_delta)                    
-
-            # if significant changes detected
-            if is_motion_detected:
-                # remove image from background list if it is not static
-                self.background_check()
-                # save to last_motion file
-                filename_last_motion = self.cnfg.filename_last_motion()
-                if not filename_last_motion is None:
-                    cv2.imwrite(filename_last_motion, frame_orig)
-                # save image for debug
-                self.save_debug_img(img_new, img_prev, img_delta, img_thresh)
-                # count number of changed frames                
-                self.cnt_frames_changed += 1
-                self.cnt_frames_static = 0
-                if self.cnfg.is_motion_contour_detection:
-                    self.logger.debug(f"frames_changed= {self.cnt_frames_changed}[{self.cnfg.motion_min_frames_changes}] area= {max_area}[{self.cnfg.motion_contour_min_area}, {self.cnfg.motion_contour_max_area}]")
-                else:
-                    self.logger.debug(f"frames_changed= {self.cnt_frames_changed}[{self.cnfg.motion_min_frames_changes}] dev= {dev_delta}")
-                is_motion_detected = (self.cnt_frames_changed >= self.cnfg.motion_min_frames_changes)
+            if len(contours)>self.cnfg.motion_contour_max_count:                    
+                self.logger.warning(f"Too many counturs found: '{len(contours)} > {self.cnfg.motion_contour_max_count}'. Skipping..")
+                return None
             else:
-                self.cnt_frames_static += 1
-                #self.logger.debug(f"Cooldown: cnt_frames_static={self.cnt_frames_static}")
-                if self.cnt_frames_static >= self.cnfg.motion_max_frames_static:
-                    if self.cnt_frames_changed>0:
-                        self.logger.debug(f"Reset max frames_changed= {self.cnt_frames_changed}")
-                        self.cnt_frames_changed = 0
-        #self.logger.debug(f'motion detection end: {filename}')
-        return is_motion_detected
-
-    def background_check(self):
-        """Check if last image for the background is static:"""
-        result = False
-        if self.last_background is None:
-            result = True
+                self.logger.debug(f"Counturs found: '{len(contours)}'")
+            # loop over all contours                            
+            max_area = 0
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                max_area = max(max_area, area)
+            is_motion_detected = max_area >= self.contour_min_area and max_area <= self.contour_max_area
+            score = max_area
         else:
-            #compare with last motion frame
-            img_delta = cv2.absdiff(self.last_background , self.images_bg[-1])
             _, dev_delta = cv2.meanStdDev(img_delta)
-            discard_background = dev_delta > self.cnfg.detect_by_diff_threshold
-            if not self.cnfg._filename_debug_bg is None:
-                img_blank = np.zeros(img_delta.shape, np.uint8)
-                img_blank = cv2.putText(img_blank, f'IS BG: { not discard_background}', (10,10), cv2.FONT_HERSHEY_SIMPLEX,.3,(255, 0, 0) )        
-                self.save_debug_img(self.images_bg[-1], self.last_background, img_delta, img_blank, filename = self.cnfg.filename_debug_bg())
-            if discard_background:
-                self.images_bg = self.images_bg[:-1]
+            #is_motion_detected = dev_delta > self.cnfg.detect_by_diff_threshold
+            is_motion_detected = any(i >= self.cnfg.detect_by_diff_threshold for i in dev_delta)                    
+            score = float(dev_delta.max())
+
+        # if significant changes detected
+        if is_motion_detected:
+            self.score = score
+            # remove image from background list if it is not static
+            self.background.on_motion()
+            # save to last_motion file
+            filename_last_motion = self.cnfg.filename_last_motion()
+            if not filename_last_motion is None:
+                # file was decoded at reduced resolution, so read it again
+                frame_last = frame_orig if filename is None else cv2.imread(filename)
+                if not frame_last is None:
+                    cv2.imwrite(filename_last_motion, frame_last)
+            # save image for debug
+            self.save_debug_img(img_new, img_prev, img_delta, img_thresh)
+            self.motion_timestamp = timestamp
+            # count number of changed frames                
+            self.cnt_frames_changed += 1
+            self.cnt_frames_static = 0
+            if self.cnfg.is_motion_contour_detection:
+                self.logger.debug(f"frames_changed= {self.cnt_frames_changed}[{self.cnfg.motion_min_frames_changes}] area= {max_area}[{self.cnfg.motion_contour_min_area}, {self.cnfg.motion_contour_max_area}]")
             else:
-                result = True
-        if len(self.images_bg)>0:
-            self.last_background  = self.images_bg[-1]
-        return result
+                self.logger.debug(f"frames_changed= {self.cnt_frames_changed}[{self.cnfg.motion_min_frames_changes}] dev= {dev_delta}")
+            is_motion_detected = (self.cnt_frames_changed >= self.cnfg.motion_min_frames_changes)
+        else:
+            self.cnt_frames_static += 1
+            #self.logger.debug(f"Cooldown: cnt_frames_static={self.cnt_frames_static}")
+            if self.cnt_frames_static >= self.cnfg.motion_max_frames_static:
+                if self.cnt_frames_changed>0:
+                    self.logger.debug(f"Reset max frames_changed= {self.cnt_frames_changed}")
+                    self.cnt_frames_changed = 0
+        #self.logger.debug(f'motion detection end: {filename}')
+        return is_motion_detected
 
     def define_minmax_area(self, value, height, width):
         """ if min and max area in percentage, then need to calculate actual value """
@@ -155,6 +233,10 @@ class MotionDetector():
         except:
             return int(value.strip())
 
+    def save_debug_bg_img(self, img_new, img_prev, img_delta, img_check):
+        if not self.cnfg._filename_debug_bg is None:
+            self.save_debug_img(img_new, img_prev, img_delta, img_check, filename=self.cnfg.filename_debug_bg())
+
     def save_debug_img(self, img_new, img_prev, img_delta, img_thresh, filename=None):
         """Function needed just for debugging and tuning motion detection. It saves: comparing frames and their substraction"""        
         if filename is None:
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import logging
+import time
+import shlex
+import itertools
+from subprocess import Popen, PIPE, TimeoutExpired
+from concurrent.futures import Future, TimeoutError
+from threading import Thread, Lock
+
+from cls.ControlChannel import encode_message, decode_message
+
+class _Worker():
+    """ Worker process (sxvrs_motion.py) with its pending requests """
+    def __init__(self, index, cmd):
+        self.index = index
+        self.proc = Popen(shlex.split(cmd), stdin=PIPE, stdout=PIPE)
+        self.pending = {} # {request_id: future}
+
+class MotionPool():
+    """ Pool of worker processes for motion detection (sxvrs_motion.py), so motion analysis is not limited by GIL of the daemon process.
+    Cameras are sharded between workers by their order in config, each worker keeps motion detector state of its cameras
+    and processes requests in order, so frames of one camera are compared in order.
+    Frames are not sent to workers: they read them from shared memory (frame buffer of the recorder, or image file in RAM folder),
+    only small JSON messages are passed thru stdin/stdout of the worker. Died worker is restarted (its pending requests are failed)
+    """
+    def __init__(self, cnfg, restart_delay=1, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:MotionPool")
+        self.cnfg = cnfg
+        self.processes = cnfg.motion_pool_processes
+        self.restart_delay = restart_delay
+        self._workers = [None] * self.processes
+        self._request_ids = itertools.count()
+        self._lock = Lock()
+        self._stopped = False
+
+    def start(self):
+        with self._lock:
+            for index in range(self.processes):
+                self._start_worker(index)
+
+    def _start_worker(self, index):
+        worker = _Worker(index, self.cnfg.cmd_motion_pool(index=index))
+        self._workers[index] = worker
+        Thread(target=self._read_results, args=(worker,), name=f'MotionPool:{index}', daemon=True).start()
+        self.logger.debug(f'Started motion detection worker #{index}: pid={worker.proc.pid}')
+
+    def get_worker(self, camera):
+        """ Worker process of the camera (fixed shard) """
+        cameras = list(self.cnfg.recorders)
+        index = cameras.index(camera) if camera in cameras else len(camera)
+        return self._workers[index % self.processes]
+
+    def _send(self, worker, msg):
+        worker.proc.stdin.write(encode_message(msg))
+        worker.proc.stdin.flush()
+
+    def submit(self, camera, **source):
+        """ Submit frame of the camera for motion detection, <source> is filename=... or frame_buffer=..., slot=..., frame_num=..., timestamp=...
+        Returns concurrent.futures.Future with result (is_motion, score)
+        """
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                future.set_exception(RuntimeError('Motion pool is stopped'))
+                return future
+            worker = self.get_worker(camera)
+            request_id = next(self._request_ids)
+            worker.pending[request_id] = future
+            future.worker = worker # to kill the worker, if it does not answer
+            try:
+                self._send(worker, {'cmd': 'detect', 'id': request_id, 'name': camera, **source})
+            except (OSError, ValueError) as ex:
+                del worker.pending[request_id]
+                future.set_exception(ex)
+        return future
+
+    def kill_worker(self, future):
+        """ Kill worker, which does not answer to the request <future> (i.e. it is hung). Worker is restarted by its reader thread """
+        worker = getattr(future, 'worker', None)
+        if worker is None or future.done():
+            return
+        self.logger.error(f'Motion detection worker #{worker.index} does not answer in {self.cnfg.motion_pool_timeout} sec, killing it')
+        try:
+            worker.proc.kill()
+        except OSError:
+            pass
+
+    def reset(self, camera):
+        """ Forget motion detector state of the camera """
+        with self._lock:
+            if not self._stopped:
+                try:
+                    self._send(self.get_worker(camera), {'cmd': 'reset', 'name': camera})
+                except (OSError, ValueError):
+                    pass # worker is restarting
+
+    def _read_results(self, worker):
+        for line in worker.proc.stdout:
+            msg = decode_message(line)
+            if msg is None:
+                continue
+            with self._lock:
+                future = worker.pending.pop(msg.get('id'), None)
+            if future is None:
+                continue
+            if 'error' in msg:
+                future.set_exception(RuntimeError(msg['error']))
+            else:
+                future.set_result((msg.get('result'), msg.get('score', 0)))
+        code = worker.proc.wait()
+        with self._lock:
+            pending, worker.pending = worker.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError('Motion detection worker is finished'))
+        if not self._stopped:
+            self.logger.error(f'Motion detection worker #{worker.index} is finished (exit code: {code}), restarting')
+            time.sleep(self.restart_delay)
+            with self._lock:
+                if not self._stopped:
+                    self._start_worker(worker.index)
+
+    def stop(self, timeout=None):
+        """ Close stdin of the workers and wait for them """
+        with self._lock:
+            self._stopped = True
+            workers = [worker for worker in self._workers if not worker is None]
+        for worker in workers:
+            try:
+                worker.proc.stdin.close()
+            except OSError:
+                pass
+        for worker in workers:
+            try:
+                worker.proc.wait(timeout)
+            except TimeoutExpired:
+                worker.proc.kill()
+
+class RemoteMotionDetector():
+    """ Motion detector of the camera running inside the worker process of the pool (used by camera watcher instead of MotionDetector) """
+    def __init__(self, pool, camera, frame_shape=None):
+        self.pool = pool
+        self.camera = camera
+        self.score = 0
+        # (height, width) of the camera stream (worker needs it to rasterize motion detection areas)
+        self.frame_shape = None if frame_shape is None or None in frame_shape[:2] else list(frame_shape[:2])
+        # worker can keep the state of the camera since the previous watcher run
+        pool.reset(camera)
+
+    def detect(self, filename):
+        """ Image file is read by the worker """
+        return self._detect(filename=filename)
+
+    def detect_ref(self, frame_buffer, slot, frame_num, timestamp=None):
+        """ Frame is read by the worker from shared memory ring buffer """
+        return self._detect(frame_buffer=frame_buffer.filename, slot=slot, frame_num=frame_num, timestamp=timestamp)
+
+    def _detect(self, **source):
+        if not self.frame_shape is None:
+            source['frame_shape'] = self.frame_shape
+        future = self.pool.submit(self.camera, **source)
+        try:
+            result, self.score = future.result(timeout=self.pool.cnfg.motion_pool_timeout)
+        except TimeoutError:
+            # hung worker is restarted, the frame is skipped
+            self.pool.kill_worker(future)
+            return None
+        return result
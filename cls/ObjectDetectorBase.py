@@ -3,13 +3,19 @@
 import os, logging
 import glob
 import time
-from threading import Thread, Event
+from threading import Event
+from concurrent.futures import Future
+import cv2
 
 from cls.StorageManager import StorageManager
 from cls.RAM_Storage import RAM_Storage
+from cls.FileWatcher import get_file_watcher
+from cls.DetectionScheduler import DetectionScheduler
 
 class ObjectDetectorBase():
     """ Base class for object detection. Must be inherited by <local> and <cloud> versions
+    Frames can be passed to detector directly by <submit> (inside the same process), 
+    or thru RAM folder as *.obj.wait files (file transport)
     """
     def __init__(self, cnfg, logger_name='None'):
         self.logger = logging.getLogger(f"{logger_name}:ObjectDetector")
@@ -20,54 +26,126 @@ class ObjectDetectorBase():
         self.ram_storage = RAM_Storage(cnfg)
         # Create storage manager
         self.storage = StorageManager(cnfg.temp_storage_path, cnfg.temp_storage_size, logger_name = self.logger.name)
+        # per camera queues of frames waiting for detection
+        self.scheduler = None
+        self.file_subscription = None
 
     def is_started(self):
         return not self._stop_event.is_set()
 
-    def thread_watch(self):
-        """ Watch folder and wait for new files
-        """
-        sleep_time = self.cnfg.object_detector_sleep_time
-        while not self._stop_event.is_set():
-            try:
-                filename = self.storage.get_first_file(f"{self.ram_storage.storage_path}/*.obj.wait", 
-                                                        start_mtime= time.time() - self.cnfg.object_detector_timeout + 2 # do not take outdated files ( +2 sec to be safe)
-                                                        )
-                if filename is None:                    
-                    #self.logger.debug(f'Wait for file. Sleep {sleep_time} sec')
-                    time.sleep(sleep_time)
-                    continue
-                if filename[-9:] == ".obj.wait":
-                    self.logger.debug(f"ObjectDetector: Found file: {filename}")
-                    filename_start = f"{filename[:-5]}.start"
-                    os.rename(filename, filename_start)
-                    self.detect(filename_start)
-            except:
-                self.logger.exception(f"Object Detection Error: {filename}")
+    def camera_of_file(self, filename):
+        """ Returns name of the camera, which saved the file into RAM folder (the longest recorder name matching file name) """
+        basename = os.path.basename(filename)
+        names = [name for name in self.cnfg.recorders if basename.startswith(name)]
+        return max(names, key=len) if len(names) > 0 else ''
+
+    def get_camera_weight(self, camera):
+        cnfg_recorder = self.cnfg.recorders.get(camera)
+        return 1 if cnfg_recorder is None else cnfg_recorder.object_detector_weight
+
+    def on_file(self, filename):
+        """ New *.obj.wait file is found in RAM folder (dispatched by file watcher, shared with camera watchers) """
+        try:
+            deadline = os.path.getmtime(filename) + self.cnfg.object_detector_timeout - 2 # +2 sec to be safe
+        except FileNotFoundError:
+            return
+        self.logger.debug(f"ObjectDetector: Found file: {filename}")
+        self.scheduler.put(self.camera_of_file(filename), (None, None, filename), deadline)
 
     def start_watch(self):
-        """ This function for running main loop: scan folder for files and start processing them
+        """ This function for running main loop: frames from all cameras (RAM folder files and directly submitted frames)
+        are processed by the fair scheduler
         """
         if not self._stop_event.is_set():
             self.logger.error('Object detector is already started')
             return
         self._stop_event.clear()
-        self.thread = Thread(target=self.thread_watch, args=())
-        self.thread.start()
-        self.logger.debug("ObjectDetector start folder watching")
+        self.scheduler = DetectionScheduler(self.process_item, release=self.release_item, queue_size=self.cnfg.object_detector_queue_size,
+                        timeout=self.cnfg.object_detector_timeout, get_weight=self.get_camera_weight, logger_name=self.logger.name)
+        self.scheduler.start()
+        if self.cnfg.object_detector_transport == 'file':
+            self.file_watcher = get_file_watcher(self.ram_storage.storage_path, poll_interval=self.cnfg.object_detector_sleep_time, logger_name=self.logger.name)
+            self.file_subscription = self.file_watcher.subscribe('*.obj.wait', self.on_file)
+            self.logger.debug("ObjectDetector start folder watching")
+
+    @property
+    def is_direct(self):
+        """ Frames are submitted directly (not thru RAM folder) """
+        return self.cnfg.object_detector_transport != 'file'
+
+    def submit(self, image=None, filename=None, camera=''):
+        """ Submit image (numpy array in BGR format) or image file of the <camera> for object detection.
+        Returns concurrent.futures.Future with result dict: {'result', 'objects', 'elapsed'}
+        If detector is too slow, then stale frames of the camera are dropped (their result is 'dropped')
+        """
+        future = Future()
+        if self.scheduler is None:
+            future.set_exception(RuntimeError('Object detector is not started'))
+        else:
+            self.scheduler.put(camera, (future, image, filename))
+        return future
+
+    def scheduler_stats(self, camera=None):
+        """ Per camera counters of the scheduler: admitted, processed, dropped, expired frames """
+        if self.scheduler is None:
+            return None
+        return self.scheduler.stats(camera)
+
+    def process_item(self, future, image, filename):
+        if future is None:
+            # file transport
+            filename_start = f"{filename[:-5]}.start"
+            try:
+                os.rename(filename, filename_start)
+            except FileNotFoundError:
+                return # file is removed by watcher on timeout
+            self.detect(filename_start)
+            return
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            if image is None:
+                image = cv2.imread(filename)
+            result = self.detect_image(image)
+            if result is NotImplemented:
+                raise NotImplementedError(f'{type(self).__name__} does not support direct transport')
+            future.set_result(result)
+        except Exception as ex:
+            self.logger.exception(f"Object Detection Error: {filename}")
+            future.set_exception(ex)
+
+    def release_item(self, item):
+        """ Called for each processed or dropped item """
+        future, _image, filename = item
+        if future is None:
+            # let camera watcher know, that the frame will not be processed
+            try:
+                os.rename(filename, f"{filename[:-5]}.dropped")
+            except FileNotFoundError:
+                pass
+        elif not future.done():
+            future.set_result({'result': 'dropped', 'objects': [], 'elapsed': 0})
 
     def detect(self, filename):
         """ Abstract method, must be implementet inside derived classes
         """
         return NotImplemented
+
+    def detect_image(self, image):
+        """ Abstract method, must be implementet inside derived classes (for direct transport)
+        """
+        return NotImplemented
     
     def stop_watch(self):
         """ Abstract method, must be implementet inside derived classes
         """
-        if hasattr(self, 'thread'):
-            self._stop_event.set()
-            self.thread.join()
+        self._stop_event.set()
+        if not self.file_subscription is None:
+            self.file_watcher.unsubscribe(self.file_subscription)
+            self.file_subscription = None
             self.logger.debug("ObjectDetector stop folder watching")
+        if not self.scheduler is None:
+            self.scheduler.stop(timeout=self.cnfg.object_detector_timeout)
         return True
 
     def scan_waiting_files(self):
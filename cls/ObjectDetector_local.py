@@ -12,6 +12,7 @@ try:
 except:
     logging.warning('tensorflow is not installed')
 from cls.ObjectDetectorBase import ObjectDetectorBase
+from cls.FrameBuffer import read_reference
 
 class ObjectDetector_local(ObjectDetectorBase):
     """ Object Detection using local CPU or GPU. Make sure that you have enought CPU/GPU available, otherwice use cloud detection
@@ -58,9 +59,18 @@ class ObjectDetector_local(ObjectDetectorBase):
         if os.path.isfile(filename):
             self.logger.debug(f"ObjectDetector: open file '{filename}'")
             try:
-                self.image = cv2.imread(filename)
+                # file can be a reference to the frame inside shared memory ring buffer
+                self.frame_ref = read_reference(filename, logger_name=self.logger.name)
+                if self.frame_ref is None:
+                    self.image = cv2.imread(filename)
+                else:
+                    frame_buffer, slot, frame_num = self.frame_ref
+                    self.image = frame_buffer.get_frame(slot, frame_num)
+                    if self.image is None:
+                        self.logger.warning(f"Frame {frame_num} is already overwritten in frame buffer: '{frame_buffer.filename}'")
+                        return False
+                self.image_original = self.image
                 self.original_height, self.original_width, self.original_channels = self.image.shape
-                self.resize_image(1024,786)
                 return True
             except Exception as ex:
                 self.logger.exception(f"Error in ObjectDetector: can't open image '{filename}'")
@@ -69,8 +79,8 @@ class ObjectDetector_local(ObjectDetectorBase):
             self.logger.error(f"Can't find file: '{filename}'")
             raise FileNotFoundError
     
-    def resize_image(self, target_height, target_width):
-        height, width, channels = self.image.shape
+    def resize_image(self, image, target_height, target_width):
+        height, width, channels = image.shape
         if height > target_height:
             scale_height = target_height / height
         else:
@@ -83,52 +93,74 @@ class ObjectDetector_local(ObjectDetectorBase):
         if scale < 1:
             height = math.floor(height*scale)
             width = math.floor(width*scale)
-            self.image = cv2.resize(self.image, (width, height))               
-                    
-    def detect(self, filename):
-        """ Object Detection using CPU or GPU
+            image = cv2.resize(image, (width, height))               
+        return image
+
+    def detect_image(self, image):
+        """ Object Detection using CPU or GPU on the image (numpy array in BGR format)
         """
+        original_height, original_width = image.shape[:2]
+        image = self.resize_image(image, 1024, 786)
         objects = []
-        if self.load_image(filename):
-            # Expand dimensions since the trained_model expects images to have shape: [1, None, None, 3]
-            image_np_expanded = np.expand_dims(self.image, axis=0)
-            start_time = time.time()
-            (boxes, scores, classes, num) = self.tf_sess.run(
-                [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
-                feed_dict={self.image_tensor: image_np_expanded})
-            scores = scores[0].tolist()
-            classes = [int(x) for x in classes[0].tolist()]      
-            for i in range(boxes.shape[1]):
-                if scores[i]*100 >= self.cnfg.object_detector_min_score:
-                    self.logger.debug(f'Object detected! class:{classes[i]} score:{scores[i]}')
-                    box =  (int(boxes[0,i,0] * self.original_height),
-                            int(boxes[0,i,1] * self.original_width),
-                            int(boxes[0,i,2] * self.original_height),
-                            int(boxes[0,i,3] * self.original_width))
-                    objects.append({
-                        'box': box,
-                        'score': scores[i],
-                        'class': self.labels[classes[i]],
-                        'num': int(num[0]),                     
-                    }) 
-            if len(objects)>0:
-                result = {
-                    'result': 'ok',
-                    'objects': objects,
-                    'elapsed': time.time() - start_time,
-                }
+        # Expand dimensions since the trained_model expects images to have shape: [1, None, None, 3]
+        image_np_expanded = np.expand_dims(image, axis=0)
+        start_time = time.time()
+        (boxes, scores, classes, num) = self.tf_sess.run(
+            [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
+            feed_dict={self.image_tensor: image_np_expanded})
+        scores = scores[0].tolist()
+        classes = [int(x) for x in classes[0].tolist()]      
+        for i in range(boxes.shape[1]):
+            if scores[i]*100 >= self.cnfg.object_detector_min_score:
+                self.logger.debug(f'Object detected! class:{classes[i]} score:{scores[i]}')
+                box =  (int(boxes[0,i,0] * original_height),
+                        int(boxes[0,i,1] * original_width),
+                        int(boxes[0,i,2] * original_height),
+                        int(boxes[0,i,3] * original_width))
+                objects.append({
+                    'box': box,
+                    'score': scores[i],
+                    'class': self.labels[classes[i]],
+                    'num': int(num[0]),                     
+                }) 
+        result = {
+            'result': 'ok',
+            'objects': objects,
+            'elapsed': time.time() - start_time,
+        }
+        self.logger.debug(f"ObjectDetector Elapsed Time:{result['elapsed']} : \n {result}")
+        return result
+
+    def detect(self, filename):
+        """ Object Detection of the image file (file transport): results are written into RAM folder
+        """
+        result = {
+            'result': 'ok',
+            'objects': [],
+            'elapsed': 0,
+        }
+        if not self.load_image(filename):
+            os.rename(filename, f"{filename[:-10]}.obj.none")
+        else:
+            result = self.detect_image(self.image)
+            image_encoded = None
+            if len(result['objects'])>0 and not self.frame_ref is None:
+                # actions need an image file, so save frame from shared memory (only frames with objects are saved)
+                image_encoded = cv2.imencode('.bmp', self.image_original)[1]
+                frame_buffer, slot, frame_num = self.frame_ref
+                if not frame_buffer.is_valid(slot, frame_num):
+                    # frame was overwritten by recorder during detection, so objects and image can not be trusted
+                    self.logger.warning(f"Frame {frame_num} was overwritten during object detection: '{frame_buffer.filename}'")
+                    result['objects'] = []
+            if len(result['objects'])>0:
                 filename_obj_found = f"{filename[:-10]}.obj.found"
                 with open(filename_obj_found+'.info', 'w') as f:
                     f.write(json.dumps(result))
+                if not image_encoded is None:
+                    image_encoded.tofile(filename)
                 os.rename(filename, filename_obj_found)
             else:
                 os.rename(filename, f"{filename[:-10]}.obj.none") 
-                result = {
-                    'result': 'ok',
-                    'objects': [],
-                    'elapsed': time.time() - start_time,
-                }
-            self.logger.debug(f"ObjectDetector Elapsed Time:{result['elapsed']} : \n {result}")
         return result   
     
     def close(self):
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import logging
+from collections import deque
+import numpy as np
+
+TS_PACKET_SIZE = 188
+
+class PacketBuffer():
+    """ RAM ring buffer of encoded video packets (mpegts stream) for the last <buffer_time> seconds.
+    Packets are grouped by GOP (starting from keyframe), so the buffer content can always be decoded from the beginning
+    """
+    def __init__(self, buffer_time, logger_name='None'):
+        self.logger = logging.getLogger(f"{logger_name}:PacketBuffer")
+        self.buffer_time = buffer_time
+        self.gops = deque() # list of [timestamp, [chunks]]
+        self.size = 0
+        self._remainder = b''
+
+    def split_keyframes(self, data):
+        """ Split mpegts data into chunks: returns list of (is_keyframe, chunk).
+        Keyframe chunk starts from ts packet with random_access_indicator flag
+        """
+        data = self._remainder + data
+        cnt = len(data) // TS_PACKET_SIZE
+        self._remainder = data[cnt * TS_PACKET_SIZE:]
+        if cnt == 0:
+            return []
+        packets = np.frombuffer(data, np.uint8, count=cnt * TS_PACKET_SIZE).reshape(cnt, TS_PACKET_SIZE)
+        # adaptation field exists, it is not empty and has random_access_indicator
+        is_random_access = ((packets[:, 3] & 0x20) != 0) & (packets[:, 4] > 0) & ((packets[:, 5] & 0x40) != 0)
+        keyframes = [int(i) for i in np.flatnonzero(is_random_access)]
+        starts = [0] + keyframes
+        ends = keyframes + [cnt]
+        chunks = []
+        for start, end in zip(starts, ends):
+            if end > start:
+                chunks.append((start in keyframes, data[start * TS_PACKET_SIZE:end * TS_PACKET_SIZE]))
+        return chunks
+
+    def append(self, data, timestamp):
+        """ Add new data to the buffer and remove outdated GOPs.
+        Returns list of (is_keyframe, chunk) from the added data
+        """
+        chunks = self.split_keyframes(data)
+        for is_keyframe, chunk in chunks:
+            if is_keyframe:
+                self.gops.append([timestamp, []])
+            elif len(self.gops) == 0:
+                # data before the first keyframe can't be decoded
+                continue
+            self.gops[-1][1].append(chunk)
+            self.size += len(chunk)
+        # keep the latest GOP started before buffer_time (so buffer covers at least buffer_time seconds)
+        while len(self.gops) > 1 and self.gops[1][0] <= timestamp - self.buffer_time:
+            self.size -= sum(len(chunk) for chunk in self.gops.popleft()[1])
+        return chunks
+
+    def start_time(self):
+        """ Timestamp of the oldest buffered keyframe """
+        if len(self.gops) == 0:
+            return None
+        return self.gops[0][0]
+
+    def get_data(self):
+        """ Returns all buffered data starting from the oldest keyframe """
+        return b''.join(chunk for gop in self.gops for chunk in gop[1])
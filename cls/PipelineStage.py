@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from threading import Thread, Lock, Condition
+from queue import Queue, Empty, Full
+from concurrent.futures import ThreadPoolExecutor
+
+class PipelineStage(Thread):
+    """ Stage of the recorder pipeline. Items are processed in separate thread from the bounded queue,
+    so slow stage never blocks the stage that puts items into it.
+    If queue is full, then item is dropped according to <drop_policy>:
+        'newest' - new item is discarded (keeps continuity of already queued items, i.e. for video encoder)
+        'oldest' - the oldest queued item is discarded (keeps the most recent items, i.e. for analysis)
+    <release> callback is called for each item after it is processed or dropped (i.e. to return frame into the pool)
+    If <workers> > 1, then items are processed by several threads in parallel (order of processing is not guaranteed)
+    If <executor> is set, then stage has no threads of its own: items are processed by the shared executor (see get_stage_executor),
+    not more than <workers> items of the stage at the same time (with <workers>=1 items are processed in order)
+    """
+    def __init__(self, name, process, queue_size=8, drop_policy='newest', release=None, workers=1, executor=None, logger_name='None'):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+        self.logger = logging.getLogger(f"{logger_name}:{name}")
+        self.process = process
+        self.release = release
+        self.drop_policy = drop_policy
+        self.queue = Queue(maxsize=queue_size)
+        self.executor = executor
+        if executor is None:
+            self.workers = [self] + [Thread(target=self.run, name=f'{name}:{k}', daemon=True) for k in range(1, workers)]
+        else:
+            self.workers = []
+        self.max_running = max(workers, 1)
+        self._running = 0 # items of the stage being processed by the executor
+        self._stopped = False
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        self.cnt_put = 0
+        self.cnt_processed = 0
+        self.cnt_dropped = 0
+        self.max_queue_depth = 0
+        self.time_processing = 0
+        self.time_waiting = 0
+
+    def start(self):
+        if not self.executor is None:
+            return
+        Thread.start(self)
+        for worker in self.workers[1:]:
+            worker.start()
+
+    def put(self, item):
+        """ Put item into the queue without blocking. Returns False if some item was dropped """
+        if self._stopped:
+            self._drop(item)
+            return False
+        self.cnt_put += 1
+        dropped = None
+        queued = (time.time(), item)
+        try:
+            self.queue.put_nowait(queued)
+        except Full:
+            if self.drop_policy == 'oldest':
+                try:
+                    dropped = self.queue.get_nowait()[1]
+                except Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(queued)
+                except Full:
+                    self._drop(item)
+            else:
+                dropped = item
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        self._schedule()
+        if not dropped is None:
+            self._drop(dropped)
+            return False
+        return True
+
+    def _drop(self, item):
+        with self._lock:
+            self.cnt_dropped += 1
+        if not self.release is None:
+            self.release(item)
+
+    def run(self):
+        while True:
+            queued = self.queue.get()
+            if queued is None:
+                break
+            self._process(queued)
+
+    def _process(self, queued):
+        time_put, item = queued
+        time_start = time.time()
+        try:
+            self.process(*item)
+        except:
+            self.logger.exception(f'Pipeline stage {self.name} failed')
+        finally:
+            with self._lock:
+                self.time_waiting += time_start - time_put
+                self.time_processing += time.time() - time_start
+                self.cnt_processed += 1
+            if not self.release is None:
+                self.release(item)
+
+    def _schedule(self):
+        """ Submit queued items to the shared executor (one task per item, so stages of all cameras take turns) """
+        if self.executor is None:
+            return
+        with self._lock:
+            cnt = min(self.max_running - self._running, self.queue.qsize())
+            self._running += max(cnt, 0)
+        for _ in range(cnt):
+            try:
+                self.executor.submit(self._run_task)
+            except RuntimeError: # executor is shut down
+                with self._lock:
+                    self._running -= 1
+                    self._idle.notify_all()
+
+    def _run_task(self):
+        try:
+            queued = self.queue.get_nowait()
+        except Empty:
+            queued = None # the item is dropped by put()
+        if not queued is None:
+            self._process(queued)
+        with self._lock:
+            self._running -= 1
+            self._idle.notify_all()
+        self._schedule()
+
+    def stop(self, timeout=None):
+        """ Process all queued items and stop the threads """
+        if not self.executor is None:
+            deadline = None if timeout is None else time.time() + timeout
+            with self._lock:
+                while self._running > 0 or not self.queue.empty():
+                    remaining = None if deadline is None else deadline - time.time()
+                    if not remaining is None and remaining <= 0:
+                        self.logger.warning(f'Pipeline stage {self.name} is not responding')
+                        break
+                    self._idle.wait(remaining)
+                self._stopped = True
+            return
+        for _ in self.workers:
+            try:
+                self.queue.put(None, timeout=timeout)
+            except Full:
+                self.logger.warning(f'Pipeline stage {self.name} is not responding')
+                break
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def stats(self):
+        """ Returns counters of the stage """
+        return {
+            'stage': self.name,
+            'put': self.cnt_put,
+            'processed': self.cnt_processed,
+            'dropped': self.cnt_dropped,
+            'queue': self.queue.qsize(),
+            'max_queue': self.max_queue_depth,
+            'avg_time': self.time_processing / self.cnt_processed if self.cnt_processed > 0 else 0,
+            'avg_wait': self.time_waiting / self.cnt_processed if self.cnt_processed > 0 else 0,
+        }
+
+# Executors shared by the stages of all cameras in the process
+_executors = {}
+_executors_lock = Lock()
+
+def get_stage_executor(name, max_workers, logger_name='None'):
+    """ Returns thread pool <name> shared by pipeline stages (it is created only once per process) """
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            logging.getLogger(f"{logger_name}:PipelineStage").debug(f'Shared executor {name}: {max_workers} threads')
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'stage_{name}')
+            _executors[name] = executor
+        return executor
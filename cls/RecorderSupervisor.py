@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+
+import logging
+import asyncio
+import concurrent.futures
+import shlex
+import signal
+from threading import Thread, Lock
+
+from cls.ControlChannel import encode_message, decode_message
+
+class _ProcessHandle():
+    """ Thread safe proxy of the asyncio subprocess.
+    Camera interacts with recorder process from other threads (i.e. MQTT callbacks or watcher workers)
+    using the same interface as subprocess.Popen: proc.stdin.write(), proc.stdin.flush(), proc.send_signal(), proc.returncode
+    """
+    def __init__(self, proc, loop):
+        self.proc = proc
+        self.loop = loop
+        self.stdin = self
+
+    @property
+    def returncode(self):
+        return self.proc.returncode
+
+    def poll(self):
+        return self.proc.returncode
+
+    def write(self, data):
+        if not self.proc.returncode is None:
+            raise BrokenPipeError(f'Process {self.proc.pid} is finished')
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data):
+        try:
+            self.proc.stdin.write(data)
+        except (OSError, RuntimeError):
+            pass # process is finished
+
+    def flush(self):
+        pass # data is written by the event loop
+
+    def send_signal(self, sig):
+        self.loop.call_soon_threadsafe(self._send_signal, sig)
+
+    def _send_signal(self, sig):
+        try:
+            self.proc.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+class _EngineProcess():
+    """ Recorder of one camera running inside engine process (sxvrs_engine.py).
+    It has the same interface as asyncio subprocess, so supervisor handles it as separate recorder process
+    """
+    def __init__(self, engine, name):
+        self.engine = engine
+        self.name = name
+        self.pid = engine.proc.pid
+        self.returncode = None
+        self.stdout = asyncio.StreamReader()
+        self.stdin = self
+        self._exited = asyncio.Event()
+
+    def write(self, data):
+        for line in data.splitlines():
+            msg = decode_message(line)
+            if not msg is None:
+                self.engine.send({**msg, 'name': self.name})
+
+    def send_signal(self, sig):
+        self.engine.send({'cmd': 'kill' if sig == signal.SIGKILL else 'stop', 'name': self.name})
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self):
+        await self._exited.wait()
+        return self.returncode
+
+    def exited(self, returncode):
+        self.returncode = returncode
+        self.stdout.feed_eof()
+        self._exited.set()
+
+class _Engine():
+    """ Engine process, which runs recorders of several cameras (started on demand, and restarted if it is finished) """
+    def __init__(self, cmd, logger):
+        self.cmd = cmd
+        self.logger = logger
+        self.proc = None
+        self.recorders = {}
+        self._reader = None
+        self._start_lock = None
+
+    def is_running(self):
+        return not self.proc is None and self.proc.returncode is None
+
+    async def start_recorder(self, camera, from_recorder=True):
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock() # several cameras can start at the same time, but engine process must be started once
+        async with self._start_lock:
+            if not self.is_running():
+                self.logger.debug(f'engine process run:> {self.cmd}')
+                self.proc = await asyncio.create_subprocess_exec(*shlex.split(self.cmd), 
+                            stdout=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE)
+                self._reader = asyncio.get_event_loop().create_task(self._read_output(self.proc))
+        recorder = _EngineProcess(self, camera.name)
+        self.recorders[camera.name] = recorder
+        self.send({'cmd': 'start', 'name': camera.name, 'mode': 'record' if from_recorder else 'snapshot', 
+                    'frame_shape': [camera.frame_height, camera.frame_width, camera.frame_channels]})
+        return recorder
+
+    def send(self, msg):
+        if self.is_running():
+            self.proc.stdin.write(encode_message(msg))
+
+    async def _read_output(self, proc):
+        """ Pass event messages of the engine to recorders """
+        while True:
+            line = await proc.stdout.readline()
+            if line == b'':
+                break
+            msg = decode_message(line)
+            if msg is None:
+                continue
+            recorder = self.recorders.get(msg.get('name'))
+            if recorder is None:
+                continue
+            if msg.get('event') == 'exit':
+                del self.recorders[recorder.name]
+                recorder.exited(int(msg.get('code', 1)))
+            else:
+                recorder.stdout.feed_data(line)
+        returncode = await proc.wait()
+        self.logger.debug(f'engine process is finished with code {returncode}')
+        for recorder in self.recorders.values():
+            recorder.exited(returncode or -1)
+        self.recorders = {}
+
+    async def kill(self, timeout):
+        """ Kill engine process (i.e. its recorder is not finished after kill command).
+        All recorders of the engine are finished, so supervisor restarts them in the new engine process
+        """
+        if self.is_running():
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        if not self._reader is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._reader), timeout)
+            except asyncio.TimeoutError:
+                self.logger.error(f'Engine process {self.proc.pid} is not finished in {timeout} sec after kill')
+        # recorders are not waiting for the engine output anymore
+        for recorder in list(self.recorders.values()):
+            recorder.exited(-1)
+        self.recorders = {}
+
+    async def stop(self, timeout):
+        """ Engine is finished, when stdin is closed and all recorders are stopped """
+        if self.is_running():
+            self.proc.stdin.close()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+        if not self._reader is None:
+            await self._reader
+
+class RecorderSupervisor(Thread):
+    """ Supervisor of recorder subprocesses for all cameras.
+    Single asyncio event loop runs tasks of every camera: starts recorder process, reads its output with asyncio streams,
+    restarts it with timers, polls watcher and sends periodic status. So number of threads does not depend on number of cameras.
+    Blocking calls (ping, ffprobe, watcher setup) are executed in the default executor of the loop.
+    Camera notifies supervisor about changed state (record/watcher start/stop) by calling camera.on_change()
+    If <recorder_engine> is configured, then recorders are run inside shared engine processes (cameras are distributed between them),
+    instead of separate recorder process for each camera
+    """
+    def __init__(self, cnfg_daemon=None, stop_timeout=30, logger_name='None'):
+        Thread.__init__(self, name='RecorderSupervisor')
+        self.daemon = True
+        self.logger = logging.getLogger(f"{logger_name}:RecorderSupervisor")
+        # time to wait for recorder process to finish after SIGINT, before it is killed
+        self.stop_timeout = stop_timeout
+        self.loop = asyncio.new_event_loop()
+        self._tasks = {}
+        self.engines = []
+        self._camera_engine = {}
+        if not cnfg_daemon is None and cnfg_daemon.is_recorder_engine:
+            self.engines = [_Engine(cnfg_daemon.cmd_recorder_engine(index=k), self.logger) for k in range(cnfg_daemon.recorder_engine_processes)]
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def add(self, camera):
+        """ Start supervising of the camera. Returns concurrent.futures.Future, which is done when camera is stopped """
+        if not self.is_alive():
+            self.start()
+        future = asyncio.run_coroutine_threadsafe(self._supervise(camera), self.loop)
+        self._tasks[camera.name] = future
+        return future
+
+    def wait(self, camera, timeout=None):
+        """ Wait until camera is stopped """
+        future = self._tasks.pop(camera.name, None)
+        if future is None:
+            return
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.logger.warning(f"Camera '{camera.name}' is not stopped in {timeout} sec")
+            future.cancel()
+        except concurrent.futures.CancelledError:
+            pass
+
+    def stop(self, timeout=None):
+        if self.is_alive():
+            if len(self.engines) > 0:
+                future = asyncio.run_coroutine_threadsafe(self._stop_engines(), self.loop)
+                try:
+                    future.result(timeout)
+                except concurrent.futures.TimeoutError:
+                    self.logger.warning(f"Engine processes are not stopped in {timeout} sec")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join(timeout)
+
+    async def _stop_engines(self):
+        await asyncio.gather(*(engine.stop(self.stop_timeout) for engine in self.engines))
+
+    def get_engine(self, camera):
+        """ Engine process for the camera (cameras are distributed evenly in order of their start) """
+        engine = self._camera_engine.get(camera.name)
+        if engine is None:
+            engine = self.engines[len(self._camera_engine) % len(self.engines)]
+            self._camera_engine[camera.name] = engine
+        return engine
+
+    async def _wait(self, event, timeout):
+        """ Returns True if asyncio <event> is set within <timeout> seconds """
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run_blocking(self, func, *args):
+        return await self.loop.run_in_executor(None, func, *args)
+
+    async def _supervise(self, camera):
+        """ Main task of the camera """
+        changed = asyncio.Event()
+        watcher_changed = asyncio.Event()
+        def on_change():
+            changed.set()
+            watcher_changed.set()
+        camera.on_change = lambda: self.loop.call_soon_threadsafe(on_change)
+        notify_task = self.loop.create_task(self._notify_status(camera))
+        watcher_task = None
+        try:
+            await self._run_blocking(camera.get_camera_info)
+            while not camera.is_stopped():
+                changed.clear()
+                if camera.state_msg == 'inactive':
+                    if await self._wait(changed, camera.cnfg.recorder_ping_interval):
+                        camera.mqtt_status()
+                    await self._run_blocking(camera.get_camera_info)
+                elif not (camera.is_record_started() or camera.is_watcher_started()):
+                    if await self._wait(changed, camera.cnfg.recorder_ping_interval):
+                        camera.mqtt_status()
+                else:
+                    # watcher is started only once
+                    if watcher_task is None:
+                        watcher_task = self.loop.create_task(self._watch(camera, watcher_changed))
+                    await self._run_recorder(camera, changed)
+        except asyncio.CancelledError:
+            raise
+        except:
+            camera.logger.exception(f"Camera supervisor failed '{camera.name}'")
+        finally:
+            camera.on_change = None
+            notify_task.cancel()
+            if not watcher_task is None:
+                watcher_changed.set()
+                await watcher_task
+
+    async def _notify_status(self, camera):
+        """ Send mqtt notify messages with given <send_status_interval> """
+        while not camera.is_stopped():
+            await asyncio.sleep(camera.cnfg.send_status_interval)
+            camera.notify_status()
+
+    async def _watch(self, camera, changed):
+        """ Frame files are dispatched to the watcher by file watcher, only shared memory ring buffer is polled here """
+        try:
+            await self._run_blocking(camera.watcher_init)
+        except:
+            camera.logger.exception(f"Can't start watcher '{camera.name}'")
+            return
+        try:
+            while not camera.is_stopped():
+                changed.clear()
+                if not camera.is_watcher_started():
+                    camera.logger.debug(f'Watcher {camera.name}: wait for start {camera.event_timeout} sec')
+                    if await self._wait(changed, camera.event_timeout):
+                        camera.mqtt_status()
+                else:
+                    try:
+                        camera.watcher_poll()
+                    except:
+                        camera.logger.exception(f"watcher failed '{camera.name}'")
+                    await self._wait(changed, camera.cnfg.motion_detection_sleep_time)
+        finally:
+            await self._run_blocking(camera.watcher_close)
+
+    async def _run_recorder(self, camera, changed):
+        """ Run recorder process in a loop:
+        - execute {cmd_recorder_start} for start recording into file and take snapshots
+        - handle event messages of the recorder (video file, snapshot, stats)
+        """
+        i = 0
+        while not camera.is_stopped() and (camera.is_record_started() or camera.is_watcher_started()):
+            changed.clear()
+            if camera.state_msg == 'inactive': # camera is not alive, then just exit from recording loop and wait in upper loop
+                break
+            elif camera.is_record_started(): # start recording
+                await self._start_process(camera)
+                camera.set_recorder_state('started')
+                # handle event messages of the recorder until it is finished
+                duration = await self._parse_output(camera, changed)
+                # detect if process run too fast (unsuccessful start)
+                if duration < camera.cnfg.start_error_threshold:
+                    camera.err_cnt += 1
+                    camera.logger.debug(f"Probably can't start recording. Finished in {duration:.2f} sec (attempt {camera.err_cnt})")
+                    if (camera.err_cnt % camera.cnfg.start_error_atempt_cnt) == 0:
+                        camera.logger.debug(f'Too many attempts to start with no success ({camera.err_cnt}). Going to sleep for {camera.cnfg.start_error_sleep} sec')
+                        await self._run_blocking(camera.get_camera_info, True) # check if camera is available (cached frame shape can be outdated)
+                        camera.set_recorder_state('error')
+                        changed.clear()
+                        await self._wait(changed, camera.cnfg.start_error_sleep)
+                else:
+                    camera.err_cnt = 0
+                    camera.logger.debug(f'process execution finished in {duration:.2f} sec')
+                if camera.is_record_started():
+                    camera.set_recorder_state('restarting')
+                else:
+                    camera.set_recorder_state('stopped')
+                i += 1
+                camera.logger.debug(f'Running recorder, iteration #{i}')
+            elif camera.is_watcher_started(): # take snapshots only (no recording)
+                await self._start_process(camera, from_recorder=False)
+                await self._parse_output(camera, changed, from_recorder=False)
+                camera.logger.debug(f'Recording is not started.')
+
+    async def _start_process(self, camera, from_recorder=True):
+        """ Start recorder process {cmd_recorder_start} (or {cmd_take_snapshot} if only watcher is started), or start recorder inside the engine """
+        if len(self.engines) > 0:
+            engine = self.get_engine(camera)
+            camera.logger.debug(f'{"record" if from_recorder else "snapshot"} run in engine process #{self.engines.index(engine)}')
+            proc = await engine.start_recorder(camera, from_recorder)
+        else:
+            if from_recorder:
+                cmd = camera.cnfg.cmd_recorder_start(
+                    frame_height = camera.frame_height,
+                    frame_width = camera.frame_width,
+                    frame_channels = camera.frame_channels
+                )
+                if cmd == '':
+                    raise ValueError(f"Config value: 'cmd_recorder_start' is not defined")
+                camera.logger.debug(f'record process run:> {cmd}')
+            else:
+                cmd = camera.cnfg.cmd_take_snapshot(
+                    frame_height = camera.frame_height,
+                    frame_width = camera.frame_width,
+                    frame_channels = camera.frame_channels
+                )
+                camera.logger.debug(f'snapshot process run:> {cmd}')
+            # stdin/stdout is the control channel, log output of the recorder goes to stderr of the daemon
+            proc = await asyncio.create_subprocess_exec(*shlex.split(cmd),
+                        stdout=asyncio.subprocess.PIPE, stdin=asyncio.subprocess.PIPE)
+        camera.proc_recorder = _ProcessHandle(proc, self.loop)
+        return proc
+
+    async def _parse_output(self, camera, changed, from_recorder=True):
+        """ Handle event messages of the recorder process as soon as they are written,
+        until process is finished or camera state does not require it anymore.
+        Returns duration of the process execution
+        """
+        proc = camera.proc_recorder.proc
+        camera.mqtt_status()
+        start_time = self.loop.time()
+        camera.cnt_obj_frame = 0
+        camera.cnt_motion_frame = 0
+        # interact with child process to set watcher and recording state
+        camera.recorder_send_watch_state(camera.is_watcher_started())
+        is_persistent = camera.is_recorder_persistent()
+        if is_persistent:
+            camera.recorder_send_record_state(camera.is_record_started())
+        # persistent recorder rotates files by itself, so it is not limited by {record_time}
+        is_segments = is_persistent or (from_recorder and camera.cnfg.record_segments)
+        def is_running():
+            if is_persistent:
+                # the same recorder process is used for snapshots and recording
+                return camera.is_record_started() or camera.is_watcher_started()
+            return (from_recorder and camera.is_record_started()) or (not from_recorder and camera.is_watcher_started() and not camera.is_record_started())
+        readline = None
+        duration = 0
+        while not camera.is_stopped() and is_running() and (is_segments or duration < camera.cnfg.record_time+5):
+            if readline is None:
+                readline = self.loop.create_task(proc.stdout.readline())
+            wait_changed = self.loop.create_task(changed.wait())
+            timeout = None if is_segments else camera.cnfg.record_time+5 - duration
+            done, _ = await asyncio.wait({readline, wait_changed}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            wait_changed.cancel()
+            changed.clear()
+            if readline in done:
+                try:
+                    output = readline.result()
+                except ValueError: # line is longer than the stream limit (it is skipped by the reader)
+                    camera.logger.warning('Recorder output line is too long, skipped')
+                    output = None
+                readline = None
+                if output == b'': # process is finished (EOF is returned when recorder is crashed as well)
+                    if is_segments and is_running() and not camera.is_stopped():
+                        await proc.wait()
+                        camera.logger.error(f'Recorder process is finished unexpectedly (exit code: {proc.returncode}), restarting')
+                    break
+                if not output is None:
+                    camera.handle_recorder_message(output)
+            duration = self.loop.time() - start_time
+        # if process still running, then send stop signal
+        if proc.returncode is None:
+            try:
+                proc.send_signal(signal.SIGINT)
+            except ProcessLookupError:
+                pass
+        try:
+            await asyncio.wait_for(self._drain_output(camera, proc, readline), self.stop_timeout)
+        except asyncio.TimeoutError:
+            camera.logger.warning(f'Recorder process is not finished in {self.stop_timeout} sec after SIGINT. Killing it')
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(proc.wait(), self.stop_timeout)
+            except asyncio.TimeoutError:
+                if isinstance(proc, _EngineProcess):
+                    # engine does not start new recorder of the camera while the old one is running
+                    camera.logger.error(f'Recorder is not finished in {self.stop_timeout} sec after kill. Restarting engine process #{self.engines.index(proc.engine)}')
+                    await proc.engine.kill(self.stop_timeout)
+                else:
+                    camera.logger.error(f'Recorder process {proc.pid} is not finished in {self.stop_timeout} sec after kill')
+        camera.proc_recorder = None
+        return duration
+
+    async def _drain_output(self, camera, proc, readline=None):
+        """ Read output until process is finished (otherwise it can be blocked on the full pipe) """
+        while True:
+            try:
+                output = await (readline if not readline is None else proc.stdout.readline())
+            except ValueError: # too long line
+                continue
+            finally:
+                readline = None
+            if output == b'':
+                break
+            camera.handle_recorder_message(output)
+        await proc.wait()
+
+# Supervisor shared by all cameras in the process
+_supervisor = None
+_supervisor_lock = Lock()
+
+def get_recorder_supervisor(logger_name='None'):
+    """ Returns started supervisor (it is created only once per process) """
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None or not _supervisor.is_alive():
+            _supervisor = RecorderSupervisor(logger_name=logger_name)
+            _supervisor.start()
+        return _supervisor
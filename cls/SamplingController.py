@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import time
+from threading import Lock
+
+class SamplingController():
+    """ Feedback controller of the interval between frames passed to the watcher (analysis sampling interval).
+    Capacity of the watcher is estimated by measured processing cost of one frame (motion detection, and share of object detection),
+    and frames are sampled to keep the watcher busy by <utilisation> of its capacity, but not faster than <target_fps>.
+    If end-to-end latency (from frame capture to the end of detection) or depth of the watcher queues exceeds their targets,
+    then rate is reduced proportionally to drain the backlog. Interval is changed not more than by <max_step> on each update,
+    so under load the analysis rate is degraded smoothly instead of oscillating.
+    """
+    def __init__(self, target_fps, target_latency=2, target_queue=8, min_fps=0.1, utilisation=0.8, update_interval=1, max_step=1.5, smoothing=0.3):
+        self.min_interval = 1 / target_fps
+        self.max_interval = max(1 / min_fps, self.min_interval)
+        self.target_latency = target_latency
+        self.target_queue = max(target_queue, 1)
+        self.utilisation = utilisation
+        self.update_interval = update_interval
+        self.max_step = max_step
+        self.smoothing = smoothing
+        self.interval = self.min_interval
+        self.latency = 0 # smoothed worst latency
+        self.cost = 0 # smoothed processing cost of one frame (seconds)
+        self.load = 0
+        self._latency_max = 0
+        self._cost = 0
+        self._cnt_processed = 0
+        self._update_time = time.time()
+        self._lock = Lock()
+
+    def frame_processed(self, latency, cost):
+        """ Register frame processed by the watcher: its end-to-end <latency> and processing <cost> (seconds) """
+        with self._lock:
+            self._cnt_processed += 1
+            self._cost += cost
+            self._latency_max = max(self._latency_max, latency)
+
+    def add_latency(self, latency, cost=0):
+        """ Register additional processing of the frame (i.e. object detection) """
+        with self._lock:
+            self._cost += cost
+            self._latency_max = max(self._latency_max, latency)
+
+    def update(self, queue_depth):
+        """ Recalculate sampling interval (not often than every <update_interval> seconds). Returns the current interval """
+        now = time.time()
+        if now - self._update_time < self.update_interval:
+            return self.interval
+        self._update_time = now
+        with self._lock:
+            latency, self._latency_max = self._latency_max, 0
+            cost, self._cost = self._cost, 0
+            cnt, self._cnt_processed = self._cnt_processed, 0
+        self.latency += self.smoothing * (latency - self.latency)
+        if cnt > 0:
+            self.cost += self.smoothing * (cost / cnt - self.cost)
+        rate = 1 / self.min_interval
+        if self.cost > 0:
+            rate = min(rate, self.utilisation / self.cost)
+        self.load = max(self.latency / self.target_latency, queue_depth / self.target_queue)
+        if self.load > 1:
+            rate /= self.load
+        interval = min(max(1 / rate, self.interval / self.max_step), self.interval * self.max_step)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.interval
+
+    @property
+    def fps(self):
+        return 1 / self.interval
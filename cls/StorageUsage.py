@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import os
+
+class StorageUsage():
+    """ Running counter of RAM folder usage by the files of one producer (recorder), which are not consumed yet.
+    Producer registers each written file by <add>, consumer (watcher, object detector) renames and removes them.
+    Each query reads the folder once (one directory listing instead of stat of every file, the folder holds only frames
+    waiting for processing) and forgets all registered files, which are not found with any of <extensions> anymore
+    (the same frame is renamed on each stage of processing). So consumed files are discounted at once, even after bursts
+    """
+    def __init__(self, extensions=('',)):
+        self.extensions = extensions
+        self.files = {} # {filename without extension: size}
+        self.size = 0
+
+    def add(self, filename_base, size):
+        """ Register file written into the folder """
+        self.size += size - self.files.get(filename_base, 0)
+        self.files[filename_base] = size
+
+    def get_alive(self):
+        """ Registered files (without extension), which are still in the folder """
+        alive = set()
+        for folder in {os.path.dirname(filename_base) for filename_base in self.files}:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        for ext in self.extensions:
+                            if entry.path.endswith(ext):
+                                alive.add(entry.path[:len(entry.path) - len(ext)])
+            except FileNotFoundError:
+                pass # folder is removed with all files
+        return alive
+
+    def get_size(self):
+        """ Returns the size of registered files, which are still in the folder """
+        if len(self.files) > 0:
+            alive = self.get_alive()
+            for filename_base in [filename_base for filename_base in self.files if not filename_base in alive]:
+                self.size -= self.files.pop(filename_base)
+        return self.size
+
+    def clear(self):
+        self.files.clear()
+        self.size = 0
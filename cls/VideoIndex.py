@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import os, logging
+import struct
+from threading import RLock
+import numpy as np
+
+class VideoIndex():
+    """ Compact binary sidecar file for the recorded video file ({filename}.idx).
+    It allows to seek directly to the frames with motion or detected objects, without decoding video or parsing text logs.
+    File is appended by several processes (recorder writes frames, watcher writes motion and objects),
+    so it consists of fixed size records, each of them is written by single write call:
+        header: magic, start time of the video file
+        record: type, class_id, frame_num, timestamp (wallclock), value
+            FRAME  - frame is written into the video: value = pts (seconds from the beginning of the video file)
+            MOTION - motion is detected on the frame: value = motion score
+            OBJECT - object is detected on the frame: value = object score, class_id = index of the LABEL record
+            LABEL  - name of the object class (class_id + name instead of frame_num, timestamp, value)
+    """
+    MAGIC = b'SXVRSIX1'
+    FRAME = 1
+    MOTION = 2
+    OBJECT = 3
+    LABEL = 4
+    _header = struct.Struct('<8sd')
+    _record = struct.Struct('<BBHidf')
+    _label = struct.Struct('<BBH16s')
+    dtype = np.dtype([('type', 'u1'), ('class_id', 'u1'), ('reserved', '<u2'), ('frame_num', '<i4'), ('timestamp', '<f8'), ('value', '<f4')])
+
+    def __init__(self, filename, start_time=None, flush_count=25, logger_name='None'):
+        """ Open index file for appending (create it, if it does not exist).
+        <flush_count> records are collected in memory before they are written into the file
+        """
+        self.logger = logging.getLogger(f"{logger_name}:VideoIndex")
+        self.filename = filename
+        self.flush_count = flush_count
+        self.labels = {}
+        self._pending = bytearray()
+        self._lock = RLock()
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, self._header.pack(self.MAGIC, start_time or 0))
+        else:
+            # continue appending: load already registered labels
+            self.labels = read_labels(filename)
+        self.start_time = start_time
+
+    def _append(self, record, flush=False):
+        with self._lock:
+            if self.fd is None:
+                return
+            self._pending += record
+            if flush or len(self._pending) >= self.flush_count * self._record.size:
+                self._flush()
+
+    def _flush(self):
+        if len(self._pending) > 0:
+            os.write(self.fd, self._pending)
+            self._pending = bytearray()
+
+    def add_frame(self, frame_num, timestamp, pts=None):
+        """ Frame is written into video file. If <pts> is not known, then it is calculated from <timestamp> """
+        if pts is None:
+            pts = timestamp - self.start_time if not self.start_time is None else 0
+        self._append(self._record.pack(self.FRAME, 0, 0, frame_num, timestamp, pts))
+
+    def add_motion(self, frame_num, timestamp, score=0):
+        """ Motion is detected on the frame """
+        self._append(self._record.pack(self.MOTION, 0, 0, frame_num, timestamp, score), flush=True)
+
+    def add_object(self, frame_num, timestamp, class_name, score=0):
+        """ Object of class <class_name> is detected on the frame """
+        with self._lock:
+            class_id = self.labels.get(class_name)
+            if class_id is None:
+                if len(self.labels) >= 255:
+                    self.logger.warning(f"Too many object classes in '{self.filename}', '{class_name}' is skipped")
+                    return
+                class_id = len(self.labels)
+                self.labels[class_name] = class_id
+                self._append(self._label.pack(self.LABEL, class_id, 0, str(class_name).encode('utf-8')[:16]))
+            self._append(self._record.pack(self.OBJECT, class_id, 0, frame_num, timestamp, score), flush=True)
+
+    def close(self):
+        with self._lock:
+            if self.fd is None:
+                return
+            self._flush()
+            os.close(self.fd)
+            self.fd = None
+
+def _read_records(filename):
+    """ Returns (start_time, records as numpy structured array) """
+    with open(filename, 'rb') as f:
+        magic, start_time = VideoIndex._header.unpack(f.read(VideoIndex._header.size))
+        if magic != VideoIndex.MAGIC:
+            raise ValueError(f"Wrong video index file: {filename}")
+        data = f.read()
+    # ignore incomplete record (it is being written right now)
+    cnt = len(data) // VideoIndex.dtype.itemsize
+    return start_time, np.frombuffer(data, VideoIndex.dtype, count=cnt)
+
+def read_labels(filename):
+    """ Returns dict of object class names registered in the index file: {name: class_id} """
+    _, records = _read_records(filename)
+    labels = {}
+    for record in records[records['type'] == VideoIndex.LABEL]:
+        name = VideoIndex._label.unpack(record.tobytes())[3]
+        labels[name.rstrip(b'\0').decode('utf-8', errors='replace')] = int(record['class_id'])
+    return labels
+
+def read_index(filename):
+    """ Load index file. Returns dict:
+        start_time: start time of the video file
+        frames:     numpy array of (frame_num, timestamp, pts)
+        motion:     numpy array of (frame_num, timestamp, score, pts)
+        objects:    list of dict(frame_num, timestamp, score, pts, class)
+    """
+    start_time, records = _read_records(filename)
+    labels = {class_id: name for name, class_id in read_labels(filename).items()}
+    frames = records[records['type'] == VideoIndex.FRAME]
+    frames = frames[np.argsort(frames['timestamp'], kind='stable')]
+    def get_pts(timestamps):
+        """ pts of the nearest written frame before <timestamps> """
+        if len(frames) == 0:
+            return timestamps - start_time
+        pos = np.clip(np.searchsorted(frames['timestamp'], timestamps, side='right') - 1, 0, len(frames) - 1)
+        return frames['value'][pos].astype(np.float64)
+    motion = records[records['type'] == VideoIndex.MOTION]
+    objects = records[records['type'] == VideoIndex.OBJECT]
+    objects_pts = get_pts(objects['timestamp'])
+    return {
+        'start_time': start_time,
+        'frames': np.rec.fromarrays([frames['frame_num'], frames['timestamp'], frames['value']], names='frame_num,timestamp,pts'),
+        'motion': np.rec.fromarrays([motion['frame_num'], motion['timestamp'], motion['value'], get_pts(motion['timestamp'])], names='frame_num,timestamp,score,pts'),
+        'objects': [{
+                'frame_num': int(obj['frame_num']),
+                'timestamp': float(obj['timestamp']),
+                'score': float(obj['value']),
+                'pts': float(pts),
+                'class': labels.get(int(obj['class_id']), ''),
+            } for obj, pts in zip(objects, objects_pts)],
+    }
+
+def find_objects(filenames, class_name=None, time_from=None, time_to=None):
+    """ Search detected objects in several index files (i.e. for the whole day of recordings).
+    Only objects with time_from <= timestamp < time_to are returned (if limits are given, as unix time)
+    Returns list of dict(filename, timestamp, pts, score, class) sorted by timestamp, where <filename> is the video file
+    """
+    result = []
+    for filename in filenames:
+        try:
+            index = read_index(filename)
+        except (OSError, ValueError, struct.error):
+            continue
+        for obj in index['objects']:
+            if not class_name is None and obj['class'] != class_name:
+                continue
+            if not time_from is None and obj['timestamp'] < time_from:
+                continue
+            if not time_to is None and obj['timestamp'] >= time_to:
+                continue
+            obj['filename'] = filename[:-4] if filename.endswith('.idx') else filename
+            result.append(obj)
+    return sorted(result, key=lambda obj: obj['timestamp'])
@@ -2,6 +2,8 @@
 
 import yaml
 import os, sys, shutil
+import re
+from string import Formatter
 import logging, logging.config
 from datetime import datetime
 import importlib
@@ -66,6 +68,33 @@ class config_reader():
         self.temp_storage_size = cnfg.get('temp_storage_size', 128)
         self._temp_storage_cmd_mount = cnfg.get('temp_storage_cmd_mount', None) # 'mount -t tmpfs -o size={temp_storage_size}m tmpfs {temp_storage_path}'
         self._temp_storage_cmd_unmount = cnfg.get('temp_storage_cmd_unmount', 'umount {path}')
+        # Camera probing (ping + ffprobe) runs concurrently, stream info is cached on disk (keyed by stream_url)
+        camera_probe = cnfg.get('camera_probe', {}) or {}
+        self.camera_probe_cache_filename = camera_probe.get('cache', 'storage/camera_probe.json')
+        self.camera_probe_workers = camera_probe.get('workers', 8) # max number of cameras probed at the same time
+        self.camera_probe_ping_timeout = camera_probe.get('ping_timeout', 2) # in seconds
+        self.camera_probe_timeout = camera_probe.get('timeout', 15) # ffprobe timeout in seconds
+        self.camera_probe_revalidate_interval = camera_probe.get('revalidate_interval', 3600) # cached info is probed again in background after this time (seconds)
+        # Motion and object detection stages of all camera watchers run on shared thread pools (number of threads does not depend on number of cameras)
+        watcher_pool = cnfg.get('watcher_pool', {}) or {}
+        self.watcher_pool_motion_workers = max(1, watcher_pool.get('motion_workers', os.cpu_count() or 1)) # cameras are compared in parallel, frames of each camera in order
+        self.watcher_pool_object_workers = max(1, watcher_pool.get('object_workers', 16)) # threads waiting for object detection results
+        # Capture engine: recorders of several cameras are run inside shared engine processes (instead of separate process for each camera)
+        self.is_recorder_engine = 'recorder_engine' in cnfg
+        if self.is_recorder_engine:
+            self.recorder_engine_processes = max(1, cnfg['recorder_engine'].get('processes', 1)) # cameras are distributed evenly between engine processes
+            self._recorder_engine_cmd = cnfg['recorder_engine'].get('cmd', 'python sxvrs_engine.py -i {index}')
+        # Batch motion detection: frames of all cameras are compared together in one vectorized pass (useful for many cameras)
+        self.is_motion_batch = 'motion_batch' in cnfg
+        if self.is_motion_batch:
+            self.motion_batch_max_batch = (cnfg['motion_batch'] or {}).get('max_batch', 64) # max number of frames in one batch
+            self.motion_batch_max_wait = (cnfg['motion_batch'] or {}).get('max_wait', 0) # time to wait for more frames before processing the batch (seconds)
+        # Motion detection in pool of worker processes (sxvrs_motion.py), each worker runs motion detection for its share of cameras
+        self.is_motion_pool = 'motion_pool' in cnfg
+        if self.is_motion_pool:
+            self.motion_pool_processes = max(1, (cnfg['motion_pool'] or {}).get('processes', os.cpu_count() or 1)) # number of worker processes
+            self._motion_pool_cmd = (cnfg['motion_pool'] or {}).get('cmd', 'python sxvrs_motion.py -i {index}')
+            self.motion_pool_timeout = (cnfg['motion_pool'] or {}).get('timeout', 10) # if worker does not answer in time (seconds), then it is killed and restarted
         # set config for each recorder
         self.recorders = {}
         for recorder in cnfg['recorders']:
@@ -77,6 +106,9 @@ class config_reader():
             self.object_detector_cloud_key = cnfg['object_detector_cloud'].get('key') # obtain your personal key from cloud server
             self.object_detector_timeout = cnfg['object_detector_cloud'].get('timeout', 300) # in seconds
             self.object_detector_min_score = cnfg['object_detector_cloud'].get('min_score', 30) # min score from 0..100
+            # cloud detector receives frames thru RAM folder only
+            self.object_detector_transport = 'file'
+            self.object_detector_queue_size = cnfg['object_detector_cloud'].get('queue_size', 32)
             # object detector watch folder for new files, will sleep if there is no any new file (seconds)
             self.object_detector_sleep_time= cnfg['object_detector_local'].get('sleep_time', 0.5)
         self.is_object_detector_local = 'object_detector_local' in cnfg
@@ -88,6 +120,11 @@ class config_reader():
             self.object_detector_min_score = cnfg['object_detector_local'].get('min_score', 30) # min score from 0..100
             # tensorflow per_process_gpu_memory_fraction param can limit usage of GPU memory
             self.tensorflow_per_process_gpu_memory_fraction = cnfg['object_detector_local'].get('tensorflow_per_process_gpu_memory_fraction', None)
+            # how frames are passed to object detector: 'direct' - inside daemon process (detection result is returned as future), 
+            #                                           'file' - thru RAM folder (*.obj.wait files), i.e. for detector running in another process
+            self.object_detector_transport = cnfg['object_detector_local'].get('transport', 'direct')
+            # max number of frames of each camera waiting for object detection. If detector is too slow, then the oldest frames are dropped
+            self.object_detector_queue_size = cnfg['object_detector_local'].get('queue_size', 32)
             # object detector watch folder for new files, will sleep if there is no any new file (seconds)
             self.object_detector_sleep_time= cnfg['object_detector_local'].get('sleep_time', 0.5)
         if self.object_detector_min_score == 0:
@@ -120,6 +157,10 @@ class config_reader():
         return self.is_object_detector_cloud or (self.is_object_detector_local and self.tensorflow_is_installed)
     def cmd_http_server(self, **kwargs):
         return self._http_server_cmd.format(**kwargs)
+    def cmd_recorder_engine(self, **kwargs):
+        return self._recorder_engine_cmd.format(**kwargs)
+    def cmd_motion_pool(self, **kwargs):
+        return self._motion_pool_cmd.format(**kwargs)
 
 class recorder_configuration():
     """ Combines global and local parameter for given redcorder record
@@ -168,47 +209,128 @@ class recorder_configuration():
             self.resize_frame_height = self.combine('height', group='resize_frame', default=None)
         # Take snapshot every <snapshot_time> seconds
         self.snapshot_time = self.combine('snapshot_time', default=5)
+        # If defined <snapshot_size>, then snapshot is downscaled to fit this size (if only width or height is set, then the other side is not limited)
+        self.snapshot_resize = not self.combine('snapshot_size', default=None) is None
+        if self.snapshot_resize:
+            self.snapshot_width = self.combine('width', group='snapshot_size', default=None)
+            self.snapshot_height = self.combine('height', group='snapshot_size', default=None)
+            self.snapshot_resize = not (self.snapshot_width is None and self.snapshot_height is None)
         # maximum storage folder size in GB. If it exceeds, then the oldes files will be removed
         self.storage_max_size = self.combine('storage_max_size', default=10)
         # folder for storing recorded files. This is template and can be formated with {name} and {datetime} params
         self._storage_path = self.combine('storage_path', default='storage/{name}')
         # filename for the temp file in RAM disk. This is template and can be formated with {name},{storage_path}  and {datetime} params
         self._filename_temp = self.combine('filename_temp', default="{temp_storage_path}/{name}_{frame_num}_{datetime:%H%M%S.%f}")
+        # If frame_buffer_slots > 0, then frames for the watcher are passed thru shared memory ring buffer (instead of writing image files into RAM folder)
+        self.frame_buffer_slots = self.combine('frame_buffer_slots', default=0)
+        # filename for the shared memory ring buffer. This is template and can be formated with {name} and {temp_storage_path} params
+        self._filename_frame_buffer = self.combine('filename_frame_buffer', default="{temp_storage_path}/{name}.frames")
         # filename for the snapshot. This is template and can be formated with {name},{storage_path} and {datetime} params
         self._filename_snapshot = self.combine('filename_snapshot', default='{storage_path}/snapshot.jpg')
         # filename for recording. This is template and can be formated with {name},{storage_path} and {datetime} params
         self._filename_video = self.combine('filename_video', default="{storage_path}/{datetime:%Y-%m-%d}/{name}_{datetime:%Y%m%d_%H%M%S}.mp4")
-        # shell command to just take snapshot
+        # shell command to just take snapshot (recording can be started later in the same process, except stream copy mode)
         #self._cmd_take_snapshot = self.combine('cmd_take_snapshot', 'ffmpeg -hide_banner -nostdin -nostats -flags low_delay -fflags +genpts+discardcorrupt -y -i "{stream_url}" -vframes 1 "{filename}"')
         self._cmd_take_snapshot = self.combine('cmd_take_snapshot', 'python sxvrs_recorder.py -n {name} --snapshot_mode -fh {frame_height} -fw {frame_width} -fc {frame_channels}')
         # shell command for recorder start (used in daemon thread)
         self._cmd_recorder_start = self.combine('cmd_recorder_start', 'python sxvrs_recorder.py -n {name} -fh {frame_height} -fw {frame_width} -fc {frame_channels}')
-        # shell command to start ffmpeg and read frames (used inside recorder subprocess)
-        self._cmd_ffmpeg_read = self.combine('cmd_ffmpeg_read', default='ffmpeg -hide_banner -nostdin -nostats -flags low_delay -fflags +genpts+discardcorrupt -y -i "{stream_url}" -f rawvideo -pix_fmt rgb24 pipe:')
-        # shell command to start ffmpeg and write video from collected frames (used inside recorder subprocess)
-        self._cmd_ffmpeg_write = self.combine('cmd_ffmpeg_write', default='ffmpeg -hide_banner -nostdin -nostats -y -f rawvideo -vcodec rawvideo -s {width}x{height} -pix_fmt rgb{pixbytes} -r 5 -i - -an -c:v libx264 -crf 26 -preset fast "{filename}"')
+        # shell command to start ffmpeg and read frames (used inside recorder subprocess). Frames are expected in bgr24 (OpenCV format), otherwise they are converted
+        self._cmd_ffmpeg_read = self.combine('cmd_ffmpeg_read', default='ffmpeg -hide_banner -nostdin -nostats -flags low_delay -fflags +genpts+discardcorrupt -y -i "{stream_url}" -f rawvideo -pix_fmt bgr24 pipe:')
+        # shell command to start ffmpeg and write video from collected frames (used inside recorder subprocess). {pix_fmt} is the same as in {cmd_ffmpeg_read}
+        self._cmd_ffmpeg_write = self.combine('cmd_ffmpeg_write', default='ffmpeg -hide_banner -nostdin -nostats -y -f rawvideo -vcodec rawvideo -s {width}x{height} -pix_fmt {pix_fmt} -r 5 -i - -an -c:v libx264 -crf 26 -preset fast "{filename}"')
+        # old placeholder '-pix_fmt rgb{pixbytes}' would label bgr24 frames as rgb24 (red and blue swapped), so it is replaced by {pix_fmt}
+        if not self._cmd_ffmpeg_write is None and '{pixbytes}' in self._cmd_ffmpeg_write:
+            self.parent.logger.warning(f"[{name}] {{pixbytes}} in 'cmd_ffmpeg_write' is deprecated, it is replaced by {{pix_fmt}} (pixel format of {{cmd_ffmpeg_read}})")
+            self._cmd_ffmpeg_write = re.sub(r'\w*\{pixbytes\}', '{pix_fmt}', self._cmd_ffmpeg_write)
+        # segmenting mode: recorder process is not restarted, video files are rotated on {record_time} boundaries (aligned to clock) without gaps
+        self.record_segments = self.combine('record_segments', default=False)
+        # write binary index file ({filename_video}.idx) with timestamps of the recorded frames, detected motion and objects
+        self.is_video_index = self.combine('video_index', default=True)
+        # recording mode: 'encode' - decoded frames are encoded again by {cmd_ffmpeg_write}, 'copy' - source stream is copied into the file without re-encoding by {cmd_ffmpeg_copy}
+        #                 'event' - source stream is kept in RAM buffer and written into the file only when the watcher detects an event (see <event_recording> group)
+        self.record_mode = self.combine('record_mode', default='encode')
+        # shell command to start ffmpeg, that copies source stream into video file and at the same time outputs decoded frames to pipe (used inside recorder subprocess)
+        self._cmd_ffmpeg_copy = self.combine('cmd_ffmpeg_copy', default='ffmpeg -hide_banner -nostdin -nostats -flags low_delay -fflags +genpts+discardcorrupt -y -i "{stream_url}" -map 0:v:0 -c:v copy -an "{filename}" -map 0:v:0 -f rawvideo -pix_fmt bgr24 pipe:')
+        # the same as {cmd_ffmpeg_copy}, but for segmenting mode: ffmpeg segment muxer rotates files and writes finished segments list into pipe with file descriptor {fd}
+        # {filename} is {filename_video} as strftime pattern, so files are named by the clock (-strftime 1)
+        self._cmd_ffmpeg_copy_segments = self.combine('cmd_ffmpeg_copy_segments', default='ffmpeg -hide_banner -nostdin -nostats -flags low_delay -fflags +genpts+discardcorrupt -y -i "{stream_url}" -map 0:v:0 -c:v copy -an -f segment -segment_time {record_time} -segment_atclocktime 1 -reset_timestamps 1 -strftime 1 -segment_list pipe:{fd} -segment_list_type csv "{filename}" -map 0:v:0 -f rawvideo -pix_fmt bgr24 pipe:')
+        if not self._cmd_ffmpeg_copy_segments is None and not '-strftime 1' in self._cmd_ffmpeg_copy_segments:
+            self.parent.logger.warning(f"[{name}] 'cmd_ffmpeg_copy_segments' has no '-strftime 1' option, segment files will not be named by the clock")
+        # event recording: the last {pre_record_time} seconds of the source stream are kept in RAM, and written into the file when the watcher reports an event
+        self.event_pre_record_time = self.combine('pre_record_time', group='event_recording', default=10)
+        # continue recording for {post_record_time} seconds after the last event
+        self.event_post_record_time = self.combine('post_record_time', group='event_recording', default=20)
+        # what triggers event recording: 'motion' - motion is detected, 'object' - object is detected
+        self.event_trigger = self.combine('trigger', group='event_recording', default='motion')
+        # ffmpeg output options for the source stream packets (appended to {cmd_ffmpeg_read}). Packets are written into pipe with file descriptor {fd}
+        self._cmd_ffmpeg_packets = self.combine('cmd_ffmpeg_packets', group='event_recording', default='-map 0:v:0 -c:v copy -an -bsf:v dump_extra -f mpegts pipe:{fd}')
+        # shell command to write buffered packets into the file
+        self._cmd_ffmpeg_event_write = self.combine('cmd_ffmpeg_write', group='event_recording', default='ffmpeg -hide_banner -nostdin -nostats -y -f mpegts -i - -c copy -an "{filename}"')
         # if there is too many errors to connect to video source, then try to sleep some time before new attempts
         self.start_error_atempt_cnt = self.combine('start_error_atempt_cnt', default=10)
         self.start_error_threshold = self.combine('start_error_threshold', default=10)
         self.start_error_sleep = self.combine('start_error_sleep', default=600)
         # ffmpeg buffer frame count
         self.ffmpeg_buffer_frames = self.combine('ffmpeg_buffer_frames', default=16)
-        # How many frames will be skipped between motion detection
-        self.frame_skip = self.combine('frame_skip', default=5)
+        # number of preallocated frame buffers for reading frames from ffmpeg (by default: encoder_queue_size + analysis_queue_size + 3)
+        self.frame_pool_size = self.combine('frame_pool_size', default=None)
+        # max number of frames waiting for the encoder. If encoder is too slow, then new frames are dropped (capture is never stalled)
+        self.encoder_queue_size = self.combine('encoder_queue_size', default=8)
+        # max number of frames waiting for analysis (snapshots and watcher). If it is too slow, then the oldest frames are dropped
+        self.analysis_queue_size = self.combine('analysis_queue_size', default=2)
+        # Target number of frames per second passed to the watcher (analysis rate). If the watcher or object detector can't keep up,
+        # then the rate is reduced smoothly by the feedback controller, down to <analysis_min_fps>
+        self.analysis_fps = self.combine('analysis_fps', default=2)
+        self.analysis_min_fps = self.combine('analysis_min_fps', default=0.1)
+        # rates are used as divisors (sampling interval), so they must be positive
+        if not self.analysis_fps or self.analysis_fps <= 0:
+            self.parent.logger.warning(f"[{name}] 'analysis_fps' must be greater than 0, using default value 2")
+            self.analysis_fps = 2
+        if not self.analysis_min_fps or self.analysis_min_fps <= 0:
+            self.parent.logger.warning(f"[{name}] 'analysis_min_fps' must be greater than 0, using default value 0.1")
+            self.analysis_min_fps = 0.1
+        self.analysis_min_fps = min(self.analysis_min_fps, self.analysis_fps)
+        # <frame_skip> and <throttling_min_mem_size> are replaced by analysis sampling rate (<analysis_fps>), which is adjusted by the watcher
+        for param in ('frame_skip', 'throttling_min_mem_size'):
+            if not self.combine(param, default=None) is None:
+                self.parent.logger.warning(f"[{name}] '{param}' is deprecated and ignored, use 'analysis_fps' and 'analysis_min_fps' to control analysis rate")
+        # Analysis rate is reduced, if end-to-end latency of the watcher (from frame capture to the end of motion and object detection) exceeds this value (seconds)
+        self.analysis_max_latency = self.combine('analysis_max_latency', default=2)
         # To detect duplicate frames comparing hash of frame miniature, it is possible to define frame_comparing_width for this miniature
         self.frame_comparing_width = self.combine('frame_comparing_width', default=32)
-        # If there are too many files on RAM disk, then start to increase frame skipping (throttling) (means that motion_detection or object detection are not fast enough to process files)
-        self.throttling_min_mem_size = self.combine('throttling_min_mem_size', default=32)*1024*1024
         # If total size of files exceeds maximum value, then disable frame saving to RAM folder (means that new frames are not added for processing if memory reaches max size)
         self.throttling_max_mem_size = self.combine('throttling_max_mem_size', default=64)*1024*1024
         ### watcher params ###        
         # before motion detection, image is resized for reducing of calculations
         self.motion_detector_max_image_height = self.combine('max_image_height', group='motion_detector', default=128)
         self.motion_detector_max_image_width = self.combine('max_image_width', group='motion_detector', default=128)
-        # number of frames to remember for the background (selected randomly)
+        # background model for motion detection: 'frames' - the last {bg_frame_count} frames, new frame is compared with the oldest one,
+        # 'average' - exponential running average of frames, 'mog2' or 'knn' - OpenCV background subtractors
+        self.motion_background_model = self.combine('background_model', group='motion_detector', default='frames')
+        # speed of adapting 'average' background model to the changes of the scene (0..1)
+        self.motion_background_learning_rate = self.combine('learning_rate', group='motion_detector', default=0.05)
+        # number of frames used to build 'mog2' or 'knn' background model
+        self.motion_background_history = self.combine('history', group='motion_detector', default=100)
+        # threshold of 'mog2' or 'knn' background subtractor (not a grey level like <motion_detector_threshold>):
+        # 'mog2' - squared Mahalanobis distance of the pixel to the model (OpenCV default 16), 'knn' - squared distance to the samples (OpenCV default 400)
+        self.motion_background_subtractor_threshold = self.combine('subtractor_threshold', group='motion_detector')
+        # number of frames to remember for the background ('frames' model)
         self.motion_detector_bg_frame_count = self.combine('bg_frame_count', group='motion_detector', default=5)
+        # motion is detected only inside <include_areas> polygons (if defined), and never inside <exclude_areas> (i.e. trees, road, timestamp on the video)
+        # each polygon is a list of points [x, y] in pixels of the camera stream, or in percents of the frame size (i.e. ["50%", "10%"])
+        self.motion_include_areas = self.combine('include_areas', group='motion_detector', default=[]) or []
+        self.motion_exclude_areas = self.combine('exclude_areas', group='motion_detector', default=[]) or []
         # threshold for binarized image difference in motion detector
         self.motion_detector_threshold = self.combine('motion_detector_threshold', group='motion_detector', default=15)
+        # If defined <analysis_stream>, then ffmpeg produces additional output with low resolution and low fps frames just for the watcher
+        self.is_analysis_stream = not self.combine('analysis_stream', default=None) is None and self.combine('enabled', group='analysis_stream', default=True)
+        # number of frames per second in analysis stream (frames are sampled from it at the analysis rate)
+        self.analysis_stream_fps = self.combine('fps', group='analysis_stream', default=self.analysis_fps)
+        # the size of frames in analysis stream (by default it is the same as for motion detector). Notice: object detector will receive frames of the same size
+        self.analysis_stream_width = self.combine('width', group='analysis_stream', default=self.motion_detector_max_image_width)
+        self.analysis_stream_height = self.combine('height', group='analysis_stream', default=self.motion_detector_max_image_height)
+        # ffmpeg output options for analysis stream (appended to {cmd_ffmpeg_read} or {cmd_ffmpeg_copy}). Frames are written into pipe with file descriptor {fd}
+        self._cmd_ffmpeg_analysis = self.combine('cmd_ffmpeg_analysis', group='analysis_stream', default='-map 0:v:0 -vf "fps={fps},scale={width}:{height}" -f rawvideo -pix_fmt bgr24 pipe:{fd}')
         # If defined <contour_detection> then it will try to detect motion by detecting contours inside the frame (slightly cpu expensive operation)
         _motion_detector = self.combine('motion_detector', default=[])  
         self.is_motion_detection =  self.combine('enabled', group='motion_detector', default=False)
@@ -238,10 +360,16 @@ class recorder_configuration():
         self._filename_last_motion = self.combine('filename_last_motion', group='motion_detector', default='{storage_path}/last_motion.jpg')
         # motion detector watch folder for files with detected objects (seconds)
         self.object_watch_delay = self.combine('object_watch_delay', group='motion_detector', default=0.5)
+        # max number of frames of the camera waiting for object detection results at the same time (in shared <watcher_pool>)
+        self.watcher_workers = self.combine('workers', group='motion_detector', default=4)
+        # max number of frames waiting for motion detection (and for object detection). If watcher is too slow, then the oldest frames are dropped
+        self.watcher_queue_size = self.combine('queue_size', group='motion_detector', default=16)
         # if there are too many motiondetection events without object detection, then start throttling of object detection
         self.object_throttling = self.combine('object_throttling', group='motion_detector', default=10)
         if self.object_throttling < 1:
             self.object_throttling = 1
+        # share of object detector time for this camera, relative to other cameras (frames of all cameras are scheduled by weighted round-robin)
+        self.object_detector_weight = self.combine('object_detector_weight', default=1)
         self.memory_remember_time = self.combine('remember_time', group='memory', default=300)
         # if two objects are shifted less than <move_threshold> value then it is the same objects (value in pixel)
         self.memory_move_threshold = self.combine('move_threshold', group='memory', default=20)
@@ -326,6 +454,15 @@ class recorder_configuration():
             kwargs['storage_path'] = self.storage_path()
         return self._filename_temp.format(**kwargs)
         
+    def filename_frame_buffer(self, **kwargs):
+        if self._filename_frame_buffer is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'temp_storage_path'not in kwargs:
+            kwargs['temp_storage_path'] = self.parent.temp_storage_path
+        return self._filename_frame_buffer.format(**kwargs)
+
     def filename_snapshot(self, **kwargs):
         if self._filename_snapshot is None:
             return None
@@ -348,6 +485,26 @@ class recorder_configuration():
             kwargs['storage_path'] = self.storage_path()
         return self._filename_video.format(**kwargs)
     
+    def filename_video_strftime(self, **kwargs):
+        """ {filename_video} as strftime pattern: {datetime:...} fields are left for strftime (i.e. ffmpeg segment muxer with -strftime 1),
+        '%' in the rest of the filename is escaped
+        """
+        if self._filename_video is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'storage_path' not in kwargs:
+            kwargs['storage_path'] = self.storage_path()
+        result = ''
+        for literal, field, spec, conversion in Formatter().parse(self._filename_video):
+            result += literal.replace('%', '%%')
+            if field == 'datetime':
+                result += spec or '%Y-%m-%d %H:%M:%S'
+            elif not field is None:
+                field = '{' + field + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}'
+                result += field.format(**kwargs).replace('%', '%%')
+        return result
+
     def cmd_ffmpeg_read(self, **kwargs):
         if self._cmd_ffmpeg_read is None:
             return None
@@ -374,6 +531,69 @@ class recorder_configuration():
             kwargs['filename'] = self.filename_video()
         return self._cmd_ffmpeg_write.format(**kwargs)
 
+    @property
+    def is_record_stream_copy(self):
+        return str(self.record_mode).lower() == 'copy'
+
+    @property
+    def is_record_event(self):
+        return str(self.record_mode).lower() == 'event'
+
+    def cmd_ffmpeg_packets(self, **kwargs):
+        if self._cmd_ffmpeg_packets is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        return self._cmd_ffmpeg_packets.format(**kwargs)
+
+    def cmd_ffmpeg_event_write(self, **kwargs):
+        if self._cmd_ffmpeg_event_write is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'datetime' not in kwargs:
+            kwargs['datetime'] = datetime.now()
+        if 'storage_path' not in kwargs:
+            kwargs['storage_path'] = self.storage_path()
+        if 'filename' not in kwargs:
+            kwargs['filename'] = self.filename_video()
+        return self._cmd_ffmpeg_event_write.format(**kwargs)
+
+    def cmd_ffmpeg_copy(self, **kwargs):
+        if self._cmd_ffmpeg_copy is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'datetime' not in kwargs:
+            kwargs['datetime'] = datetime.now()
+        if 'storage_path' not in kwargs:
+            kwargs['storage_path'] = self.storage_path()
+        if 'stream_url' not in kwargs:
+            kwargs['stream_url'] = self.stream_url()
+        if 'filename' not in kwargs:
+            kwargs['filename'] = self.filename_video()
+        return self._cmd_ffmpeg_copy.format(**kwargs)
+
+    def cmd_ffmpeg_copy_segments(self, **kwargs):
+        if self._cmd_ffmpeg_copy_segments is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'stream_url' not in kwargs:
+            kwargs['stream_url'] = self.stream_url()
+        if 'record_time' not in kwargs:
+            kwargs['record_time'] = self.record_time
+        return self._cmd_ffmpeg_copy_segments.format(**kwargs)
+
+    def cmd_ffmpeg_analysis(self, **kwargs):
+        if self._cmd_ffmpeg_analysis is None:
+            return None
+        if 'name' not in kwargs:
+            kwargs['name'] = self.name
+        if 'fps' not in kwargs:
+            kwargs['fps'] = self.analysis_stream_fps
+        return self._cmd_ffmpeg_analysis.format(**kwargs)
+
     def cmd_recorder_start(self, **kwargs):
         if self._cmd_recorder_start is None:
             return None
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
+import os
 import logging
 import sys
+import math
+import signal
 import cv2
 import json
 import subprocess as sp
@@ -45,12 +48,19 @@ def SelectObjectDetector(cnfg, logger_name='None'):
     else:
         logging.warning('Object detection is not defined. Skipping..')
 
-def get_frame_shape(source):
+def get_stream_info(source, timeout=None):
+    """ Returns dict(height, width, channels, codec) of the video stream, or None if it can't be opened during <timeout> seconds """
     ffprobe_cmd = f'ffprobe -v panic -show_error -show_streams -of json "{source}"'
     logging.debug(ffprobe_cmd)
-    p = sp.Popen(ffprobe_cmd, stdout=sp.PIPE, shell=True)
-    (output, err) = p.communicate()
-    p_status = p.wait()
+    p = sp.Popen(ffprobe_cmd, stdout=sp.PIPE, shell=True, start_new_session=True)
+    try:
+        (output, err) = p.communicate(timeout=timeout)
+    except sp.TimeoutExpired:
+        # kill the whole process group (shell and ffprobe)
+        os.killpg(p.pid, signal.SIGKILL)
+        p.communicate()
+        logging.warning(f'ffprobe timeout ({timeout} sec): {source}')
+        return None
     info = json.loads(output)
     logging.debug(info)
     if 'error' in info:
@@ -60,7 +70,7 @@ def get_frame_shape(source):
         video_info = [s for s in info['streams'] if s['codec_type'] == 'video'][0]
 
         if video_info['height'] != 0 and video_info['width'] != 0:
-            return (video_info['height'], video_info['width'], 3)
+            return {'height': video_info['height'], 'width': video_info['width'], 'channels': 3, 'codec': video_info.get('codec_name', '')}
         
         # fallback to using opencv if ffprobe didnt succeed
         try:
@@ -68,18 +78,28 @@ def get_frame_shape(source):
             ret, frame = video.read()
             frame_shape = frame.shape
             video.release()
-            return frame_shape
+            return {'height': frame_shape[0], 'width': frame_shape[1], 'channels': frame_shape[2], 'codec': video_info.get('codec_name', '')}
         except Exception as e:
             logging.warning(f'OpenCPV Can''t get frame shape: source= {source}')
             raise e
 
+def get_frame_shape(source, timeout=None):
+    info = get_stream_info(source, timeout)
+    if not info is None:
+        return (info['height'], info['width'], info['channels'])
+
 def check_topic(topic, value):
     return topic.lower().endswith(f"/{value}") or topic.lower().endswith(f"#")
 
-def ping_ip(ip):
+def ping_ip(ip, timeout=None):
     try:
-        sp.check_output(["ping", "-c", "1", ip])
+        if timeout is None:
+            sp.check_output(["ping", "-c", "1", ip])
+        else:
+            sp.check_output(["ping", "-c", "1", "-W", str(math.ceil(timeout)), ip], timeout=timeout+1)
         return True     
+    except sp.TimeoutExpired:
+        return False
     except OSError(12):
         logging.error(f'Cannot allocate memory: ping -c 1 {ip}')
         return False            
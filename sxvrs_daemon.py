@@ -29,6 +29,9 @@ import paho.mqtt.client as mqtt
 from subprocess import Popen, PIPE
 
 from cls.CameraThread import camera_create
+from cls.RecorderSupervisor import RecorderSupervisor
+from cls.CameraProbe import CameraProbe
+from cls.MotionPool import MotionPool
 from cls.config_reader import config_reader
 from cls.misc import check_topic
 from cls.RAM_Storage import RAM_Storage
@@ -171,11 +174,22 @@ if stored_exception==None:
     # create and start all instances from config
     cnt_instanse = 0
     watchers = []
+    # Start Object Detector (before cameras, as they submit frames directly into it)
+    object_detector = SelectObjectDetector(cnfg, logger_name = logger.name)
+    # recorder processes of all cameras are supervised by single asyncio event loop (optionally inside shared engine processes)
+    supervisor = RecorderSupervisor(cnfg, logger_name = logger.name)
+    supervisor.start()
+    # motion detection can run in worker processes (cameras are distributed between them)
+    motion_pool = None
+    if cnfg.is_motion_pool:
+        motion_pool = MotionPool(cnfg, logger_name = logger.name)
+        motion_pool.start()
+    # probe all cameras concurrently (cameras with cached stream info are started immediately, and revalidated in background)
+    probe = CameraProbe(cnfg, logger_name = logger.name)
+    probe.probe_all(configuration.stream_url() for configuration in cnfg.recorders.values())
     for recorder, configuration in cnfg.recorders.items():
-        camera_list.append(camera_create(recorder, cnfg_daemon=cnfg, cnfg_recorder=configuration, mqtt_client=mqtt_client))
+        camera_list.append(camera_create(recorder, cnfg_daemon=cnfg, cnfg_recorder=configuration, mqtt_client=mqtt_client, object_detector=object_detector, supervisor=supervisor, probe=probe, motion_pool=motion_pool))
         cnt_instanse += 1
-    # Start Object Detector
-    object_detector = SelectObjectDetector(cnfg, logger_name = logger.name)
     # Start HTTP web server
     if cnfg.is_http_server and (start_with_http_server or cnfg.http_server_autostart):
         Popen(cnfg.cmd_http_server(), shell=True)
@@ -194,6 +208,10 @@ if stored_exception==None:
     for camera in camera_list:
         camera.stop()
         logger.debug(f"   stoping instance: {camera.name}")
+    supervisor.stop(timeout=30)
+    if not motion_pool is None:
+        motion_pool.stop(timeout=10)
+    probe.stop()
     mqtt_client.loop_stop()
     mqtt_client.disconnect()
     if not object_detector is None:
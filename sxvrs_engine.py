@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""     SXVRS Recorder Engine
+This script runs recorders of several cameras in one process, so python modules and configuration are loaded only once
+(instead of separate sxvrs_recorder.py process for each camera). Frames are still decoded by ffmpeg subprocesses.
+It is started and controlled by the daemon (see <recorder_engine> config group) thru stdin/stdout, one JSON message per line.
+Each message has "name" of the recorder, other fields are the same as for sxvrs_recorder.py (see cls/ControlChannel.py), and:
+    {"cmd": "start", "name": ..., "mode": "record"|"snapshot", "frame_shape": [height, width, channels]}
+    {"cmd": "stop", "name": ...}      - stop recorder gracefully
+    {"cmd": "kill", "name": ...}      - stop recorder, killing its reader process
+    {"event": "exit", "name": ..., "code": ...}   - recorder is finished
+Log output is written to stderr.
+Engine is finished, when stdin is closed and all recorders are stopped
+
+Dependencies:
+     ffmpeg
+
+Starting parameters:
+    > python sxvrs_engine.py -i <engine_index>
+
+"""
+
+__author__      = "Rustem Sharipov"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+__version__     = "0.2.0"
+__maintainer__  = "Rustem Sharipov"
+__email__       = "zebatus@gmail.com"
+__status__      = "Development"
+
+import os, sys, logging
+import argparse
+from datetime import datetime
+import signal
+from threading import Thread, Lock
+
+# stdout is used for communication with the daemon, so everything else (logs, ffmpeg output) is redirected to stderr
+_protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'wb', buffering=0)
+os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+sys.stdout = sys.stderr
+
+from cls.config_reader import config_reader
+from cls.CameraRecorder import CameraRecorder
+from cls.ControlChannel import ControlChannel, decode_message
+
+# Get command line arguments
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument('-i','--index', help='Index of the engine process (used in log filename)', required=False, default=0)
+args = arg_parser.parse_args()
+
+# Get running script name
+script_path, script_name = os.path.split(os.path.splitext(__file__)[0])
+dt_start = datetime.now()
+
+# Load configuration files (once for all cameras)
+cnfg_daemon = config_reader(
+        os.path.join('cnfg' ,'sxvrs.yaml'),
+        log_filename = f'recorder_engine_{args.index}'
+    )
+logger = logging.getLogger(f"{script_name}:{args.index}")
+logger.debug(f"> Start on: '{dt_start}'")
+
+_protocol_lock = Lock()
+
+recorders = {} # running recorders: {name: CameraRecorder}
+recorders_lock = Lock()
+
+def run_recorder(recorder):
+    """ Run recorder in separate thread and report exit code """
+    exit_code = 0
+    try:
+        exit_code = recorder.run()
+    except:
+        logger.exception(f"Recorder failed: {recorder.name}")
+        exit_code = 1
+    finally:
+        with recorders_lock:
+            if recorders.get(recorder.name) is recorder:
+                del recorders[recorder.name]
+        recorder.channel.send_event('exit', code=exit_code)
+
+def handle_command(msg):
+    name = msg.get('name')
+    cmd = msg.get('cmd')
+    if name is None:
+        return
+    with recorders_lock:
+        recorder = recorders.get(name)
+    if cmd == 'start':
+        if not recorder is None:
+            logger.warning(f"Recorder '{name}' is already running")
+            return
+        channel = ControlChannel(_protocol, lock=_protocol_lock, name=name)
+        try:
+            recorder = CameraRecorder(cnfg_daemon, name, frame_shape=tuple(msg.get('frame_shape', (None, None, 3))),
+                        snapshot_mode=msg.get('mode') == 'snapshot', channel=channel, logger_name=script_name)
+        except:
+            logger.exception(f"Can't create recorder: {name}")
+            channel.send_event('exit', code=1)
+            return
+        with recorders_lock:
+            recorders[name] = recorder
+        Thread(target=run_recorder, args=(recorder,), name=f'recorder:{name}').start()
+    elif recorder is None:
+        logger.debug(f"Recorder '{name}' is not running: {msg}")
+    elif cmd == 'stop':
+        recorder.stop()
+    elif cmd == 'kill':
+        recorder.kill()
+    else:
+        recorder.command(msg)
+
+def stop_all():
+    with recorders_lock:
+        running = list(recorders.values())
+    for recorder in running:
+        recorder.stop()
+
+# correct termination on signal receive
+def signal_handler(sig, frame):
+    logger.info('[CTRL+C detected] stopping all recorders')
+    stop_all()
+signal.signal(signal.SIGINT, signal_handler)
+
+for line in sys.stdin:
+    try:
+        msg = decode_message(line)
+        if msg is None:
+            logger.debug(f"Wrong command: {line.strip()}")
+            continue
+        handle_command(msg)
+    except:
+        logger.exception(f"Can't handle command: {line.strip()}")
+# daemon is finished: stop all recorders and wait for them
+stop_all()
+dt_end = datetime.now()
+logger.debug(f"> Finish on: '{dt_end}'")
@@ -19,7 +19,7 @@ import os, sys, logging
 import yaml
 import json
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt
 import html
 import io
@@ -33,6 +33,7 @@ import glob
 
 from cls.config_reader import config_reader
 from cls.misc import check_topic, Recorder
+from cls.VideoIndex import find_objects
 
 # Get running script name
 script_path, script_name = os.path.split(os.path.splitext(__file__)[0])
@@ -389,6 +390,22 @@ def view_recorder_log(recorder_name, log_name='daemon', log_len=500, log_start=0
         log_data = f'Error loading log file: {log_file}'
     return render_template('view_log.html', log_data=log_data)
 
+@app.route('/recorder/<recorder_name>/objects/<date>')
+@app.route('/recorder/<recorder_name>/objects/<date>/<class_name>')
+def recorder_objects(recorder_name, date, class_name=None):
+    """Function will return detected objects (with video file and position in it) for given recorder and date (YYYY-MM-DD)"""
+    try:
+        dt = datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return make_response(f'Wrong date: {date}', 400)
+    if not recorder_name in cnfg.recorders:
+        return make_response(f'Unknown recorder: {recorder_name}', 404)
+    video_path = os.path.dirname(os.path.abspath(cnfg.recorders[recorder_name].filename_video(datetime=dt)))
+    # folder can contain recordings of other days (i.e. if filename template is not split by date)
+    objects = find_objects(glob.glob(video_path + "/*.idx"), class_name=class_name,
+                    time_from=dt.timestamp(), time_to=(dt + timedelta(days=1)).timestamp())
+    return make_response(json.dumps(objects), 200, {'Content-Type': 'application/json'})
+
 @app.route('/recorder/<recorder_name>/record/start')
 def recorder_start(recorder_name):
     mqtt_client.publish(mqtt_topic_pub.format(source_name=recorder_name), json.dumps({'cmd':'record_start'}))
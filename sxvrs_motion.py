@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""     SXVRS Motion Detection Worker
+This script runs motion detection for its share of cameras outside of the daemon process, so motion analysis is not limited
+by one core (GIL of the daemon). It keeps motion detector state of each camera, and frames are processed in order of requests.
+It is started and controlled by the daemon (see <motion_pool> config group) thru stdin/stdout, one JSON message per line.
+Frames are not passed thru the pipe: worker reads them from RAM folder or from shared memory frame buffer of the recorder.
+    {"cmd": "detect", "id": ..., "name": ..., "filename": ...}      - compare image file with the background of the camera
+    {"cmd": "detect", "id": ..., "name": ..., "frame_buffer": ..., "slot": ..., "frame_num": ..., "timestamp": ...}
+                                                                    - compare frame from the frame buffer
+                                                                      (detect message can have "frame_shape": [height, width] of the camera stream)
+    {"cmd": "reset", "name": ...}                                   - forget motion detector state of the camera
+    {"id": ..., "result": true|false|null, "score": ...}            - result of detection (or {"id": ..., "error": ...})
+Log output is written to stderr.
+Worker is finished, when stdin is closed
+
+Starting parameters:
+    > python sxvrs_motion.py -i <worker_index>
+
+"""
+
+__author__      = "Rustem Sharipov"
+__copyright__   = "Copyright 2020"
+__license__     = "GPL"
+__version__     = "0.2.0"
+__maintainer__  = "Rustem Sharipov"
+__email__       = "zebatus@gmail.com"
+__status__      = "Development"
+
+import os, sys, logging
+import argparse
+from datetime import datetime
+import signal
+
+# stdout is used for communication with the daemon, so everything else is redirected to stderr
+_protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'wb', buffering=0)
+os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+sys.stdout = sys.stderr
+
+from cls.config_reader import config_reader
+from cls.MotionDetector import MotionDetector
+from cls.FrameBuffer import FrameBuffer
+from cls.ControlChannel import ControlChannel, decode_message
+
+# Get command line arguments
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument('-i','--index', help='Index of the worker process (used in log filename)', required=False, default=0)
+args = arg_parser.parse_args()
+
+# Get running script name
+script_path, script_name = os.path.split(os.path.splitext(__file__)[0])
+dt_start = datetime.now()
+
+# Load configuration files (once for all cameras)
+cnfg_daemon = config_reader(
+        os.path.join('cnfg' ,'sxvrs.yaml'),
+        log_filename = f'motion_pool_{args.index}'
+    )
+logger = logging.getLogger(f"{script_name}:{args.index}")
+logger.debug(f"> Start on: '{dt_start}'")
+
+# worker is stopped by the daemon (by closing stdin), not by CTRL+C sent to the whole process group
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+channel = ControlChannel(_protocol)
+detectors = {} # {camera: MotionDetector}
+frame_buffers = {} # {filename: FrameBuffer}
+
+def get_frame(msg):
+    """ Returns frame from the frame buffer (or None if it is already overwritten by recorder) """
+    filename = msg['frame_buffer']
+    frame_buffer = frame_buffers.get(filename)
+    if frame_buffer is None or not frame_buffer.is_current():
+        if not frame_buffer is None:
+            frame_buffer.close()
+        frame_buffer = FrameBuffer(filename, logger_name=script_name)
+        frame_buffers[filename] = frame_buffer
+    return frame_buffer.get_frame(msg['slot'], msg['frame_num'])
+
+def detect(msg):
+    name = msg['name']
+    detector = detectors.get(name)
+    if detector is None:
+        detector = MotionDetector(cnfg_daemon.recorders[name], frame_shape=msg.get('frame_shape'), logger_name=name)
+        detectors[name] = detector
+    if 'frame_buffer' in msg:
+        frame = get_frame(msg)
+        result = None if frame is None else detector.detect_frame(frame, msg.get('timestamp'))
+    else:
+        result = detector.detect(msg['filename'])
+    return {'result': None if result is None else bool(result), 'score': float(detector.score)}
+
+for line in sys.stdin:
+    msg = decode_message(line)
+    if msg is None:
+        logger.debug(f"Wrong command: {line.strip()}")
+        continue
+    cmd = msg.get('cmd')
+    if cmd == 'reset':
+        detectors.pop(msg.get('name'), None)
+    elif cmd == 'detect':
+        try:
+            response = detect(msg)
+        except Exception as ex:
+            logger.exception(f"Motion detection failed: {line.strip()}")
+            response = {'error': repr(ex)}
+        channel.send({'id': msg.get('id'), **response})
+    else:
+        logger.debug(f"Unknown command: {line.strip()}")
+for frame_buffer in frame_buffers.values():
+    frame_buffer.close()
+dt_end = datetime.now()
+logger.debug(f"> Finish on: '{dt_end}'")